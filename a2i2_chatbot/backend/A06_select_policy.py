@@ -19,8 +19,11 @@ import torch.nn.functional as F
 import numpy as np
 import json
 import argparse
+import threading
+import time
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
+
+from encoder_registry import get_encoder
 
 # --------------------------------------------------------------------
 # Paths
@@ -113,8 +116,8 @@ class IQLPolicySelector:
         print(f"[INFO] Loaded {self.num_actions} operator embeddings from {PROTOTYPES_FILE}")
         print(f"[INFO] Operator policies: {self.policy_names}")
 
-        # Load sentence transformer for state embeddings
-        self.embed_model = SentenceTransformer(EMBED_MODEL)
+        # Load sentence transformer for state embeddings (shared with other modules in this process)
+        self.embed_model = get_encoder(EMBED_MODEL)
 
         # Determine model path based on mode
         self.model_path = SELECTOR_DIR / f"iql_model_{mode}.pt"
@@ -164,6 +167,130 @@ class IQLPolicySelector:
 
         return best_policy, q_dict
 
+    # ----------------------------------------------------------------
+    def select_policy_batch(self, histories):
+        """
+        Select policies for many conversations at once: one SBERT encode over every
+        conversation's last-N resident lines and one Q-network forward for all states.
+        Returns a list of (best_policy, q_dict) in the order of `histories`.
+        """
+        if not histories:
+            return []
+
+        # Flatten the last-N resident lines of every history, remembering each span
+        texts, spans = [], []
+        for history in histories:
+            res_texts = [h["text"] for h in history if h["role"] == "resident"]
+            last_n = res_texts[-self.n_last :] if res_texts else []
+            spans.append((len(texts), len(texts) + len(last_n)))
+            texts.extend(last_n)
+
+        dim = self.embed_model.get_sentence_embedding_dimension()
+        embs = (
+            self.embed_model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+            if texts else np.zeros((0, dim), dtype=np.float32)
+        )
+        # Same state as embed_state(): mean of the normalized embeddings (zeros if no resident line)
+        states = np.stack([
+            embs[start:end].mean(axis=0) if end > start else np.zeros(dim, dtype=np.float32)
+            for start, end in spans
+        ]).astype(np.float32)
+        return self.select_policy_from_states(states)
+
+    def select_policy_from_states(self, states):
+        """
+        Score precomputed state vectors (B, state_dim) in one Q-network forward.
+        Used directly by the lockstep simulator, which caches resident embeddings.
+        """
+        state_tensor = torch.tensor(np.asarray(states, dtype=np.float32), dtype=torch.float32, device=self.device)
+
+        with torch.no_grad():
+            if self.mode == "embed":
+                # Pair every state with every action: (B*A, D) states against (B*A,) action ids
+                batch = state_tensor.shape[0]
+                s = state_tensor.repeat_interleave(self.num_actions, dim=0)
+                a = torch.arange(self.num_actions, device=self.device).repeat(batch)
+                q_matrix = self.qnet(s, a).view(batch, self.num_actions)
+            else:
+                q_matrix = self.qnet(state_tensor)
+        q_matrix = q_matrix.cpu().numpy()
+
+        results = []
+        for q_values in q_matrix:
+            best_idx = int(np.argmax(q_values))
+            results.append((self.policy_names[best_idx], dict(zip(self.policy_names, q_values.tolist()))))
+        return results
+
+
+# --------------------------------------------------------------------
+# Batching front-end for concurrent simulations
+# --------------------------------------------------------------------
+class CoalescingPolicySelector:
+    """
+    Thread-safe wrapper around IQLPolicySelector for concurrent simulations.
+
+    Each worker thread calls select_policy(history) as usual; calls that arrive
+    within `max_wait_s` of each other are merged into one select_policy_batch()
+    call on a background thread, so N live conversations cost one encode and
+    one Q-network forward per step instead of N.
+    """
+    def __init__(self, selector, max_batch=64, max_wait_s=0.02):
+        self.selector = selector
+        self.policy_names = selector.policy_names
+        self.max_batch = max(1, max_batch)
+        self.max_wait_s = max_wait_s
+        self.batches = 0
+        self.requests = 0
+        self._cond = threading.Condition()
+        self._pending = []
+        self._worker = threading.Thread(target=self._run, name="iql-coalescer", daemon=True)
+        self._worker.start()
+
+    def select_policy(self, history):
+        slot = {"history": history, "done": threading.Event(), "result": None, "error": None}
+        with self._cond:
+            self._pending.append(slot)
+            self._cond.notify()
+        slot["done"].wait()
+        if slot["error"] is not None:
+            raise slot["error"]
+        return slot["result"]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Give other workers a short window to join this batch
+                deadline = time.monotonic() + self.max_wait_s
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                self._pending = self._pending[self.max_batch:]
+
+            try:
+                results = self.selector.select_policy_batch([slot["history"] for slot in batch])
+                for slot, result in zip(batch, results):
+                    slot["result"] = result
+            except Exception as e:
+                for slot in batch:
+                    slot["error"] = e
+            finally:
+                self.batches += 1
+                self.requests += len(batch)
+                for slot in batch:
+                    slot["done"].set()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+        }
+
 # --------------------------------------------------------------------
 # Example usage
 # --------------------------------------------------------------------
@@ -9,29 +9,35 @@ Single-run simulator:
   • Optional seed operator line
   • Alternating turns with early stop check (decision.py)
   • Returns a rich result dict consumed by A08
+  • simulate_conversations_lockstep(): advances many conversations turn by turn
+    with one batched encode / Q forward / retrieval matmul per step
 
 This file is /dataA-aware and returns full `history` for A08.
 """
 
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 from typing import List, Dict, Optional
 
+import httpx
+import numpy as np
 import requests
 from requests import RequestException
+from requests.adapters import HTTPAdapter
 
 from A06_select_policy import IQLPolicySelector
 from A06c_generate_operator_reply_pairs import retrieve_topk_pairs
 from decision import is_successful_session
+from ollama_client import OllamaError, ollama_generate
 from personas import PERSONA
 # --------------------------------------------------------------------
 # CONFIG (adjust if needed)
 # --------------------------------------------------------------------
 MAVIS_URL = "http://localhost:8001/chat"         # FastAPI backend for resident replies
-OLLAMA_URL = "http://localhost:11434/api/generate"
-OLLAMA_MODEL = "llama3"
+OLLAMA_MODEL = "llama3"                          # served from OLLAMA_HOST (ollama_client.py)
 
 RUN_ID = datetime.now().strftime("%Y%m%d_%H%M%S")
 MAX_TURNS = 16        # total turns (operator+resident entries) cap
@@ -39,30 +45,28 @@ K_EXAMPLES = 2        # ICL few-shots per operator turn
 N_LAST_RESIDENT = 3   # used inside IQL selector (already configured there)
 
 DATAA = Path(__file__).resolve().parent / "dataA"
+POLICY_INDEX_DIR = Path(__file__).resolve().parent / "indexes" / "policies"
 RUN_DIR = DATAA / "runs" / f"run_{RUN_ID}"
 RUN_DIR.mkdir(parents=True, exist_ok=True)
 
+# One keep-alive pool shared by every conversation (A08 runs many concurrently);
+# Ollama calls go through ollama_client's pool, capped at OLLAMA_NUM_PARALLEL
+HTTP = requests.Session()
+HTTP.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=64))
+HTTP.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=64))
+
 # --------------------------------------------------------------------
 # UTILITIES
 # --------------------------------------------------------------------
 def call_ollama(prompt: str, model: str = OLLAMA_MODEL, temperature: float = 0.7, max_tokens: int = 128) -> str:
-    """Call Ollama local API; return text or a safe fallback."""
+    """Call Ollama through the shared keep-alive client; return text or a safe fallback."""
     try:
-        r = requests.post(
-            OLLAMA_URL,
-            json={"model": model, "prompt": prompt, "stream": False},
-            timeout=90,
-        )
-        r.raise_for_status()
-        obj = r.json()
-        return (obj.get("response") or "").strip()
-    except RequestException as e:
+        return ollama_generate(prompt, model=model, temperature=temperature, max_tokens=max_tokens)
+    except (httpx.HTTPError, OllamaError, ValueError) as e:
         print(f"[ERR] Ollama call failed: {e}")
-        try:
+        if isinstance(e, httpx.HTTPStatusError):
             # Some servers include response body with details
-            print("[DETAIL]", r.text)  # noqa: F821 (r may not exist if early failure)
-        except Exception:
-            pass
+            print("[DETAIL]", e.response.text)
         # Short, safe fallback (1 sentence)
         return "Please evacuate immediately; conditions can worsen quickly."
 
@@ -90,7 +94,7 @@ def call_mavis_api(history: List[Dict[str, str]],
     }
 
     try:
-        r = requests.post(MAVIS_URL, json=payload, timeout=timeout_s)
+        r = HTTP.post(MAVIS_URL, json=payload, timeout=timeout_s)
         r.raise_for_status()
         obj = r.json()
         return (obj.get("text") or "").strip()
@@ -232,16 +236,25 @@ def simulate_conversation(resident_name: str = "ross",
                           temperature_op: float = 0.5,
                           temperature_res: float = 0.8,
                           max_tokens_op: int = 64,
-                          max_tokens_res: int = 128) -> Dict:
+                          max_tokens_res: int = 128,
+                          selector=None,
+                          turn_delay: float = 0.8,
+                          out_file: Optional[Path] = None,
+                          verbose: bool = True) -> Dict:
     """
     Run one conversation.
 
     If `seed_text` is provided, we start with an OPERATOR turn using that seed,
     then the next turn is RESIDENT. If not provided, we start with a RESIDENT
     opener ("Hello? Who is this?") and the next turn is OPERATOR.
+
+    Batch drivers (A08) pass a shared `selector` so SBERT and the Q-network are
+    loaded once, `turn_delay=0` to drop the per-turn pause, and a unique `out_file`.
     """
-    print("[INFO] Initializing IQL selector (first load may download SBERT)…")
-    selector = IQLPolicySelector()
+    log = print if verbose else (lambda *a, **k: None)
+    if selector is None:
+        print("[INFO] Initializing IQL selector (first load may download SBERT)…")
+        selector = IQLPolicySelector()
 
     # Seed history and who speaks next
     history: List[Dict[str, str]] = []
@@ -252,9 +265,9 @@ def simulate_conversation(resident_name: str = "ross",
         history.append({"role": "resident", "text": "Hello? Who is this?"})
         operator_next = True    # resident spoke → operator goes next
 
-    print(f"\n[START] Conversation Run: {RUN_ID}")
-    print(f"Resident persona: {resident_name}")
-    print("=" * 60)
+    log(f"\n[START] Conversation Run: {RUN_ID}")
+    log(f"Resident persona: {resident_name}")
+    log("=" * 60)
 
     # loop
     for turn_idx in range(1, MAX_TURNS + 1):
@@ -275,7 +288,7 @@ def simulate_conversation(resident_name: str = "ross",
                     break
 
             retrieved = retrieve_topk_pairs(best_policy, last_res, k=K_EXAMPLES)
-            print(f"[TURN {turn_idx}] Policy: {best_policy}, "
+            log(f"[TURN {turn_idx}] Policy: {best_policy}, "
                   f"Q-values: {{ {', '.join(f'{k}: {round(v,3)}' for k,v in qvals.items())} }}")
 
             prompt = build_prompt(best_policy, history, retrieved, PERSONA)
@@ -287,7 +300,7 @@ def simulate_conversation(resident_name: str = "ross",
                 "selected_policy": best_policy,
                 "examples_used": retrieved
             })
-            print(f"Operator ({best_policy}): {op_reply}\n")
+            log(f"Operator ({best_policy}): {op_reply}\n")
 
             operator_next = False
             continue
@@ -301,7 +314,7 @@ def simulate_conversation(resident_name: str = "ross",
             timeout_s=30
         )
         history.append({"role": "resident", "text": res_reply})
-        print(f"Resident: {res_reply}\n")
+        log(f"Resident: {res_reply}\n")
 
         # Early-stop check after resident turn
         # ------------------ DECISION CHECK ------------------
@@ -314,31 +327,38 @@ def simulate_conversation(resident_name: str = "ross",
         )
 
         if decision is True:
-            print("[✓] Resident agreed to evacuate — conversation successful.")
+            log("[✓] Resident agreed to evacuate — conversation successful.")
             if closing_msg:
                 history.append({"role": "operator", "text": closing_msg})
-                print(f"Operator (closing): {closing_msg}\n")
+                log(f"Operator (closing): {closing_msg}\n")
             break
         elif decision is False:
-            print("[✗] Resident repeatedly refused evacuation — marking as failed.")
+            log("[✗] Resident repeatedly refused evacuation — marking as failed.")
             break
 
 
         operator_next = True
-        time.sleep(0.8)
+        if turn_delay > 0:
+            time.sleep(turn_delay)
 
+    if out_file is None:
+        out_file = RUN_DIR / f"dialogue_{resident_name}_{RUN_ID}.jsonl"
+    return finish_conversation(history, out_file, log)
+
+
+def finish_conversation(history: List[Dict], out_file: Path, log=print) -> Dict:
+    """Persist a finished conversation to JSONL and build the rich result dict consumed by A08."""
     # Persist conversation to JSONL
-    out_file = RUN_DIR / f"dialogue_{resident_name}_{RUN_ID}.jsonl"
     with out_file.open("w", encoding="utf-8") as f:
         for t in history:
             f.write(json.dumps(t, ensure_ascii=False) + "\n")
-    print(f"[OK] Saved to {out_file}")
+    log(f"[OK] Saved to {out_file}")
 
     # Build rich return for A08
     decision_final, closing_final = is_successful_session(history)
     success = bool(decision_final)
     status = "SUCCESS" if success else "FAILURE"
-    print(f"[FINAL STATUS] {status}")
+    log(f"[FINAL STATUS] {status}")
 
     if closing_final and success:
         history.append({"role": "operator", "text": closing_final})
@@ -351,6 +371,228 @@ def simulate_conversation(resident_name: str = "ross",
         "history": history,
     }
 
+
+# --------------------------------------------------------------------
+# LOCKSTEP BATCH SIMULATION
+# --------------------------------------------------------------------
+class BatchPairRetriever:
+    """
+    In-policy example retrieval for many queries at once.
+
+    All policies' operator-line embeddings are stacked into one matrix, so a step's
+    retrieval is a single (N, D) @ (D, M) matmul; each row is then restricted to the
+    slice of its selected policy before taking the top-k.
+    """
+    def __init__(self, policy_names: List[str], index_dir: Path = POLICY_INDEX_DIR):
+        self.pairs: List[Dict] = []
+        self.slices: Dict[str, slice] = {}
+        mats = []
+        for policy in policy_names:
+            pairs_path = index_dir / f"{policy}_pairs.json"
+            embeds_path = index_dir / f"{policy}_op_embeds.npy"
+            if not pairs_path.exists() or not embeds_path.exists():
+                print(f"[WARN] Missing retrieval index for policy '{policy}' in {index_dir}")
+                continue
+            pairs = json.loads(pairs_path.read_text(encoding="utf-8"))
+            embeds = np.load(embeds_path).astype(np.float32)
+            if len(pairs) != embeds.shape[0]:
+                raise RuntimeError(f"Pairs/embeds length mismatch for {policy}")
+            self.slices[policy] = slice(len(self.pairs), len(self.pairs) + len(pairs))
+            self.pairs.extend(pairs)
+            mats.append(embeds)
+        self.matrix = np.concatenate(mats, axis=0) if mats else np.zeros((0, 0), dtype=np.float32)
+
+    def retrieve_batch(self, policies: List[str], query_vecs: np.ndarray, k: int = K_EXAMPLES) -> List[List[Dict]]:
+        if not len(policies) or self.matrix.size == 0:
+            return [[] for _ in policies]
+        sims = query_vecs @ self.matrix.T  # one matmul for every conversation in the step
+        out = []
+        for row, policy in zip(sims, policies):
+            sl = self.slices.get(policy)
+            if sl is None:
+                out.append([])
+                continue
+            local = row[sl]
+            top = np.argsort(-local)[:k]
+            out.append([
+                {
+                    "resident": (self.pairs[sl.start + ix].get("resident_text") or "").strip(),
+                    "operator": (self.pairs[sl.start + ix].get("operator_text") or "").strip(),
+                }
+                for ix in top
+            ])
+        return out
+
+
+class _LockstepConversation:
+    """Per-conversation state for simulate_conversations_lockstep"""
+    def __init__(self, resident_name: str, seed_text: Optional[str], out_file: Path):
+        self.resident_name = resident_name
+        self.out_file = out_file
+        self.history: List[Dict] = []
+        self.res_embs: List[np.ndarray] = []  # cached embedding of every resident line so far
+        self.done = False
+        self.error: Optional[str] = None      # set when one of this conversation's calls failed
+        if seed_text and seed_text.strip():
+            self.history.append({"role": "operator", "text": seed_text.strip()})
+            self.operator_next = False
+        else:
+            self.history.append({"role": "resident", "text": "Hello? Who is this?"})
+            self.operator_next = True
+
+    def resident_texts(self) -> List[str]:
+        return [h["text"] for h in self.history if h.get("role") == "resident"]
+
+    def fail(self, stage: str, exc: Exception):
+        """Drop this conversation from the group; the others keep going"""
+        self.error = f"{stage}: {exc}"
+        self.done = True
+        print(f"[ERR] Lockstep {self.resident_name} ({self.out_file.name}) failed at {self.error}")
+
+
+def simulate_conversations_lockstep(jobs: List[Dict],
+                                    selector,
+                                    retriever: Optional[BatchPairRetriever] = None,
+                                    io_workers: int = 16,
+                                    temperature_op: float = 0.5,
+                                    temperature_res: float = 0.8,
+                                    max_tokens_op: int = 64,
+                                    max_tokens_res: int = 128,
+                                    turn_delay: float = 0.0,
+                                    encode_batch_size: int = 64) -> List[Dict]:
+    """
+    Advance many conversations one turn at a time.
+
+    `jobs` are dicts with resident_name, seed_text and out_file. Each step does:
+      • one SBERT encode for all resident lines added since the previous step
+      • one Q-network forward over every conversation whose operator speaks next
+      • one retrieval matmul for those conversations
+    while the Ollama/Mavis calls of the step run concurrently on `io_workers` threads
+    (Ollama calls additionally capped at OLLAMA_NUM_PARALLEL by ollama_client).
+    New resident lines are encoded in chunks of `encode_batch_size`; `turn_delay`
+    pauses between steps, as simulate_conversation pauses between turns.
+    Returns the same result dicts as simulate_conversation, in job order; a
+    conversation whose call failed is dropped from the group and returns
+    {"error": ...} instead.
+    """
+    if retriever is None:
+        retriever = BatchPairRetriever(selector.policy_names)
+    convs = [_LockstepConversation(j["resident_name"], j.get("seed_text"), Path(j["out_file"])) for j in jobs]
+    dim = selector.embed_model.get_sentence_embedding_dimension()
+
+    with ThreadPoolExecutor(max_workers=max(1, io_workers)) as pool:
+        for turn_idx in range(1, MAX_TURNS + 1):
+            active = [c for c in convs if not c.done]
+            if not active:
+                break
+
+            # ---------- OPERATOR TURNS (batched model work) ----------
+            op_convs = []
+            for c in active:
+                if not c.operator_next:
+                    continue
+                if not c.resident_texts():
+                    c.operator_next = False  # no resident line yet → resident speaks first
+                    continue
+                op_convs.append(c)
+
+            op_futures = []
+            if op_convs:
+                # Embed only resident lines not seen before, across every conversation
+                new_texts, owners = [], []
+                for c in op_convs:
+                    for text in c.resident_texts()[len(c.res_embs):]:
+                        new_texts.append(text)
+                        owners.append(c)
+                if new_texts:
+                    embs = selector.embed_model.encode(
+                        new_texts, convert_to_numpy=True, normalize_embeddings=True,
+                        show_progress_bar=False, batch_size=encode_batch_size,
+                    ).astype(np.float32)
+                    for c, emb in zip(owners, embs):
+                        c.res_embs.append(emb)
+
+                states = np.stack([
+                    np.mean(c.res_embs[-selector.n_last:], axis=0) if c.res_embs else np.zeros(dim, dtype=np.float32)
+                    for c in op_convs
+                ]).astype(np.float32)
+                choices = selector.select_policy_from_states(states)
+
+                # Retrieval query = latest resident line, whose embedding is already cached
+                queries = np.stack([c.res_embs[-1] for c in op_convs])
+                retrieved = retriever.retrieve_batch([p for p, _ in choices], queries, k=K_EXAMPLES)
+
+                for c, (best_policy, _), examples in zip(op_convs, choices, retrieved):
+                    try:
+                        prompt = build_prompt(best_policy, c.history, examples, PERSONA)
+                    except Exception as e:
+                        c.fail("operator prompt", e)
+                        continue
+                    fut = pool.submit(call_ollama, prompt, OLLAMA_MODEL, temperature_op, max_tokens_op)
+                    op_futures.append((c, best_policy, examples, fut))
+
+            # ---------- RESIDENT TURNS ----------
+            res_futures = []
+            for c in active:
+                if c.operator_next:
+                    continue
+                fut = pool.submit(call_mavis_api, list(c.history), c.resident_name,
+                                  temperature_res, max_tokens_res, 30)
+                res_futures.append((c, fut))
+
+            # ---------- APPLY RESULTS ----------
+            for c, best_policy, examples, fut in op_futures:
+                try:
+                    text = fut.result()
+                except Exception as e:
+                    c.fail("operator turn", e)
+                    continue
+                c.history.append({
+                    "role": "operator",
+                    "text": text,
+                    "selected_policy": best_policy,
+                    "examples_used": examples
+                })
+                c.operator_next = False
+
+            for c, fut in res_futures:
+                try:
+                    c.history.append({"role": "resident", "text": fut.result()})
+                    decision, closing_msg = is_successful_session(
+                        conversation=c.history,
+                        min_turns=4,
+                        tail_window=3,
+                        max_turns=MAX_TURNS,
+                        allow_early_stop=True
+                    )
+                except Exception as e:
+                    c.fail("resident turn", e)
+                    continue
+                if decision is True:
+                    if closing_msg:
+                        c.history.append({"role": "operator", "text": closing_msg})
+                    c.done = True
+                elif decision is False:
+                    c.done = True
+                else:
+                    c.operator_next = True
+
+            print(f"[LOCKSTEP] Turn {turn_idx}: {len(op_futures)} operator / {len(res_futures)} resident turns, "
+                  f"{sum(not c.done for c in convs)} conversations still active")
+            if turn_delay > 0:
+                time.sleep(turn_delay)
+
+    results = []
+    for c in convs:
+        if c.error is None:
+            try:
+                results.append(finish_conversation(c.history, c.out_file, log=lambda *a, **k: None))
+                continue
+            except Exception as e:
+                c.fail("save", e)
+        results.append({"error": c.error})
+    return results
+
 # --------------------------------------------------------------------
 if __name__ == "__main__":
     # Run a quick local test with a seed operator line
@@ -6,26 +6,43 @@ Batch driver for A-pipeline:
   • Starts each conversation from hard-coded operator seed utterances.
   • Runs across one or more resident personas (ross, michelle, bob, lindsay, niki, …).
   • Uses the IQL + ICL conversation loop from A07_simulate_with_iql_and_mavis.py.
+  • Loads SBERT + the Q-network once and runs conversations concurrently
+    (--workers), batching policy selection across all live conversations.
   • Saves:
       – One JSON file per conversation (with turn-wise operator policy + success flag)
-      – A master summary JSON for the batch
+      – master_index.jsonl, appended as each conversation finishes
+      – A master summary JSON + CSV for the batch
+
+--lockstep advances up to --lockstep_size conversations together, one turn per
+step, with a single batched encode, Q-network forward and retrieval matmul per step.
+
+A partial run can be resumed: conversations whose JSON already exists are skipped.
+
+Run example:
+  python3 A08_simulate_from_seeds.py --residents ross,michelle,bob,lindsay,niki \
+      --num_conversations 10 --num_reps 20 --run_id sweep1 --workers 16
+  python3 A08_simulate_from_seeds.py ... --run_id sweep1 --resume
+  python3 A08_simulate_from_seeds.py ... --run_id sweep2 --lockstep --lockstep_size 128
 """
 
 import argparse
 import json
 import csv
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
 from pathlib import Path
-from importlib.machinery import SourceFileLoader
 
-from personas import PERSONA
+from A06_select_policy import IQLPolicySelector, CoalescingPolicySelector
+from A07_simulate_with_iql_and_mavis import (
+    simulate_conversation,
+    simulate_conversations_lockstep,
+    BatchPairRetriever,
+)
 
-# --------------------------------------------------------------------
-# Import simulator from A07
-# --------------------------------------------------------------------
-SIM_FILE = Path("/Users/mousumi/A2I2_RAG/cross_policy/A07_simulate_with_iql_and_mavis.py")
-sim = SourceFileLoader("sim_module", str(SIM_FILE)).load_module()
-simulate_conversation = sim.simulate_conversation
+BASE_DIR = Path(__file__).resolve().parent
+SEED_RUNS_DIR = BASE_DIR / "dataA" / "runs" / "seed_runs"
 
 # --------------------------------------------------------------------
 # Seed operator openers
@@ -43,6 +60,87 @@ SEEDS = [
     "Emergency services require you to leave the area for your own safety."
 ]
 
+# --------------------------------------------------------------------
+# Helpers
+# --------------------------------------------------------------------
+def resolve_run_dir(run_id: str, resume: bool, out_dir: str = "") -> Path:
+    """Explicit --out_dir wins; --resume reuses the latest *_<run_id> folder; otherwise a fresh one."""
+    if out_dir:
+        return Path(out_dir)
+    if resume:
+        existing = sorted(SEED_RUNS_DIR.glob(f"*_{run_id}"))
+        if existing:
+            return existing[-1]
+        print(f"[A08] No previous run found for '{run_id}', starting a new one")
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    return SEED_RUNS_DIR / f"{timestamp}_{run_id}"
+
+
+def build_conv_meta(sid: int, seed_text: str, resident: str, rep: int, result: dict) -> dict:
+    # --- Fallback safety ---
+    if result is None:
+        result = {"status": "unknown", "path": "", "history": []}
+
+    # Extract turn-wise operator policies
+    operator_turns = [
+        {"turn": i, "policy": t.get("selected_policy", None), "text": t.get("text", "")}
+        for i, t in enumerate(result.get("history", []), start=1)
+        if t.get("role", "").lower() == "operator"
+    ]
+
+    # Determine if resident agreed to evacuate
+    success_flag = 0
+    if "success" in result:
+        success_flag = result["success"]
+    elif any("leave" in (t.get("text", "").lower()) for t in result.get("history", [])):
+        success_flag = 1
+
+    return {
+        "seed_id": sid,
+        "seed_text": seed_text,
+        "resident": resident,
+        "rep": rep,
+        "status": result.get("status", "unknown"),
+        "stop_reason": result.get("stop_reason", ""),
+        "num_turns": result.get("turns", len(result.get("history", []))),
+        "success": success_flag,
+        "operator_policies": operator_turns,
+        "history": result.get("history", []),
+        "file": result.get("path", "")
+    }
+
+
+def index_entry(conv_meta: dict, outfile: Path) -> dict:
+    return {
+        "seed_id": conv_meta["seed_id"],
+        "seed_text": conv_meta["seed_text"],
+        "resident": conv_meta["resident"],
+        "rep": conv_meta["rep"],
+        "success": conv_meta["success"],
+        "stop_reason": conv_meta["stop_reason"],
+        "num_turns": conv_meta["num_turns"],
+        "policies_used": [t["policy"] for t in conv_meta["operator_policies"] if t.get("policy")],
+        "file": str(outfile)
+    }
+
+
+def load_index(index_jsonl: Path) -> dict:
+    """(seed_id, resident, rep) -> entry for every conversation already recorded"""
+    entries = {}
+    if not index_jsonl.exists():
+        return entries
+    with index_jsonl.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                e = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from an interrupted run
+            entries[(e["seed_id"], e["resident"], e["rep"])] = e
+    return entries
+
 # --------------------------------------------------------------------
 # Main batch driver
 # --------------------------------------------------------------------
@@ -56,6 +154,18 @@ def main():
                     help="How many times to repeat each (seed,resident)")
     ap.add_argument("--run_id", type=str, required=True,
                     help="Run ID (creates folder under dataA/runs/seed_runs/)")
+    ap.add_argument("--workers", type=int, default=8,
+                    help="Conversations in flight at once (bounds concurrent Ollama/Mavis calls)")
+    ap.add_argument("--turn_delay", type=float, default=0.0,
+                    help="Pause between turns in seconds (A07 default is 0.8; with --lockstep, between steps)")
+    ap.add_argument("--resume", action="store_true",
+                    help="Reuse the latest folder for --run_id and skip finished conversations")
+    ap.add_argument("--out_dir", type=str, default="",
+                    help="Explicit run folder (overrides the timestamped default)")
+    ap.add_argument("--lockstep", action="store_true",
+                    help="Advance conversations together, batching model calls per turn")
+    ap.add_argument("--lockstep_size", type=int, default=64,
+                    help="Conversations per lockstep group")
     args = ap.parse_args()
 
     # Parse arguments
@@ -63,92 +173,127 @@ def main():
     seeds_to_use = SEEDS[:args.num_conversations]
 
     # Create directories
-    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
-    base_dir = Path("/Users/mousumi/A2I2_RAG/cross_policy/dataA/runs/seed_runs") / f"{timestamp}_{args.run_id}"
+    base_dir = resolve_run_dir(args.run_id, args.resume, args.out_dir)
     conversations_dir = base_dir / "conversations"
     conversations_dir.mkdir(parents=True, exist_ok=True)
+    index_jsonl = base_dir / "master_index.jsonl"
 
-    master = {"run_id": args.run_id, "timestamp": timestamp, "results": []}
-
-    print("=" * 70)
-    print(f"[A08] Starting batch run {args.run_id} for residents: {residents}")
-    print("=" * 70)
-
-    run_idx = 0
+    done = load_index(index_jsonl)
+    jobs = []
     for sid, seed_text in enumerate(seeds_to_use):
         for resident in residents:
             for rep in range(1, args.num_reps + 1):
-                run_idx += 1
-                print(f"\n[RUN {run_idx}] Seed={sid}  Resident={resident}  Rep={rep}")
-                print(f"[SEED] {seed_text}")
-
-                # --- Run one conversation ---
-                result = simulate_conversation(resident_name=resident)
-
-                # --- Fallback safety ---
-                if result is None:
-                    result = {"status": "unknown", "path": "", "history": []}
-
-                # Extract turn-wise operator policies
-                operator_turns = [
-                    {"turn": i, "policy": t.get("selected_policy", None), "text": t.get("text", "")}
-                    for i, t in enumerate(result.get("history", []), start=1)
-                    if t.get("role", "").lower() == "operator"
-                ]
-
-                # Determine if resident agreed to evacuate
-                success_flag = 0
-                if "success" in result:
-                    success_flag = result["success"]
-                elif any("leave" in (t.get("text", "").lower()) for t in result.get("history", [])):
-                    success_flag = 1
-
-                # --- Construct conversation metadata ---
-                conv_meta = {
-                    "seed_id": sid,
-                    "seed_text": seed_text,
-                    "resident": resident,
-                    "rep": rep,
-                    "status": result.get("status", "unknown"),
-                    "stop_reason": result.get("stop_reason", ""),
-                    "num_turns": result.get("turns", len(result.get("history", []))),
-                    "success": success_flag,
-                    "operator_policies": operator_turns,
-                    "history": result.get("history", []),
-                    "file": result.get("path", "")
-                }
-
-                # --- Save per-conversation JSON ---
                 outfile = conversations_dir / f"seed{sid}__{resident}__rep{rep}.json"
-                outfile.write_text(json.dumps(conv_meta, indent=2, ensure_ascii=False), encoding="utf-8")
-
-                # --- Append to master index ---
-                master["results"].append({
-                    "seed_id": sid,
-                    "seed_text": seed_text,
-                    "resident": resident,
-                    "rep": rep,
-                    "success": success_flag,
-                    "stop_reason": conv_meta["stop_reason"],
-                    "num_turns": conv_meta["num_turns"],
-                    "file": str(outfile)
-                })
-
-    # --- Save master summary JSON ---
-    index_file = base_dir / "master_index.json"
-    index_file.write_text(json.dumps(master, indent=2, ensure_ascii=False), encoding="utf-8")
+                if (sid, resident, rep) in done and outfile.exists():
+                    continue
+                jobs.append((sid, seed_text, resident, rep, outfile))
 
-    print(f"\n[OK] Master index written → {index_file}")
-    print("\nBatch completed successfully ✅")
-
-
-    import csv
+    total = len(seeds_to_use) * len(residents) * args.num_reps
+    print("=" * 70)
+    print(f"[A08] Starting batch run {args.run_id} for residents: {residents}")
+    print(f"[A08] {total} conversations, {total - len(jobs)} already done, {len(jobs)} to run "
+          f"with {args.workers} workers → {base_dir}")
+    print("=" * 70)
 
-    # Save master summary JSON
+    # Models are loaded once and shared; concurrent policy selections are batched
+    base_selector = IQLPolicySelector()
+    selector = CoalescingPolicySelector(base_selector, max_batch=max(1, args.workers))
+    index_lock = threading.Lock()
+
+    def dialogue_file(job):
+        sid, _, resident, rep, _ = job
+        return conversations_dir / f"seed{sid}__{resident}__rep{rep}.jsonl"
+
+    def record(job, result):
+        sid, seed_text, resident, rep, outfile = job
+        conv_meta = build_conv_meta(sid, seed_text, resident, rep, result)
+
+        # --- Save per-conversation JSON (atomic, so resume never sees a partial file) ---
+        tmp = outfile.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(conv_meta, indent=2, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(outfile)
+
+        # --- Append to master index ---
+        entry = index_entry(conv_meta, outfile)
+        with index_lock:
+            with index_jsonl.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        done[(sid, resident, rep)] = entry
+        return entry
+
+    def run_one(job):
+        sid, seed_text, resident, rep, _ = job
+        # --- Run one conversation ---
+        result = simulate_conversation(
+            resident_name=resident,
+            seed_text=seed_text,
+            selector=selector,
+            turn_delay=args.turn_delay,
+            out_file=dialogue_file(job),
+            verbose=args.workers <= 1,
+        )
+        return record(job, result)
+
+    t0 = time.time()
+    finished = failed = 0
+    if args.lockstep:
+        retriever = BatchPairRetriever(base_selector.policy_names)
+        size = max(1, args.lockstep_size)
+        for g in range(0, len(jobs), size):
+            group = jobs[g:g + size]
+            print(f"\n[A08] Lockstep group {g // size + 1}: {len(group)} conversations")
+            try:
+                results = simulate_conversations_lockstep(
+                    [{"resident_name": job[2], "seed_text": job[1], "out_file": dialogue_file(job)} for job in group],
+                    selector=base_selector,
+                    retriever=retriever,
+                    io_workers=args.workers,
+                    turn_delay=args.turn_delay,
+                )
+            except Exception as e:
+                # Batched model work failed: the whole group is lost, later groups still run
+                failed += len(group)
+                print(f"[ERR] Lockstep group {g // size + 1} failed: {e}")
+                continue
+            for job, result in zip(group, results):
+                sid, _, resident, rep, _ = job
+                try:
+                    if result.get("error"):
+                        raise RuntimeError(result["error"])
+                    entry = record(job, result)
+                    finished += 1
+                    print(f"[RUN {finished}/{len(jobs)}] Seed={sid}  Resident={resident}  Rep={rep}  "
+                          f"success={entry['success']}  turns={entry['num_turns']}")
+                except Exception as e:
+                    failed += 1
+                    print(f"[ERR] Seed={sid} Resident={resident} Rep={rep} failed: {e}")
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+            futures = {pool.submit(run_one, job): job for job in jobs}
+            for fut in as_completed(futures):
+                sid, _, resident, rep, _ = futures[fut]
+                try:
+                    entry = fut.result()
+                    finished += 1
+                    print(f"[RUN {finished}/{len(jobs)}] Seed={sid}  Resident={resident}  Rep={rep}  "
+                          f"success={entry['success']}  turns={entry['num_turns']}")
+                except Exception as e:
+                    failed += 1
+                    print(f"[ERR] Seed={sid} Resident={resident} Rep={rep} failed: {e}")
+        print(f"[A08] Policy batching: {selector.stats()}")
+
+    elapsed = time.time() - t0
+    rate = finished / elapsed * 60 if elapsed > 0 else 0.0
+    print(f"\n[A08] {finished} conversations in {elapsed:.1f}s ({rate:.1f}/min), {failed} failed")
+
+    # --- Save master summary JSON (everything recorded so far, including resumed runs) ---
+    results = sorted(done.values(), key=lambda e: (e["seed_id"], e["resident"], e["rep"]))
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    master = {"run_id": args.run_id, "timestamp": timestamp, "results": results}
     index_file = base_dir / "master_index.json"
     index_file.write_text(json.dumps(master, indent=2, ensure_ascii=False), encoding="utf-8")
 
-    # --- New: Build CSV summary ---
+    # --- Build CSV summary ---
     csv_file = base_dir / "master_index.csv"
     with open(csv_file, "w", newline="", encoding="utf-8") as f:
         fieldnames = [
@@ -158,22 +303,7 @@ def main():
         ]
         writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
-        for entry in master["results"]:
-            # Try to read the per-conversation JSON to extract policy list
-            conv_file = Path(entry["file"])
-            policies_used = []
-            if conv_file.exists():
-                try:
-                    conv_data = json.loads(conv_file.read_text())
-                    if "history" in conv_data:
-                        for turn in conv_data["history"]:
-                            if turn.get("role") == "operator":
-                                policy = turn.get("selected_policy", "")
-                                if policy:
-                                    policies_used.append(policy)
-                except Exception:
-                    pass
-            entry["policies_used"] = policies_used
+        for entry in results:
             writer.writerow(entry)
 
     print(f"\n[OK] Master index written → {index_file}")
@@ -181,7 +311,7 @@ def main():
     print("\nBatch completed successfully ✅")
 
 
-    # --------------------------------------------------------------------
+# --------------------------------------------------------------------
 if __name__ == "__main__":
     main()
 
@@ -1,5 +1,27 @@
+"""
+Synthetic Julie / town-person conversation generator
+
+Runs many conversations in parallel for IQL retraining corpora:
+  • a bounded worker pool (--workers), each conversation with its own uuid
+    session in conversation_manager, so parallel dialogues never share history
+  • every finished dialogue is appended to a JSONL file as soon as it
+    completes; --resume skips (town_person, rep) pairs already in it
+  • throughput (conversations/minute) is reported as results come in, and the
+    aggregate JSON is rebuilt from the JSONL at the end
+
+Usage:
+    python auto_generate_conversations.py --num_reps 50 --workers 8
+    python auto_generate_conversations.py --characters bob,ross --num_reps 200 --workers 16 --resume
+"""
+
+import argparse
 import json
 import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 from pathlib import Path
 from ollama_0220 import simulate_interactive_single_turn, conversation_manager, decision_making
 
@@ -10,6 +32,9 @@ BASE_DIR = os.getenv('A2I2_BASE_DIR', os.path.dirname(os.path.dirname(os.path.ab
 PERSONA_FILE_PATH = os.path.join("data_for_train/persona.json")
 DIAL_FILE_PATH = os.path.join("data_for_train/character_lines.jsonl")
 OUTPUT_FILE_PATH = os.path.join(BASE_DIR, "results/auto_generated_conversations.json")
+OUTPUT_JSONL_PATH = os.path.join(BASE_DIR, "results/auto_generated_conversations.jsonl")
+
+TOWN_PEOPLE = ["bob", "niki", "lindsay", "ross", "michelle"]
 
 def load_json_file(file_path):
     """Load JSON file with error handling."""
@@ -69,19 +94,22 @@ def get_town_person_category(message_count, town_person):
         else:
             return "progression"
 
-def generate_conversation(town_person, persona_data, dialogue_data):
+def generate_conversation(town_person, persona_data, dialogue_data, session_id=None, verbose=True):
     """Generate a conversation between Julie and a town person."""
-    # Use a unique session ID with timestamp to avoid conflicts
-    import time
-    session_id = f"{town_person}_auto_session_{int(time.time())}"
+    # A uuid session keeps parallel conversations for the same character apart
+    if session_id is None:
+        session_id = f"{town_person}_auto_{uuid.uuid4().hex}"
     conversation_history = []
     decision_responses = []
+    error = None
     
-    print(f"Generating conversation for {town_person}...")
+    if verbose:
+        print(f"Generating conversation for {town_person}...")
     
     # Generate up to 10 messages (5 exchanges between Julie and town person)
     for message_count in range(1, 11):
-        print(f"Message {message_count}")
+        if verbose:
+            print(f"Message {message_count}")
         
         # Get conversation history
         history = conversation_manager.get_history(session_id, max_turns=11)
@@ -130,7 +158,8 @@ def generate_conversation(town_person, persona_data, dialogue_data):
                 "retrieved_info": julie_retrieved_info
             })
             
-            print(f"Julie: {julie_response}")
+            if verbose:
+                print(f"Julie: {julie_response}")
             
             # Check if conversation should end
             if julie_category == "closing":
@@ -170,7 +199,8 @@ def generate_conversation(town_person, persona_data, dialogue_data):
                 "retrieved_info": retrieved_info
             })
             
-            print(f"{town_person}: {response}")
+            if verbose:
+                print(f"{town_person}: {response}")
             
             # Get decision response if we have enough messages
             updated_history = conversation_manager.get_history(session_id, max_turns=9)
@@ -184,57 +214,130 @@ def generate_conversation(town_person, persona_data, dialogue_data):
             
         except Exception as e:
             print(f"Error generating message {message_count} for {town_person}: {str(e)}")
+            error = str(e)
             break
     
-    return {
+    # The transcript is in the result; free the session's memory
+    conversation_manager.end_session(session_id)
+
+    result = {
         "town_person": town_person,
+        "session_id": session_id,
         "conversation_history": conversation_history,
         "decision_responses": decision_responses,
         "total_messages": len(conversation_history)
     }
+    if error:
+        result["error"] = error
+    return result
+
+def load_finished(jsonl_path):
+    """(town_person, rep) -> record for every error-free conversation already in the JSONL."""
+    finished = {}
+    if not os.path.exists(jsonl_path):
+        return finished
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from an interrupted run
+            if not record.get("error"):
+                finished[(record["town_person"], record["rep"])] = record
+    return finished
 
 def main():
-    """Main function to generate conversations for all town people."""
+    """Generate conversations for the requested town people in parallel."""
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--characters", type=str, default=",".join(TOWN_PEOPLE),
+                    help="Comma-separated town people (default: all five)")
+    ap.add_argument("--num_reps", type=int, default=1,
+                    help="Conversations to generate per town person")
+    ap.add_argument("--workers", type=int, default=4,
+                    help="Conversations in flight at once (bounds concurrent LLM calls)")
+    ap.add_argument("--output", type=str, default=OUTPUT_JSONL_PATH,
+                    help="JSONL file that finished conversations are appended to")
+    ap.add_argument("--summary", type=str, default=OUTPUT_FILE_PATH,
+                    help="Aggregate JSON rebuilt from the JSONL at the end")
+    ap.add_argument("--resume", action="store_true",
+                    help="Keep the existing JSONL and skip conversations already in it")
+    args = ap.parse_args()
+
     # Load data
     persona_data = load_json_file(PERSONA_FILE_PATH)
     dialogue_data = load_dialogue_data()
-    
-    # Town people to generate conversations for
-    town_people = ["bob", "niki", "lindsay", "ross", "michelle"]
-    
-    all_conversations = []
-    
-    for town_person in town_people:
-        print(f"\n{'='*50}")
-        print(f"Generating conversation for {town_person}")
-        print(f"{'='*50}")
-        
-        conversation_result = generate_conversation(town_person, persona_data, dialogue_data)
-        all_conversations.append(conversation_result)
-        
-        print(f"Generated {conversation_result['total_messages']} messages for {town_person}")
-    
-    # Save results to JSON file
+
+    town_people = [c.strip().lower() for c in args.characters.split(",") if c.strip()]
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    if not args.resume and os.path.exists(args.output):
+        os.remove(args.output)
+    finished = load_finished(args.output)
+
+    jobs = [(town_person, rep) for town_person in town_people for rep in range(1, args.num_reps + 1)
+            if (town_person, rep) not in finished]
+    total = len(town_people) * args.num_reps
+    print(f"\n{'='*50}")
+    print(f"Generating {total} conversations ({total - len(jobs)} already done, {len(jobs)} to run) "
+          f"with {args.workers} workers → {args.output}")
+    print(f"{'='*50}")
+
+    write_lock = threading.Lock()
+    verbose = args.workers <= 1
+
+    def run_one(job):
+        town_person, rep = job
+        result = generate_conversation(town_person, persona_data, dialogue_data, verbose=verbose)
+        result["rep"] = rep
+        result["generated_at"] = datetime.now(timezone.utc).isoformat()
+        with write_lock:
+            with open(args.output, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        return result
+
+    t0 = time.time()
+    done = failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(run_one, job): job for job in jobs}
+        for fut in as_completed(futures):
+            town_person, rep = futures[fut]
+            try:
+                result = fut.result()
+            except Exception as e:
+                failed += 1
+                print(f"[ERR] {town_person} rep {rep} failed: {e}")
+                continue
+            if result.get("error"):
+                failed += 1
+            else:
+                done += 1
+                finished[(town_person, rep)] = result
+            elapsed = time.time() - t0
+            rate = (done + failed) / elapsed * 60 if elapsed > 0 else 0.0
+            print(f"[GEN {done + failed}/{len(jobs)}] {town_person} rep {rep}: "
+                  f"{result['total_messages']} messages, {len(result['decision_responses'])} decisions "
+                  f"({rate:.1f} conv/min)")
+
+    elapsed = time.time() - t0
+    rate = done / elapsed * 60 if elapsed > 0 else 0.0
+    messages = sum(finished[(p, r)]["total_messages"] for p, r in jobs if (p, r) in finished)
+    print(f"\n{'='*50}")
+    print(f"Generated {done} conversations in {elapsed:.1f}s ({rate:.1f} conv/min, "
+          f"{messages / elapsed * 60 if elapsed > 0 else 0.0:.1f} messages/min), {failed} failed")
+
+    # Aggregate JSON of everything recorded so far, including resumed runs
+    all_conversations = sorted(finished.values(), key=lambda r: (r["town_person"], r["rep"]))
     output_data = {
-        "generated_at": str(Path(__file__).stat().st_mtime),
+        "generated_at": datetime.now(timezone.utc).isoformat(),
         "total_conversations": len(all_conversations),
         "conversations": all_conversations
     }
-    
-    # Ensure output directory exists
-    os.makedirs(os.path.dirname(OUTPUT_FILE_PATH), exist_ok=True)
-    
-    with open(OUTPUT_FILE_PATH, 'w') as f:
+    os.makedirs(os.path.dirname(os.path.abspath(args.summary)), exist_ok=True)
+    with open(args.summary, 'w') as f:
         json.dump(output_data, f, indent=2)
-    
-    print(f"\n{'='*50}")
-    print(f"Generated {len(all_conversations)} conversations")
-    print(f"Results saved to: {OUTPUT_FILE_PATH}")
+
+    print(f"Results streamed to: {args.output}")
+    print(f"Summary saved to: {args.summary}")
     print(f"{'='*50}")
-    
-    # Print summary
-    for conv in all_conversations:
-        print(f"{conv['town_person']}: {conv['total_messages']} messages, {len(conv['decision_responses'])} decisions")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
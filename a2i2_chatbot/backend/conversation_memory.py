@@ -0,0 +1,115 @@
+"""
+Bounded per-session conversation memory
+
+ConversationManager shared by ollama_0220.py and ollama_0220_openai.py (and so
+by server_keywords.py / server_local_model.py):
+
+  • each session keeps at most CONVERSATION_MAX_MESSAGES messages in a deque
+    (callers read at most the last 12), with each line pre-rendered on append
+  • get_history() output is cached per window size until the next message,
+    so repeated reads within a turn are dictionary lookups
+  • sessions are kept in LRU order; sessions idle for CONVERSATION_IDLE_TTL_S
+    and the least recently used beyond CONVERSATION_MAX_SESSIONS are evicted
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List
+
+CONVERSATION_MAX_MESSAGES = int(os.getenv("CONVERSATION_MAX_MESSAGES", "32"))
+CONVERSATION_MAX_SESSIONS = int(os.getenv("CONVERSATION_MAX_SESSIONS", "1000"))
+CONVERSATION_IDLE_TTL_S = float(os.getenv("CONVERSATION_IDLE_TTL_S", "3600"))
+
+
+class Message:
+    __slots__ = ("speaker", "content", "timestamp")
+
+    def __init__(self, speaker: str, content: str, timestamp: float):
+        self.speaker = speaker
+        self.content = content
+        self.timestamp = timestamp
+
+    def as_dict(self) -> Dict:
+        return {"speaker": self.speaker, "content": self.content, "timestamp": self.timestamp}
+
+
+class _Session:
+    __slots__ = ("messages", "lines", "rendered", "last_access")
+
+    def __init__(self, max_messages: int):
+        self.messages = deque(maxlen=max_messages)
+        self.lines = deque(maxlen=max_messages)  # "speaker: content", aligned with messages
+        self.rendered: Dict[int, str] = {}        # max_turns -> joined history, valid until the next append
+        self.last_access = time.monotonic()
+
+
+class ConversationManager:
+    def __init__(self, max_messages: int = CONVERSATION_MAX_MESSAGES,
+                 max_sessions: int = CONVERSATION_MAX_SESSIONS,
+                 idle_ttl_s: float = CONVERSATION_IDLE_TTL_S):
+        self.max_messages = max_messages
+        self.max_sessions = max_sessions
+        self.idle_ttl_s = idle_ttl_s
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def _evict(self, now: float):
+        """Drop idle sessions (oldest first) and anything beyond max_sessions; caller holds the lock"""
+        while self._sessions:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            if now - oldest.last_access > self.idle_ttl_s or len(self._sessions) > self.max_sessions:
+                del self._sessions[oldest_id]
+                self.evicted += 1
+            else:
+                break
+
+    def add_message(self, session_id: str, speaker: str, content: str):
+        """Add a message to the conversation history."""
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _Session(self.max_messages)
+                self._evict(now)
+            else:
+                self._sessions.move_to_end(session_id)
+            session.messages.append(Message(speaker, content, time.time()))
+            session.lines.append(f"{speaker}: {content}")
+            session.rendered.clear()
+            session.last_access = now
+
+    def get_history(self, session_id: str, max_turns: int = 7) -> str:
+        """Get formatted conversation history (last max_turns messages, one per line)."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                logging.debug(f"No conversation found for session ID: {session_id}")
+                return ""
+            self._sessions.move_to_end(session_id)
+            session.last_access = time.monotonic()
+            text = session.rendered.get(max_turns)
+            if text is None:
+                lines = session.lines
+                start = max(0, len(lines) - max_turns)
+                text = "\n".join(lines[i] for i in range(start, len(lines)))
+                session.rendered[max_turns] = text
+            return text
+
+    def get_messages(self, session_id: str) -> List[Dict]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return [m.as_dict() for m in session.messages] if session else []
+
+    def end_session(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
@@ -0,0 +1,259 @@
+"""
+Character / operator dialogue line store with semantic search
+
+Shared by ollama_0220.py and ollama_0220_openai.py through get_vector_store(),
+which builds the store on first use from data_for_train/characterlines.jsonl
+(resolved relative to this file, not the working directory).
+
+  • add_dialogues() loads data_for_train/characterlines.jsonl into per-character
+    and operator category dicts (as before) and a flat table of every line
+  • the embedding index is built on the first search(), not on load: callers
+    that only read operator_responses / character_responses never load the
+    encoder. Every line is embedded once with all-MiniLM-L6-v2 (normalized) and
+    cached in indexes/dialogue_embeddings/<stem>_<sha256>.npy, so later builds
+    for the same JSONL skip encoding; the shared encoder (encoder_registry.py)
+    is only loaded on a cache miss or to embed a query
+  • search() is a vectorized cosine top-k over that matrix, optionally filtered
+    by character, speaker and category
+"""
+
+import hashlib
+import json
+import logging
+import random
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from encoder_registry import get_encoder
+
+EMBED_MODEL = "all-MiniLM-L6-v2"
+DEFAULT_DIALOGUE_FILE = Path(__file__).resolve().parent / "data_for_train" / "characterlines.jsonl"
+CACHE_SUBDIR = Path("indexes") / "dialogue_embeddings"
+QUERY_CACHE_SIZE = 1024
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DialogueVectorStore:
+    def __init__(self):
+        self.character_responses = {}
+        self.operator_responses = {}
+        self.operator_response_categories = ['greetings', 'progression', 'observations', 'closing', 'emphasize_danger', 'emphasize_value_of_life', 'give_up_persuading']
+        self.character_response_categories = ['greetings', 'response_to_operator_greetings', 'progression', 'observations', 'general', 'closing']
+
+        # Flat line table + aligned normalized embeddings (filled by add_dialogues)
+        self.entries: List[Dict] = []
+        self.embeddings = np.zeros((0, 0), dtype=np.float32)
+        self._speakers = np.array([], dtype=object)
+        self._contexts = np.array([], dtype=object)
+        self._query_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._query_lock = threading.Lock()   # turns run on a threadpool; guards the LRU
+        self._source: Optional[Path] = None   # JSONL whose lines still need indexing
+        self._index_lock = threading.Lock()
+
+    @property
+    def encoder(self):
+        """Shared MiniLM encoder, loaded on first use"""
+        return get_encoder(EMBED_MODEL)
+
+    def add_dialogues(self, file_path):
+        """Load character responses from JSONL file and index every line for search."""
+        try:
+            with open(file_path, 'r') as file:
+                for line_num, line in enumerate(file, 1):
+                    # Skip empty lines
+                    line = line.strip()
+                    if not line:
+                        continue
+
+                    try:
+                        data = json.loads(line)
+                    except json.JSONDecodeError as e:
+                        logging.warning(f"Skipping invalid JSON at line {line_num}: {str(e)}")
+                        continue
+
+                    if data['character'] == 'operator':
+                        # Store operator responses
+                        for category in self.operator_response_categories:
+                            if category in data:
+                                self.operator_responses.setdefault(category, []).extend(data[category])
+                    else:
+                        # Store character responses
+                        for category in self.character_response_categories:
+                            if category not in data:
+                                data[category] = []
+                        self.character_responses[data['character']] = data
+
+            if not self.character_responses:
+                logging.warning("No valid character responses were loaded")
+            else:
+                logging.info(f"Loaded responses for characters: {list(self.character_responses.keys())}")
+                logging.info(f"Loaded operator responses for contexts: {list(self.operator_responses.keys())}")
+
+        except Exception as e:
+            logging.error(f"Error loading dialogues: {str(e)}")
+            raise
+
+        # Indexed lazily by the first search()
+        self._source = Path(file_path)
+
+    # ------------------------------------------------------------------
+    # Embedding index
+    # ------------------------------------------------------------------
+    def _ensure_index(self):
+        """Build the embedding index for the loaded dialogues once, on first use"""
+        if self._source is None:
+            return
+        with self._index_lock:
+            if self._source is not None:
+                self._build_index(self._source)
+                self._source = None
+
+    def _build_index(self, file_path: Path):
+        entries = []
+        for char, data in self.character_responses.items():
+            for category, lines in data.items():
+                if category == 'character' or not isinstance(lines, list):
+                    continue
+                entries.extend({'speaker': char, 'content': text, 'character': char, 'context': category}
+                               for text in lines if isinstance(text, str) and text.strip())
+        for category, lines in self.operator_responses.items():
+            entries.extend({'speaker': 'operator', 'content': text, 'character': 'operator', 'context': category}
+                           for text in lines if isinstance(text, str) and text.strip())
+
+        cache_file = file_path.parent / CACHE_SUBDIR / f"{file_path.stem}_{_file_sha256(file_path)[:16]}.npy"
+        embeddings = None
+        if cache_file.exists():
+            cached = np.load(cache_file)
+            if cached.shape[0] == len(entries):
+                embeddings = cached
+        if embeddings is None:
+            embeddings = self.encoder.encode(
+                [e['content'] for e in entries], convert_to_numpy=True,
+                normalize_embeddings=True, show_progress_bar=False,
+            ).astype(np.float32)
+            try:
+                cache_file.parent.mkdir(parents=True, exist_ok=True)
+                np.save(cache_file, embeddings)
+            except OSError as e:
+                logging.warning(f"Could not write dialogue embedding cache {cache_file}: {e}")
+            logging.info(f"Encoded {len(entries)} dialogue lines (cached to {cache_file.name})")
+        else:
+            logging.info(f"Loaded {len(entries)} dialogue line embeddings from {cache_file.name}")
+
+        self.entries = entries
+        self.embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self._speakers = np.array([e['speaker'] for e in entries], dtype=object)
+        self._contexts = np.array([e['context'] for e in entries], dtype=object)
+        with self._query_lock:
+            self._query_cache.clear()
+
+    def _embed_query(self, query: str) -> np.ndarray:
+        with self._query_lock:
+            vec = self._query_cache.get(query)
+            if vec is not None:
+                self._query_cache.move_to_end(query)
+                return vec
+        # Encode outside the lock so concurrent misses do not serialize on the model call
+        vec = self.encoder.encode([query], convert_to_numpy=True, normalize_embeddings=True,
+                                  show_progress_bar=False)[0].astype(np.float32)
+        with self._query_lock:
+            self._query_cache[query] = vec
+            self._query_cache.move_to_end(query)
+            while len(self._query_cache) > QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return vec
+
+    def search(self, query: str, character: str = None, k: int = 3,
+               category: Optional[str] = None, speaker: Optional[str] = None) -> List[Dict]:
+        """
+        Cosine top-k over every indexed line.
+        character / speaker restrict to one character's lines ('operator' for operator lines);
+        category restricts to one context such as 'progression' or 'observations'.
+        """
+        self._ensure_index()
+        if not self.entries or k <= 0:
+            return []
+
+        mask = np.ones(len(self.entries), dtype=bool)
+        who = speaker or (character if character in self.character_responses or character == 'operator' else None)
+        if who:
+            mask &= self._speakers == who
+        if category:
+            mask &= self._contexts == category
+        candidates = np.flatnonzero(mask)
+        if candidates.size == 0:
+            return []
+
+        scores = self.embeddings[candidates] @ self._embed_query(query)
+        k = min(k, candidates.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [dict(self.entries[candidates[i]], score=float(scores[i])) for i in top]
+
+    def get_response(self, character, category):
+        """Get a response for a specific character and category."""
+        if character not in self.character_responses:
+            raise ValueError(f"Character {character} not found")
+
+        if category not in self.character_response_categories:
+            raise ValueError(f"Category {category} not valid")
+
+        responses = self.character_responses[character].get(category, [])
+        return random.choice(responses) if responses else ""
+
+    def get_character_context(self, character):
+        """Get all responses for a character for context."""
+        if character not in self.character_responses:
+            return ""
+
+        context = []
+        for category in self.character_response_categories:
+            responses = self.character_responses[character].get(category, [])
+            if responses:
+                context.extend(responses)
+        return " ".join(context)
+
+    def get_operator_response(self, context: str) -> str:
+        """Get a response for the operator/agent based on context."""
+        if context not in self.operator_responses or not self.operator_responses[context]:
+            context = 'general'  # fallback to general responses
+
+        responses = self.operator_responses.get(context, [])
+        if not responses:
+            return "I understand. Please proceed with evacuation for your safety."
+
+        return random.choice(responses)
+
+
+# ============================================================================
+# Shared instance
+# ============================================================================
+
+_vector_store = None
+_vector_store_lock = threading.Lock()
+
+
+def get_vector_store() -> DialogueVectorStore:
+    """Process-wide store loaded from DEFAULT_DIALOGUE_FILE on first call"""
+    global _vector_store
+    if _vector_store is None:
+        with _vector_store_lock:
+            if _vector_store is None:
+                store = DialogueVectorStore()
+                if DEFAULT_DIALOGUE_FILE.exists():
+                    store.add_dialogues(DEFAULT_DIALOGUE_FILE)
+                else:
+                    logging.error(f"Warning: Dialogue file not found at {DEFAULT_DIALOGUE_FILE}")
+                _vector_store = store
+    return _vector_store
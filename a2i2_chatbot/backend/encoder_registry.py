@@ -0,0 +1,39 @@
+"""
+Process-wide registry of sentence encoders
+
+Every module that needs MiniLM gets the same instance through get_encoder(),
+loaded on first use rather than at import. sentence_transformers itself is
+imported lazily too, so importing a module that only might embed costs nothing.
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
+
+_encoders: Dict[Tuple[str, Optional[str]], object] = {}
+_lock = threading.Lock()
+
+
+def get_encoder(name: str = DEFAULT_MODEL, device: Optional[str] = None):
+    """Shared SentenceTransformer for (name, device), loaded once per process"""
+    key = (name, device)
+    encoder = _encoders.get(key)
+    if encoder is None:
+        with _lock:
+            encoder = _encoders.get(key)
+            if encoder is None:
+                from sentence_transformers import SentenceTransformer
+
+                t0 = time.time()
+                encoder = SentenceTransformer(name, device=device)
+                _encoders[key] = encoder
+                logging.info(f"Loaded encoder {name} ({device or 'default device'}) in {time.time() - t0:.2f}s")
+    return encoder
+
+
+def loaded_encoders():
+    """(name, device) keys of the encoders loaded so far"""
+    return list(_encoders)
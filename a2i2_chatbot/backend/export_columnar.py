@@ -0,0 +1,366 @@
+"""
+Columnar export of study data to Parquet / Arrow
+
+Flattens completion (CCC*.json) and exit records into four tables:
+  • messages      one row per conversation message (role, text, index)
+  • decisions     one row per IQL turn (policy, judge stance/confidence, stage timings)
+  • q_values      one row per (turn, policy) with the Q-value and whether it was chosen
+  • post_surveys  one row per post-conversation survey
+
+Each table is written as a dataset partitioned by date and character
+(hive style: <out>/<table>/date=2026-01-08/character=bob/part-*.parquet).
+Runs are incremental: a manifest records which source files have been exported
+and in which batch, so only new or changed files are read. A changed file's
+earlier rows are removed from that batch's parts before its new rows are
+appended, and active-session snapshot rows are dropped once the session shows
+up in a completion or exit record, so each session is exported once.
+
+Requires pyarrow (pip install pyarrow).
+
+Usage:
+  python export_columnar.py                       # survey_responses/{completed,exits} -> analytics/
+  python export_columnar.py --format arrow --out /data/a2i2_analytics
+  python export_columnar.py --include-active      # also snapshot active_sessions_*.json dumps
+  python export_columnar.py --rebuild             # ignore the manifest and re-export everything
+
+Query example:
+  import pyarrow.dataset as ds
+  ds.dataset("analytics/decisions", format="parquet", partitioning="hive").to_table(
+      filter=ds.field("character") == "bob").to_pandas()
+"""
+
+import argparse
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+BASE_DIR = os.getenv('A2I2_BASE_DIR', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SURVEY_RESPONSES_DIR = os.path.join(BASE_DIR, "survey_responses")
+DEFAULT_OUT_DIR = os.path.join(BASE_DIR, "analytics")
+MANIFEST_NAME = "_manifest.json"
+ACTIVE_PREFIX = "active_sessions_"
+
+TABLES = ("messages", "decisions", "q_values", "post_surveys")
+PARTITION_COLUMNS = ["date", "character"]
+
+_KEY_COLUMNS = [
+    ("date", "string"), ("character", "string"), ("participant_id", "string"),
+    ("confirmation_number", "string"), ("status", "string"), ("session_id", "string"),
+    ("source_file", "string"),
+]
+
+# Explicit column types so every incremental batch has the same schema (no null-typed columns)
+TABLE_COLUMNS = {
+    "messages": _KEY_COLUMNS + [("message_index", "int32"), ("role", "string"), ("text", "string")],
+    "decisions": _KEY_COLUMNS + [
+        ("turn", "int32"), ("timestamp", "string"), ("resident_message", "string"),
+        ("operator_response", "string"), ("selected_policy", "string"), ("stance", "string"),
+        ("stance_confidence", "float64"), ("stance_reason", "string"), ("judge_ms", "float64"),
+        ("policy_selection_ms", "float64"), ("retrieval_ms", "float64"), ("llm_call_ms", "float64"),
+    ],
+    "q_values": _KEY_COLUMNS + [("turn", "int32"), ("policy", "string"), ("q_value", "float64"), ("selected", "bool")],
+    "post_surveys": _KEY_COLUMNS + [
+        ("conversation_number", "int32"), ("willing", "string"), ("willing_yes_details", "string"),
+        ("willing_no_details", "string"), ("naturalness", "string"), ("unnatural_utterances", "string"),
+        ("num_unnatural_utterances", "int32"),
+    ],
+}
+
+
+# ============================================================================
+# Flattening
+# ============================================================================
+
+def _date_of(*timestamps: Optional[str]) -> str:
+    """YYYY-MM-DD from the first parseable ISO timestamp (partition key)"""
+    for ts in timestamps:
+        if ts:
+            try:
+                return datetime.fromisoformat(str(ts).replace("Z", "+00:00")).date().isoformat()
+            except ValueError:
+                continue
+    return "unknown"
+
+
+def iter_conversations(record: dict) -> Iterator[dict]:
+    """Conversations in a completion/exit record or an active-sessions dump"""
+    yield from record.get("conversations", [])
+    yield from record.get("sessions", [])
+
+
+def flatten_record(record: dict, source: str) -> Dict[str, List[dict]]:
+    """One source JSON file -> rows for every table"""
+    rows: Dict[str, List[dict]] = {name: [] for name in TABLES}
+    participant_id = record.get("participant_id")
+    confirmation = record.get("confirmation_number")
+    status = record.get("status") or ("active" if "sessions" in record else None)
+    record_ts = record.get("completion_timestamp") or record.get("exit_timestamp") or record.get("export_timestamp")
+
+    for conv in iter_conversations(record):
+        session_id = conv.get("session_id")
+        character = (conv.get("character") or "unknown").lower()
+        date = _date_of(conv.get("created_at"), record_ts)
+        keys = {
+            "date": date,
+            "character": character,
+            "participant_id": participant_id or conv.get("participant_id"),
+            "confirmation_number": confirmation,
+            "status": status,
+            "session_id": session_id,
+            "source_file": source,
+        }
+
+        for idx, msg in enumerate(conv.get("history", [])):
+            rows["messages"].append({**keys, "message_index": idx, "role": msg.get("role"), "text": msg.get("text")})
+
+        # iql_data from the server; "turns" from extract_conversation_data.py exports
+        for turn in conv.get("iql_data") or conv.get("turns") or []:
+            policy = turn.get("selected_policy") or turn.get("policy")
+            judge = turn.get("judge") or {}
+            timings = turn.get("timings_ms") or {}
+            rows["decisions"].append({
+                **keys,
+                "turn": turn.get("turn"),
+                "timestamp": turn.get("timestamp"),
+                "resident_message": turn.get("resident_message"),
+                "operator_response": turn.get("operator_response"),
+                "selected_policy": policy,
+                "stance": judge.get("stance"),
+                "stance_confidence": judge.get("confidence"),
+                "stance_reason": judge.get("reason"),
+                "judge_ms": timings.get("judge"),
+                "policy_selection_ms": timings.get("policy_selection"),
+                "retrieval_ms": timings.get("retrieval"),
+                "llm_call_ms": timings.get("llm_call"),
+            })
+            for name, q in (turn.get("q_values") or {}).items():
+                rows["q_values"].append({
+                    **keys,
+                    "turn": turn.get("turn"),
+                    "policy": name,
+                    "q_value": float(q),
+                    "selected": name == policy,
+                })
+
+    for survey in record.get("post_surveys", []) or []:
+        character = (survey.get("character") or "unknown").lower()
+        rows["post_surveys"].append({
+            "date": _date_of(survey.get("timestamp"), record_ts),
+            "character": character,
+            "participant_id": survey.get("participantId") or participant_id,
+            "confirmation_number": confirmation,
+            "status": status,
+            "session_id": survey.get("sessionId"),
+            "source_file": source,
+            "conversation_number": survey.get("conversationNumber"),
+            "willing": survey.get("willing"),
+            "willing_yes_details": survey.get("willingYesDetails"),
+            "willing_no_details": survey.get("willingNoDetails"),
+            "naturalness": survey.get("naturalness"),
+            "unnatural_utterances": json.dumps(survey.get("unnaturalUtterances", [])),
+            "num_unnatural_utterances": len(survey.get("unnaturalUtterances", []) or []),
+        })
+    return rows
+
+
+# ============================================================================
+# Incremental export
+# ============================================================================
+
+def discover_sources(responses_dir: Path, include_active: bool) -> List[Path]:
+    sources = sorted((responses_dir / "completed").glob("*.json")) + sorted((responses_dir / "exits").glob("*.json"))
+    if include_active:
+        sources += sorted(responses_dir.glob("active_sessions_*.json"))
+    return sources
+
+
+def load_manifest(out_dir: Path) -> dict:
+    path = out_dir / MANIFEST_NAME
+    if path.exists():
+        return json.loads(path.read_text(encoding="utf-8"))
+    return {"files": {}, "runs": []}
+
+
+def save_manifest(out_dir: Path, manifest: dict):
+    path = out_dir / MANIFEST_NAME
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    tmp.replace(path)
+
+
+def _fingerprint(path: Path) -> Tuple[int, float]:
+    st = path.stat()
+    return st.st_size, st.st_mtime
+
+
+def _is_active(name: str) -> bool:
+    return name.startswith(ACTIVE_PREFIX)
+
+
+def record_sessions(record: dict) -> List[str]:
+    return [conv["session_id"] for conv in iter_conversations(record) if conv.get("session_id")]
+
+
+def purge_rows(out_dir: Path, batches: Set[str], drop) -> int:
+    """
+    Remove rows matching the `drop` expression from the parts written by `batches`.
+    Parts are rewritten in place (tmp + replace) or deleted when nothing is left.
+    """
+    removed = 0
+    for table in TABLES:
+        for batch in sorted(batches):
+            for part in sorted((out_dir / table).rglob(f"part-{batch}-*")):
+                if part.suffix not in (".parquet", ".arrow"):
+                    continue
+                fmt = "parquet" if part.suffix == ".parquet" else "ipc"
+                data = ds.dataset(str(part), format=fmt).to_table()
+                # drop evaluates to null on null session_ids; keep those rows
+                kept = ds.dataset(data).to_table(filter=~drop | drop.is_null())
+                if kept.num_rows == data.num_rows:
+                    continue
+                removed += data.num_rows - kept.num_rows
+                if kept.num_rows == 0:
+                    part.unlink()
+                    continue
+                tmp = part.with_name(part.name + ".tmp")
+                if fmt == "parquet":
+                    pq.write_table(kept, str(tmp))
+                else:
+                    with pa.ipc.new_file(str(tmp), kept.schema) as writer:
+                        writer.write_table(kept)
+                tmp.replace(part)
+    return removed
+
+
+def write_table(rows: List[dict], out_dir: Path, table: str, fmt: str, batch_id: str) -> int:
+    if not rows:
+        return 0
+    schema = pa.schema([(name, getattr(pa, type_name)()) for name, type_name in TABLE_COLUMNS[table]])
+    arrow_table = pa.Table.from_pylist(rows, schema=schema)
+    ds.write_dataset(
+        arrow_table,
+        base_dir=str(out_dir / table),
+        format="parquet" if fmt == "parquet" else "ipc",
+        partitioning=ds.partitioning(
+            pa.schema([(c, pa.string()) for c in PARTITION_COLUMNS]), flavor="hive"
+        ),
+        basename_template=f"part-{batch_id}-{{i}}.{'parquet' if fmt == 'parquet' else 'arrow'}",
+        existing_data_behavior="overwrite_or_ignore",  # new uniquely named files next to earlier runs
+    )
+    return len(rows)
+
+
+def export(responses_dir: Path, out_dir: Path, fmt: str = "parquet",
+           include_active: bool = False, rebuild: bool = False) -> dict:
+    if not PYARROW_AVAILABLE:
+        raise RuntimeError("pyarrow is required for columnar export: pip install pyarrow")
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest = {"files": {}, "runs": []} if rebuild else load_manifest(out_dir)
+    if rebuild:
+        for table in TABLES:
+            for old in (out_dir / table).rglob("part-*"):
+                old.unlink()
+
+    t0 = time.time()
+    pending = []
+    for path in discover_sources(responses_dir, include_active):
+        size, mtime = _fingerprint(path)
+        seen = manifest["files"].get(str(path))
+        if seen and seen["size"] == size and seen["mtime"] == mtime:
+            continue
+        pending.append((path, size, mtime))
+
+    records = {}
+    skipped = []
+    for path, _, _ in pending:
+        try:
+            records[str(path)] = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"[EXPORT] Skipping unreadable {path.name}: {e}")
+            skipped.append(str(path))
+
+    # Sessions that have a completion/exit record, exported earlier or in this run
+    finished = {sid for key, entry in manifest["files"].items() if not _is_active(Path(key).name)
+                for sid in entry.get("sessions", [])}
+    newly_finished = {sid for key, record in records.items() if not _is_active(Path(key).name)
+                      for sid in record_sessions(record)} - finished
+    finished |= newly_finished
+
+    # Earlier rows to replace: every row of a re-exported file, and active-snapshot
+    # rows of sessions that now have a completion/exit record
+    changed = {Path(key).name: manifest["files"][key]["batch"] for key in records if key in manifest["files"]}
+    superseded = {Path(key).name: entry["batch"] for key, entry in manifest["files"].items()
+                  if _is_active(Path(key).name) and key not in records
+                  and newly_finished.intersection(entry.get("sessions", []))}
+    conditions = []
+    if changed:
+        conditions.append(ds.field("source_file").isin(list(changed)))
+    if superseded:
+        conditions.append(ds.field("source_file").isin(list(superseded))
+                          & ds.field("session_id").isin(list(newly_finished)))
+    replaced = 0
+    if conditions:
+        drop = conditions[0] if len(conditions) == 1 else conditions[0] | conditions[1]
+        replaced = purge_rows(out_dir, set(changed.values()) | set(superseded.values()), drop)
+
+    rows: Dict[str, List[dict]] = {name: [] for name in TABLES}
+    for key, record in records.items():
+        active = _is_active(Path(key).name)
+        for name, table_rows in flatten_record(record, Path(key).name).items():
+            if active:
+                table_rows = [r for r in table_rows if r["session_id"] not in finished]
+            rows[name].extend(table_rows)
+
+    batch_id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    counts = {name: write_table(rows[name], out_dir, name, fmt, batch_id) for name in TABLES}
+
+    for path, size, mtime in pending:
+        if str(path) not in skipped:
+            manifest["files"][str(path)] = {"size": size, "mtime": mtime, "batch": batch_id,
+                                            "sessions": record_sessions(records[str(path)])}
+    run = {
+        "batch": batch_id,
+        "timestamp": datetime.utcnow().isoformat(),
+        "format": fmt,
+        "new_files": len(pending) - len(skipped),
+        "rows": counts,
+        "replaced_rows": replaced,
+        "seconds": round(time.time() - t0, 3),
+    }
+    manifest["runs"].append(run)
+    save_manifest(out_dir, manifest)
+    return run
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Export study data to partitioned Parquet/Arrow tables.")
+    ap.add_argument("--responses-dir", type=Path, default=Path(SURVEY_RESPONSES_DIR))
+    ap.add_argument("--out", type=Path, default=Path(DEFAULT_OUT_DIR))
+    ap.add_argument("--format", choices=["parquet", "arrow"], default="parquet")
+    ap.add_argument("--include-active", action="store_true",
+                    help="Also export active_sessions_*.json snapshots (may overlap later completions)")
+    ap.add_argument("--rebuild", action="store_true", help="Ignore the manifest and re-export everything")
+    args = ap.parse_args()
+
+    run = export(args.responses_dir, args.out, args.format, args.include_active, args.rebuild)
+    print(f"[EXPORT] {run['new_files']} new files → {args.out} in {run['seconds']}s "
+          f"({run['replaced_rows']} earlier rows replaced)")
+    for name, count in run["rows"].items():
+        print(f"  {name:13s} +{count} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,9 +8,12 @@ import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from sentence_transformers import SentenceTransformer
 import requests
+import uuid
 import warnings
+
+from encoder_registry import get_encoder
+from turn_log import TurnLogWriter
 # --- suppress noisy warnings/logs ---
 os.environ["TOKENIZERS_PARALLELISM"] = "false"   # HuggingFace tokenizers fork warning
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"         # silence TF logs if any dependency pulls TF
@@ -25,13 +28,14 @@ EMBED_MODEL = "all-MiniLM-L6-v2"
 MAX_TURNS = 5              # max resident turns
 MIN_RESIDENT_TURNS = 3     # don't end before this many resident turns
 
-QLOG_PATH = Path("q_values_log.jsonl")
+# Segmented, group-committed turn log (see turn_log.py); replaces per-turn appends to q_values_log.jsonl
+QLOG_DIR = Path("q_values_log")
 
 
 # ----------------------------
 # State encoding
 # ----------------------------
-def embed_state(model: SentenceTransformer, last_n_res_texts: List[str]) -> np.ndarray:
+def embed_state(model, last_n_res_texts: List[str]) -> np.ndarray:
     if not last_n_res_texts:
         return np.zeros((model.get_sentence_embedding_dimension(),), dtype=np.float32)
     embs = model.encode(last_n_res_texts, convert_to_numpy=True, normalize_embeddings=True)
@@ -67,7 +71,7 @@ class IQLSelectorEmbedFromPT:
     """
     def __init__(self, pt_path: Path, policy_names: List[str]):
         self.device = torch.device("cpu")
-        self.embed_model = SentenceTransformer(EMBED_MODEL)
+        self.embed_model = get_encoder(EMBED_MODEL)
 
         state_dict = torch.load(pt_path, map_location="cpu")
 
@@ -139,7 +143,7 @@ def cosine_topk(query_vec: np.ndarray, mat: np.ndarray, k: int) -> List[int]:
 
 
 class PolicyExampleRetriever:
-    def __init__(self, base_dir: Path, embed_model: SentenceTransformer):
+    def __init__(self, base_dir: Path, embed_model):
         self.base_dir = base_dir
         self.embed_model = embed_model
         self._cache = {}  # policy -> (pairs, embeds_matrix)
@@ -347,6 +351,18 @@ def main():
     if not os.environ.get("OPENAI_API_KEY"):
         raise RuntimeError("Set OPENAI_API_KEY in your environment before running.")
 
+    qlog = TurnLogWriter(QLOG_DIR)
+    session_id = f"interactive_{uuid.uuid4().hex[:8]}"
+    try:
+        run_chat(selector, retriever, model, qlog, session_id)
+    except KeyboardInterrupt:
+        print()
+    finally:
+        qlog.close()
+        print(f"[LOG] Turn log committed to {QLOG_DIR}/ (session {session_id})")
+
+
+def run_chat(selector, retriever, model: str, qlog: TurnLogWriter, session_id: str):
     history: List[Dict[str, str]] = []
     print("\nYou are role-playing as Bob (resident). Type messages; Ctrl+C to exit.\n")
 
@@ -423,6 +439,8 @@ def main():
             print(f"  {pol:10s}: {q: .6f} {mark}")
 
         rec = {
+            "event": "q_values",
+            "session_id": session_id,
             "ts": time.time(),
             "turn": resident_turns,
             "resident_text": user_in,
@@ -430,8 +448,7 @@ def main():
             "q_values": qvals,
             "judge": judge,
         }
-        with QLOG_PATH.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(rec) + "\n")
+        qlog.append(rec)
 
         # ---- retrieval + operator generation ----
         examples = retriever.retrieve_topk_pairs(best_policy, resident_query=user_in, k=2)
@@ -0,0 +1,234 @@
+"""
+Compact binary storage for the IQL dataset
+
+iql_dataset.jsonl keeps every 384-dim state_vec as a JSON float list, so each
+training / evaluation run re-parses hundreds of thousands of decimal floats.
+This module converts it once into:
+
+  • <name>.states.npy   contiguous float32 matrix [N, dim], opened as a memmap
+  • <name>.meta.json    column table: dialogue_id, resident, state_text, action_id, reward
+                        (+ source fingerprint so stale stores are rebuilt)
+
+and loads it back with no parsing of the vectors at all. Sequential batches
+are views into the memmap, handed to PyTorch with torch.from_numpy (no copy).
+
+Usage:
+  python iql_dataset_store.py convert                       # iql/iql_dataset.jsonl -> iql/iql_dataset.{states.npy,meta.json}
+  python iql_dataset_store.py convert --jsonl other.jsonl --out /data/iql
+  python iql_dataset_store.py info
+
+  from iql_dataset_store import load_or_convert
+  store = load_or_convert()                                 # converts on first use / when the JSONL changed
+  for batch in store.batches(256):
+      q = qnet(batch["states"], batch["action_id"])
+"""
+
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+try:
+    import torch
+    TORCH_AVAILABLE = True
+except ImportError:
+    TORCH_AVAILABLE = False
+
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_JSONL = BASE_DIR / "iql" / "iql_dataset.jsonl"
+
+FORMAT_VERSION = 1
+META_COLUMNS = ("dialogue_id", "resident", "state_text", "action_id", "reward")
+
+
+def store_paths(jsonl_path: Path, out_dir: Optional[Path] = None) -> Dict[str, Path]:
+    """states/meta file paths for a JSONL dataset (next to it unless out_dir is given)"""
+    jsonl_path = Path(jsonl_path)
+    out_dir = Path(out_dir) if out_dir else jsonl_path.parent
+    return {
+        "states": out_dir / f"{jsonl_path.stem}.states.npy",
+        "meta": out_dir / f"{jsonl_path.stem}.meta.json",
+    }
+
+
+def _fingerprint(path: Path) -> Dict[str, float]:
+    st = path.stat()
+    return {"size": st.st_size, "mtime": st.st_mtime}
+
+
+# ============================================================================
+# Conversion
+# ============================================================================
+
+def convert_jsonl(jsonl_path: Path = DEFAULT_JSONL, out_dir: Optional[Path] = None) -> Dict[str, Path]:
+    """
+    Stream the JSONL into a float32 .npy memmap + metadata table.
+    Two passes over the file (count, then fill) so memory stays flat regardless of size.
+    """
+    jsonl_path = Path(jsonl_path)
+    paths = store_paths(jsonl_path, out_dir)
+    paths["states"].parent.mkdir(parents=True, exist_ok=True)
+
+    count, dim = 0, None
+    with jsonl_path.open("r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            if dim is None:
+                dim = len(json.loads(line)["state_vec"])
+            count += 1
+    if not count:
+        raise ValueError(f"No records in {jsonl_path}")
+
+    tmp_states = paths["states"].with_suffix(".tmp.npy")
+    states = np.lib.format.open_memmap(tmp_states, mode="w+", dtype=np.float32, shape=(count, dim))
+    columns: Dict[str, list] = {name: [] for name in META_COLUMNS}
+    i = 0
+    with jsonl_path.open("r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            vec = rec["state_vec"]
+            if len(vec) != dim:
+                raise ValueError(f"{jsonl_path}:{i + 1}: state_vec has {len(vec)} dims, expected {dim}")
+            states[i] = vec
+            for name in META_COLUMNS:
+                columns[name].append(rec.get(name))
+            i += 1
+    states.flush()
+    del states
+
+    meta = {
+        "version": FORMAT_VERSION,
+        "count": count,
+        "dim": dim,
+        "source": str(jsonl_path),
+        "source_fingerprint": _fingerprint(jsonl_path),
+        "created_at": time.time(),
+        "columns": columns,
+    }
+    tmp_meta = paths["meta"].with_suffix(".tmp")
+    tmp_meta.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    # states first, meta last: a meta file always describes a complete states file
+    os.replace(tmp_states, paths["states"])
+    os.replace(tmp_meta, paths["meta"])
+    return paths
+
+
+# ============================================================================
+# Loading
+# ============================================================================
+
+class IQLDatasetStore:
+    """Memory-mapped state matrix + metadata columns"""
+
+    def __init__(self, states_path: Path, meta_path: Path, mmap: bool = True):
+        meta = json.loads(Path(meta_path).read_text(encoding="utf-8"))
+        if meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported dataset store version {meta.get('version')} in {meta_path}")
+        self.meta = meta
+        # Copy-on-write mapping: writable for torch.from_numpy, but the file is never modified
+        self.states = np.load(states_path, mmap_mode="c" if mmap else None)
+        if self.states.shape != (meta["count"], meta["dim"]):
+            raise ValueError(f"{states_path} shape {self.states.shape} does not match {meta_path}")
+
+        cols = meta["columns"]
+        self.dialogue_id: List[str] = cols["dialogue_id"]
+        self.resident: List[str] = cols["resident"]
+        self.state_text: List[str] = cols["state_text"]
+        self.action_id = np.asarray(cols["action_id"], dtype=np.int64)
+        self.reward = np.asarray(cols["reward"], dtype=np.float32)
+
+    def __len__(self) -> int:
+        return self.meta["count"]
+
+    @property
+    def dim(self) -> int:
+        return self.meta["dim"]
+
+    def batches(self, batch_size: int = 256, shuffle: bool = False, seed: Optional[int] = None,
+                as_torch: bool = True, drop_last: bool = False) -> Iterator[Dict[str, object]]:
+        """
+        Yield dicts with states [B, dim], action_id [B], reward [B] and the row indices.
+        Sequential batches are slices of the memmap (zero-copy); shuffled batches
+        gather their rows, which is one copy per batch.
+        """
+        n = len(self)
+        order = np.random.default_rng(seed).permutation(n) if shuffle else None
+        for start in range(0, n, batch_size):
+            stop = min(start + batch_size, n)
+            if drop_last and stop - start < batch_size:
+                break
+            idx = order[start:stop] if shuffle else slice(start, stop)
+            batch = {
+                "states": self.states[idx],
+                "action_id": self.action_id[idx],
+                "reward": self.reward[idx],
+                "index": np.arange(start, stop) if not shuffle else idx,
+            }
+            if as_torch and TORCH_AVAILABLE:
+                batch = {k: torch.from_numpy(v) for k, v in batch.items()}
+            yield batch
+
+
+def is_stale(jsonl_path: Path, out_dir: Optional[Path] = None) -> bool:
+    """True if the binary store is missing or was built from a different JSONL"""
+    paths = store_paths(jsonl_path, out_dir)
+    if not (paths["states"].exists() and paths["meta"].exists()):
+        return True
+    try:
+        meta = json.loads(paths["meta"].read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return True
+    return meta.get("version") != FORMAT_VERSION or meta.get("source_fingerprint") != _fingerprint(Path(jsonl_path))
+
+
+def load_store(jsonl_path: Path = DEFAULT_JSONL, out_dir: Optional[Path] = None, mmap: bool = True) -> IQLDatasetStore:
+    paths = store_paths(jsonl_path, out_dir)
+    return IQLDatasetStore(paths["states"], paths["meta"], mmap=mmap)
+
+
+def load_or_convert(jsonl_path: Path = DEFAULT_JSONL, out_dir: Optional[Path] = None, mmap: bool = True) -> IQLDatasetStore:
+    """Load the binary store, (re)building it from the JSONL first if it is missing or stale"""
+    if is_stale(jsonl_path, out_dir):
+        print(f"[IQL-DATA] Converting {jsonl_path} to binary store...")
+        convert_jsonl(jsonl_path, out_dir)
+    return load_store(jsonl_path, out_dir, mmap=mmap)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Convert / inspect the binary IQL dataset store.")
+    ap.add_argument("command", choices=["convert", "info"])
+    ap.add_argument("--jsonl", type=Path, default=DEFAULT_JSONL)
+    ap.add_argument("--out", type=Path, default=None, help="Output directory (default: next to the JSONL)")
+    args = ap.parse_args()
+
+    if args.command == "convert":
+        t0 = time.time()
+        paths = convert_jsonl(args.jsonl, args.out)
+        print(f"[IQL-DATA] Wrote {paths['states']} and {paths['meta']} in {time.time() - t0:.2f}s")
+        return
+
+    t0 = time.perf_counter()
+    store = load_store(args.jsonl, args.out)
+    load_s = time.perf_counter() - t0
+    residents: Dict[str, int] = {}
+    for r in store.resident:
+        residents[r] = residents.get(r, 0) + 1
+    print(json.dumps({
+        "count": len(store),
+        "dim": store.dim,
+        "stale": is_stale(args.jsonl, args.out),
+        "load_ms": round(load_s * 1000, 2),
+        "residents": residents,
+        "actions": np.bincount(store.action_id).tolist(),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
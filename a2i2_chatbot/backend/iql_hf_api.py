@@ -11,14 +11,23 @@ import json
 from typing import Dict, List, Tuple
 import time
 
+import logging
+
+import metrics
+from structured_logging import get_logger, log_event, sampled
+
+log = get_logger("iql_hf")
+
+IQL_FALLBACKS = metrics.counter("a2i2_iql_fallbacks_total", "Policy selections served by the heuristic fallback")
+
 # Hugging Face configuration
 # NOTE: Do NOT hardcode tokens. Load them from environment (e.g., from `.env` via `start_server.sh`).
 HF_MODEL_ID = os.getenv("HUGGINGFACE_MODEL_ID", "tzhang62/iql-fire-rescue")
 HF_TOKEN = os.getenv("HUGGINGFACE_TOKEN")
 
 # Check if it's a Space URL or model ID
-if HF_MODEL_ID.endswith(".hf.space"):
-    # It's a Space URL - use directly
+if HF_MODEL_ID.endswith(".hf.space") or HF_MODEL_ID.startswith("http"):
+    # It's a Space URL (or a local stand-in such as mock_llm_server.py) - use directly
     HF_API_URL = f"https://{HF_MODEL_ID}" if not HF_MODEL_ID.startswith("http") else HF_MODEL_ID
     IS_SPACE = True
 else:
@@ -27,6 +36,9 @@ else:
     HF_API_URL = f"https://router.huggingface.co/hf-inference/models/{HF_MODEL_ID}"
     IS_SPACE = False
 
+# States per /predict_batch request (must not exceed the Space's PREDICT_BATCH_MAX_ITEMS)
+PREDICT_BATCH_CHUNK = int(os.getenv("IQL_PREDICT_BATCH_CHUNK", "1000"))
+
 # Policy names (must match training)
 POLICY_NAMES = [
     "bob",
@@ -51,9 +63,12 @@ class IQLHuggingFace:
             # Token only needed for Inference API, not public Spaces
             self.headers["Authorization"] = f"Bearer {HF_TOKEN}"
         
+        # Reuse keep-alive connections across turns instead of a new TLS handshake per call
+        self.session = requests.Session()
+        
         api_type = "Space" if IS_SPACE else "Inference API"
-        print(f"[IQL-HF] Initialized with {api_type}: {self.api_url}")
-        print(f"[IQL-HF] {len(self.policy_names)} policies available")
+        log_event(log, "iql_hf_initialized", api_type=api_type, api_url=self.api_url,
+                  policies=len(self.policy_names))
     
     def _prepare_state(self, history: List[Dict[str, str]], n_last: int = 3) -> str:
         """
@@ -72,25 +87,26 @@ class IQLHuggingFace:
         state_text = " | ".join(resident_messages[-n_last:])
         return state_text
     
-    def _call_hf_api(self, inputs: dict, max_retries: int = 3) -> dict:
+    def _call_hf_api(self, inputs: dict, max_retries: int = 3, session_id: str = None,
+                     path: str = "/", timeout: float = 30) -> dict:
         """
         Call Hugging Face API (Space or Inference API) with retries
         """
         # Determine endpoint URL
         if self.is_space:
-            # Space API uses root endpoint
-            endpoint = f"{self.api_url.rstrip('/')}/"
+            # Space API: root endpoint for single predictions, /predict_batch for batches
+            endpoint = f"{self.api_url.rstrip('/')}{path}"
         else:
             # Inference API uses model URL directly
             endpoint = self.api_url
         
         for attempt in range(max_retries):
             try:
-                response = requests.post(
+                response = self.session.post(
                     endpoint,
                     headers=self.headers,
                     json=inputs,
-                    timeout=30  # 30 second timeout
+                    timeout=timeout
                 )
                 
                 if response.status_code == 200:
@@ -98,29 +114,43 @@ class IQLHuggingFace:
                 elif response.status_code == 503:
                     # Model is loading, wait and retry
                     wait_time = 10 * (attempt + 1)
-                    print(f"[IQL-HF] Model loading, waiting {wait_time}s...")
+                    log_event(log, "iql_model_loading", level=logging.WARNING, session_id=session_id,
+                              attempt=attempt + 1, wait_s=wait_time)
                     time.sleep(wait_time)
                     continue
                 else:
-                    print(f"[IQL-HF] API error {response.status_code}: {response.text}")
+                    log_event(log, "iql_api_error", level=logging.ERROR, session_id=session_id,
+                              status=response.status_code, body=response.text[:500])
                     return None
                     
             except requests.exceptions.Timeout:
-                print(f"[IQL-HF] Request timeout (attempt {attempt + 1}/{max_retries})")
+                log_event(log, "iql_timeout", level=logging.WARNING, session_id=session_id,
+                          attempt=attempt + 1, max_retries=max_retries)
                 if attempt < max_retries - 1:
                     time.sleep(5)
                     continue
                 return None
                 
             except Exception as e:
-                print(f"[IQL-HF] API call failed: {e}")
+                log_event(log, "iql_call_failed", level=logging.ERROR, session_id=session_id, error=str(e))
                 return None
         
         return None
     
+    def warmup(self):
+        """
+        Open a pooled connection to the Space (wakes it up if it is sleeping)
+        """
+        if not self.is_space:
+            return
+        response = self.session.get(f"{self.api_url.rstrip('/')}/health", timeout=30)
+        response.raise_for_status()
+        log_event(log, "iql_space_warm", health=response.json())
+    
     def select_policy(self, history: List[Dict[str, str]], 
                      character: str = None, 
-                     n_last: int = 3) -> Tuple[str, Dict[str, float]]:
+                     n_last: int = 3,
+                     session_id: str = None) -> Tuple[str, Dict[str, float]]:
         """
         Select best policy using Hugging Face API
         
@@ -138,14 +168,15 @@ class IQLHuggingFace:
             }
         }
         
-        print(f"[IQL-HF] Querying API for policy (character={character})...")
-        
         # Call Hugging Face API
-        result = self._call_hf_api(payload)
+        t0 = time.perf_counter()
+        result = self._call_hf_api(payload, session_id=session_id)
+        latency_ms = round((time.perf_counter() - t0) * 1000.0, 2)
         
         if result is None:
             # Fallback to default policy if API fails
-            print("[IQL-HF] API failed, using fallback policy")
+            log_event(log, "iql_fallback", level=logging.WARNING, session_id=session_id,
+                      character=character, latency_ms=latency_ms)
             return self._fallback_policy(history)
         
         # Parse API response
@@ -162,20 +193,63 @@ class IQLHuggingFace:
             # Ensure all policies have Q-values
             q_values_dict = {p: q_values.get(p, 0.0) for p in self.policy_names}
             
-            print(f"[IQL-HF] Selected policy: {policy}")
-            print(f"[IQL-HF] Q-values: {q_values_dict}")
+            log_event(log, "iql_policy_selected", session_id=session_id, character=character,
+                      policy=policy, latency_ms=latency_ms)
+            if sampled():
+                log_event(log, "iql_q_values", level=logging.DEBUG, session_id=session_id, q_values=q_values_dict)
             
             return policy, q_values_dict
             
         except Exception as e:
-            print(f"[IQL-HF] Error parsing API response: {e}")
+            log_event(log, "iql_bad_response", level=logging.ERROR, session_id=session_id, error=str(e))
             return self._fallback_policy(history)
     
+    def select_policy_batch(self, histories: List[List[Dict[str, str]]],
+                            n_last: int = 3,
+                            chunk_size: int = PREDICT_BATCH_CHUNK,
+                            session_id: str = None) -> List[Tuple[str, Dict[str, float]]]:
+        """
+        Select policies for many conversation histories (e.g. replaying logged turns)
+        with one /predict_batch request per chunk_size states instead of one per state.
+        States of a failed chunk get the heuristic fallback, like select_policy.
+        
+        Returns:
+            [(policy_name, q_values_dict)] in the order of `histories`
+        """
+        if not self.is_space:
+            # The Inference API has no batch endpoint
+            return [self.select_policy(h, n_last=n_last, session_id=session_id) for h in histories]
+        
+        results: List[Tuple[str, Dict[str, float]]] = []
+        for start in range(0, len(histories), chunk_size):
+            chunk = histories[start:start + chunk_size]
+            payload = {"inputs": [self._prepare_state(h, n_last) for h in chunk]}
+            
+            t0 = time.perf_counter()
+            result = self._call_hf_api(payload, session_id=session_id, path="/predict_batch", timeout=300)
+            latency_ms = round((time.perf_counter() - t0) * 1000.0, 2)
+            
+            rows = result.get("results") if isinstance(result, dict) else None
+            if not rows or len(rows) != len(chunk):
+                log_event(log, "iql_batch_fallback", level=logging.WARNING, session_id=session_id,
+                          states=len(chunk), latency_ms=latency_ms)
+                results.extend(self._fallback_policy(h) for h in chunk)
+                continue
+            
+            for row in rows:
+                q_values = row.get("q_values", {})
+                results.append((row.get("policy", self.policy_names[0]),
+                                {p: q_values.get(p, 0.0) for p in self.policy_names}))
+            log_event(log, "iql_batch_selected", session_id=session_id, states=len(chunk), latency_ms=latency_ms)
+        
+        return results
+    
     def _fallback_policy(self, history: List[Dict[str, str]]) -> Tuple[str, Dict[str, float]]:
         """
         Fallback policy selection when API is unavailable
         Uses simple heuristics based on conversation length
         """
+        IQL_FALLBACKS.inc()
         turn_count = len([m for m in history if m["role"] == "resident"])
         
         # Simple rule-based fallback
@@ -192,7 +266,7 @@ class IQLHuggingFace:
         q_values = {p: 0.5 for p in self.policy_names}
         q_values[policy] = 0.8  # Selected policy gets higher value
         
-        print(f"[IQL-HF] Fallback policy: {policy}")
+        log_event(log, "iql_fallback_policy", policy=policy, resident_turns=turn_count)
         return policy, q_values
 
 # Global instance
@@ -0,0 +1,316 @@
+"""
+Deterministic stand-in for OpenAI and the IQL Hugging Face Space
+
+Lets the full chat flow (/api/chat/message) run offline for load and latency
+testing. One process serves:
+  • POST /v1/chat/completions  - OpenAI-compatible, including stream=true (SSE)
+  • GET  /v1/models            - used by the backend's connection warmup
+  • POST /                     - IQL Space predict ({"inputs": "msg1 | msg2"})
+  • POST /predict_batch        - IQL Space batched predict ({"inputs": [...]} or {"states": [[...]]})
+  • POST /embed                - IQL Space embeddings (384-d, hash-seeded)
+  • GET  /health               - Space health (reports loading while in the 503 window)
+
+Responses depend only on the request content, so runs are reproducible. Latency,
+error rate and the "model loading" window are configurable:
+
+  MOCK_LATENCY_MS        mean added latency per request (default 300)
+  MOCK_LATENCY_DIST      fixed | uniform | lognormal (default lognormal)
+  MOCK_LATENCY_SIGMA     lognormal sigma (default 0.5)
+  MOCK_ERROR_RATE        fraction of requests answered with HTTP 500 (default 0)
+  MOCK_LOADING_SECONDS   answer 503 "Model loading" for this long after start (default 0)
+  MOCK_SEED              seed for latency/error sampling (default 0)
+  MOCK_PREFIX_CACHE_SIZE prompt prefixes remembered for cached_tokens, LRU (default 10000)
+
+Point the backend at it with:
+  OPENAI_API_BASE=http://localhost:8100/v1
+  OPENAI_API_KEY=mock
+  HUGGINGFACE_MODEL_ID=http://localhost:8100
+
+Run:
+  python mock_llm_server.py --port 8100 --latency-ms 400 --error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+EMBED_DIM = 384
+POLICY_NAMES = ["bob", "lindsay", "michelle", "niki", "ross"]
+
+OPERATOR_REPLIES = [
+    "The fire is moving toward your area, please leave now and head to the shelter.",
+    "I understand your concern, but your safety comes first; please evacuate right away.",
+    "Emergency crews are on the way, please grab essentials and go to the safe zone.",
+    "Conditions can change very quickly, so please start leaving immediately.",
+    "We can help you with transportation if you need it, but please get ready to go.",
+]
+
+# ============================================================================
+# Configuration
+# ============================================================================
+
+class MockConfig:
+    def __init__(self):
+        self.latency_ms = float(os.getenv("MOCK_LATENCY_MS", "300"))
+        self.latency_dist = os.getenv("MOCK_LATENCY_DIST", "lognormal")
+        self.latency_sigma = float(os.getenv("MOCK_LATENCY_SIGMA", "0.5"))
+        self.error_rate = float(os.getenv("MOCK_ERROR_RATE", "0"))
+        self.loading_seconds = float(os.getenv("MOCK_LOADING_SECONDS", "0"))
+        self.seed = int(os.getenv("MOCK_SEED", "0"))
+        self.prefix_cache_size = int(os.getenv("MOCK_PREFIX_CACHE_SIZE", "10000"))
+
+
+config = MockConfig()
+rng = random.Random(config.seed)
+started_at = time.time()
+stats = {"requests": 0, "errors": 0, "loading_503": 0}
+
+# ============================================================================
+# Helpers
+# ============================================================================
+
+def _digest(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+def sample_latency_s() -> float:
+    mean = max(0.0, config.latency_ms) / 1000.0
+    if mean == 0:
+        return 0.0
+    if config.latency_dist == "fixed":
+        return mean
+    if config.latency_dist == "uniform":
+        return rng.uniform(0.0, 2 * mean)
+    # lognormal with the requested mean (heavy right tail, like real LLM APIs)
+    sigma = config.latency_sigma
+    mu = np.log(mean) - sigma ** 2 / 2
+    return rng.lognormvariate(mu, sigma)
+
+
+async def simulate(loading_applies: bool = False):
+    """Apply the loading window, sampled latency and error injection to one request"""
+    stats["requests"] += 1
+    if loading_applies and time.time() - started_at < config.loading_seconds:
+        stats["loading_503"] += 1
+        raise HTTPException(status_code=503, detail="Model loading")
+    await asyncio.sleep(sample_latency_s())
+    if config.error_rate > 0 and rng.random() < config.error_rate:
+        stats["errors"] += 1
+        raise HTTPException(status_code=500, detail="Injected mock error")
+
+
+def mock_embedding(text: str, normalize: bool = True) -> np.ndarray:
+    vec = np.random.default_rng(_digest(text)).standard_normal(EMBED_DIM).astype(np.float32)
+    if normalize:
+        vec /= np.linalg.norm(vec) + 1e-12
+    return vec
+
+
+def mock_completion_text(messages: List[Dict[str, Any]]) -> str:
+    """Pick a plausible reply for the prompts server.py sends, keyed on the prompt content"""
+    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+    h = _digest(prompt)
+    if "RESIDENT's stance" in prompt:
+        stance = ["AGREE", "DELAY", "REFUSE", "UNKNOWN"][h % 4]
+        return json.dumps({"stance": stance, "confidence": round(0.5 + (h % 50) / 100, 2), "reason": "mock"})
+    if "yes or no" in prompt.lower():
+        return "no"
+    return OPERATOR_REPLIES[h % len(OPERATOR_REPLIES)]
+
+
+def approx_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+# Prefix cache like OpenAI's: prompts of 1024+ tokens reuse earlier identical
+# leading messages, counted in 128-token increments. Bounded LRU, like the
+# provider's own cache, so a long load test does not grow it without limit
+_seen_prefixes: "OrderedDict[int, None]" = OrderedDict()
+
+
+def mock_cached_tokens(messages: List[Dict[str, Any]]) -> int:
+    cached, prefix, hit = 0, "", True
+    for m in messages[:-1]:
+        prefix += f"{m.get('role')}:{m.get('content', '')}\n"
+        key = _digest(prefix)
+        hit = hit and key in _seen_prefixes
+        _seen_prefixes[key] = None
+        _seen_prefixes.move_to_end(key)
+        if len(_seen_prefixes) > config.prefix_cache_size:
+            _seen_prefixes.popitem(last=False)
+        if hit:
+            cached = approx_tokens(prefix)
+    total = approx_tokens("".join(str(m.get("content", "")) for m in messages))
+    return cached // 128 * 128 if total >= 1024 and cached >= 1024 else 0
+
+# ============================================================================
+# App
+# ============================================================================
+
+app = FastAPI(title="Mock LLM / IQL Space")
+
+
+class ChatRequest(BaseModel):
+    model: str = "mock"
+    messages: List[Dict[str, Any]]
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+    stream: bool = False
+
+
+class PredictRequest(BaseModel):
+    inputs: str
+    parameters: Optional[Dict[str, Any]] = None
+
+
+class PredictBatchRequest(BaseModel):
+    inputs: Optional[List[str]] = None
+    states: Optional[List[List[float]]] = None
+
+
+class EmbedRequest(BaseModel):
+    texts: List[str]
+    normalize: bool = True
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(req: ChatRequest):
+    await simulate()
+    text = mock_completion_text(req.messages)
+    if req.max_tokens:
+        text = " ".join(text.split()[: max(1, req.max_tokens)])
+    completion_id = f"chatcmpl-mock-{_digest(text) % 10**12}"
+    created = int(time.time())
+    prompt_tokens = approx_tokens("".join(str(m.get("content", "")) for m in req.messages))
+
+    if not req.stream:
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": req.model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": approx_tokens(text),
+                "total_tokens": prompt_tokens + approx_tokens(text),
+                "prompt_tokens_details": {"cached_tokens": mock_cached_tokens(req.messages)},
+            },
+        }
+
+    async def events():
+        words = text.split(" ")
+        per_token = sample_latency_s() / max(1, len(words)) / 4
+        for i, word in enumerate(words):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": req.model,
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(per_token)
+        done = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": req.model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        yield f"data: {json.dumps(done)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model", "owned_by": "mock"}]}
+
+
+# Fixed random projection so Q-values vary smoothly with the state
+_Q_PROJECTION = np.random.default_rng(1234).standard_normal((EMBED_DIM, len(POLICY_NAMES))).astype(np.float32)
+
+
+def mock_state(inputs: Optional[str]) -> np.ndarray:
+    if inputs == "START" or not inputs:
+        return np.zeros(EMBED_DIM, dtype=np.float32)
+    return np.mean([mock_embedding(m.strip()) for m in inputs.split("|")], axis=0)
+
+
+def mock_prediction(state: np.ndarray) -> Dict[str, Any]:
+    q_vals = (np.asarray(state, dtype=np.float32) @ _Q_PROJECTION).tolist()
+    best = int(np.argmax(q_vals))
+    return {"policy": POLICY_NAMES[best], "q_values": dict(zip(POLICY_NAMES, q_vals))}
+
+
+@app.post("/")
+async def predict(req: PredictRequest):
+    await simulate(loading_applies=True)
+    return mock_prediction(mock_state(req.inputs))
+
+
+@app.post("/predict_batch")
+async def predict_batch(req: PredictBatchRequest):
+    await simulate(loading_applies=True)
+    if (req.inputs is None) == (req.states is None):
+        raise HTTPException(status_code=422, detail="Provide exactly one of 'inputs' or 'states'")
+    states = [mock_state(t) for t in req.inputs] if req.inputs is not None else req.states
+    results = [mock_prediction(s) for s in states]
+    return {"results": results, "count": len(results), "compute_ms": 0.0}
+
+
+@app.post("/embed")
+async def embed(req: EmbedRequest):
+    await simulate(loading_applies=True)
+    embeddings = [mock_embedding(t, req.normalize).tolist() for t in req.texts]
+    return {"embeddings": embeddings, "dimension": EMBED_DIM}
+
+
+@app.get("/health")
+async def health():
+    loading = time.time() - started_at < config.loading_seconds
+    return {
+        "status": "ok",
+        "model_loaded": not loading,
+        "runtime": "mock",
+        "config": vars(config),
+        "stats": stats,
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Deterministic mock of OpenAI + the IQL Space for load testing.")
+    ap.add_argument("--host", default="localhost")
+    ap.add_argument("--port", type=int, default=8100)
+    ap.add_argument("--latency-ms", type=float, default=None)
+    ap.add_argument("--latency-dist", choices=["fixed", "uniform", "lognormal"], default=None)
+    ap.add_argument("--error-rate", type=float, default=None)
+    ap.add_argument("--loading-seconds", type=float, default=None)
+    ap.add_argument("--seed", type=int, default=None)
+    args = ap.parse_args()
+
+    # CLI flags override the environment
+    for flag, attr in [("latency_ms", "latency_ms"), ("latency_dist", "latency_dist"),
+                       ("error_rate", "error_rate"), ("loading_seconds", "loading_seconds"), ("seed", "seed")]:
+        value = getattr(args, flag)
+        if value is not None:
+            setattr(config, attr, value)
+    rng.seed(config.seed)
+    started_at = time.time()
+
+    print(f"[MOCK] Serving on http://{args.host}:{args.port} with {vars(config)}")
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,129 @@
+"""
+Single-flight model warmup manager
+
+Replaces the fire-and-forget preload threads: every caller shares one warmup
+run, and its progress is reported through explicit states (cold, loading,
+ready, failed) with per-step timings so the readiness endpoint can be polled
+by load balancers and the frontend.
+"""
+
+import threading
+import time
+import traceback
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Warmup states
+COLD = "cold"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+# (name, callable, required) - a failing optional step is recorded but does
+# not mark the whole warmup as failed
+WarmupStep = Tuple[str, Callable[[], None], bool]
+
+
+class WarmupManager:
+    """
+    Runs a fixed list of warmup steps at most once at a time.
+
+    Concurrent calls to start() while a run is in flight all receive the same
+    Future, so the models are never loaded twice. A failed run can be retried
+    by calling start() again.
+    """
+
+    def __init__(self, steps: List[WarmupStep]):
+        self._steps = list(steps)
+        self._lock = threading.Lock()
+        self._future: Optional[Future] = None
+        self.state = COLD
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.steps: Dict[str, dict] = {}
+        self._reset_steps()
+
+    def _reset_steps(self):
+        self.steps = {
+            name: {"state": COLD, "required": required, "duration_s": None, "error": None}
+            for name, _, required in self._steps
+        }
+
+    def start(self) -> Future:
+        """Start warmup if cold (or failed); otherwise return the in-flight/finished run"""
+        with self._lock:
+            if self._future is not None and self.state != FAILED:
+                return self._future
+
+            self._future = Future()
+            self.state = LOADING
+            self.started_at = time.time()
+            self.finished_at = None
+            self.error = None
+            self._reset_steps()
+
+            thread = threading.Thread(target=self._run, args=(self._future,), name="model-warmup", daemon=True)
+            thread.start()
+            print("[WARMUP] Warmup started")
+            return self._future
+
+    def _run(self, future: Future):
+        failed_required = []
+        for name, fn, required in self._steps:
+            step = self.steps[name]
+            step["state"] = LOADING
+            t0 = time.time()
+            try:
+                fn()
+                step["state"] = READY
+            except Exception as e:
+                step["state"] = FAILED
+                step["error"] = str(e)
+                print(f"[WARMUP] Step '{name}' failed: {e}")
+                traceback.print_exc()
+                if required:
+                    failed_required.append(name)
+            finally:
+                step["duration_s"] = round(time.time() - t0, 3)
+                print(f"[WARMUP] Step '{name}' -> {step['state']} ({step['duration_s']:.2f}s)")
+
+        with self._lock:
+            self.finished_at = time.time()
+            if failed_required:
+                self.state = FAILED
+                self.error = f"Required warmup steps failed: {', '.join(failed_required)}"
+            else:
+                self.state = READY
+            print(f"[WARMUP] Warmup {self.state} in {self.finished_at - self.started_at:.2f}s")
+
+        future.set_result(self.state)
+
+    def wait(self, timeout: Optional[float] = None) -> str:
+        """Start warmup if needed and block until it finishes (or timeout); returns the state"""
+        future = self.start()
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            return self.state
+
+    def is_ready(self) -> bool:
+        return self.state == READY
+
+    def status(self) -> dict:
+        """Snapshot of warmup state and timings for the readiness endpoint"""
+        with self._lock:
+            if self.started_at is None:
+                elapsed = None
+            else:
+                elapsed = round((self.finished_at or time.time()) - self.started_at, 3)
+            return {
+                "state": self.state,
+                "ready": self.state == READY,
+                "started_at": datetime.utcfromtimestamp(self.started_at).isoformat() if self.started_at else None,
+                "finished_at": datetime.utcfromtimestamp(self.finished_at).isoformat() if self.finished_at else None,
+                "elapsed_s": elapsed,
+                "error": self.error,
+                "steps": {name: dict(step) for name, step in self.steps.items()},
+            }
@@ -1,17 +1,14 @@
-import ollama
+from ollama_client import ollama_chat
 from GeneratorModel import GeneratorModel
+from dialogue_vector_store import get_vector_store
+from utterance_analysis import UtteranceAnalyzer, yes_no
+from conversation_memory import ConversationManager
 import argparse
-import torch
-import pickle
 #from em_retriever import *
 import json
-from sentence_transformers import SentenceTransformer
-import faiss
-import numpy as np
 import os
-from typing import List, Dict, Optional
+from typing import Optional
 import time
-import random
 import logging
 import sys
 from datetime import datetime
@@ -37,9 +34,11 @@ logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
-for module in ['urllib3', 'requests', 'http.client', 'asyncio', 'websockets']:
+for module in ['urllib3', 'requests', 'http.client', 'asyncio', 'websockets', 'httpx', 'httpcore']:
     logging.getLogger(module).setLevel(logging.ERROR)
 
+OLLAMA_CHAT_MODEL = "llama3.2:latest"  # served from OLLAMA_HOST, see ollama_client.py
+
 prompt_1 = """System: The following conversation is between a Fire Department Agent and a TownPerson {name} who needs to be rescued during a fire emergency. 
 Here is the persona of {name}:
 {persona}
@@ -81,184 +80,9 @@ You are the Fire Department Agent. Generate a single response to {name}'s messag
 
 Format your output as a direct response without any name prefix or additional context."""
 
-class DialogueVectorStore:
-    def __init__(self):
-        self.character_responses = {}
-        self.operator_responses = {}
-        self.operator_response_categories = ['greetings', 'progression', 'observations', 'closing', 'emphasize_danger', 'emphasize_value_of_life', 'give_up_persuading']
-        self.character_response_categories = ['greetings', 'response_to_operator_greetings', 'progression', 'observations', 'general', 'closing']
-        # Initialize sentence transformer for semantic similarity
-        self.encoder = SentenceTransformer('all-MiniLM-L6-v2')
-        
-    def add_dialogues(self, file_path):
-        """Load character responses from JSONL file."""
-        try:
-            with open(file_path, 'r') as file:
-                for line_num, line in enumerate(file, 1):
-                    # Skip empty lines
-                    line = line.strip()
-                    if not line:
-                        continue
-                        
-                    try:
-                        data = json.loads(line)
-                        try:
-                            if data['character'] == 'operator':
-                                # Store operator responses
-                                for category in self.operator_response_categories:
-                                    if category in data:
-                                        if category not in self.operator_responses:
-                                            self.operator_responses[category] = []
-                                        self.operator_responses[category].extend(data[category])
-                        except:
-                            import pdb; pdb.set_trace()
-                        else:
-                            # Store character responses
-                            for category in self.character_response_categories:
-                                if category not in data:
-                                    data[category] = []
-                            self.character_responses[data['character']] = data
-                    except json.JSONDecodeError as e:
-                        logging.warning(f"Skipping invalid JSON at line {line_num}: {str(e)}")
-                        continue
-                        
-            if not self.character_responses:
-                logging.warning("No valid character responses were loaded")
-            else:
-                logging.info(f"Loaded responses for characters: {list(self.character_responses.keys())}")
-                logging.info(f"Loaded operator responses for contexts: {list(self.operator_responses.keys())}")
-                
-        except Exception as e:
-            logging.error(f"Error loading dialogues: {str(e)}")
-            raise
-
-    def search(self, query: str, character: str = None, k: int = 3) -> List[Dict]:
-        """Search for relevant dialogue entries based on keywords."""
-        results = []
-        
-        # Convert query to lowercase for case-insensitive matching
-        query = query.lower()
-        
-        # Determine which category to search based on keywords
-        category = None
-        if "greeting" in query:
-            category = 'greetings'
-        elif "evacuation" in query or "leave" in query:
-            category = 'progression'
-        elif "see" in query or "smoke" in query or "fire" in query:
-            category = 'observations'
-        elif "goodbye" in query or "bye" in query:
-            category = 'closing'
-        elif "operator" in query or "response" in query:
-            category = 'response_to_operator_greetings'
-        else:
-            category = 'general'
-
-        # If character is specified, only search that character's responses
-        if character and character in self.character_responses:
-            responses = self.character_responses[character].get(category, [])
-            for response in responses[:k]:
-                results.append({
-                    'speaker': character,
-                    'content': response,
-                    'character': character,
-                    'context': category
-                })
-        else:
-            # Search all characters
-            for char, data in self.character_responses.items():
-                responses = data.get(category, [])
-                for response in responses[:k]:
-                    results.append({
-                        'speaker': char,
-                        'content': response,
-                        'character': char,
-                        'context': category
-                    })
-                    if len(results) >= k:
-                        break
-                if len(results) >= k:
-                    break
-
-        return results[:k]
-
-    def get_response(self, character, category):
-        """Get a response for a specific character and category."""
-        if character not in self.character_responses:
-            raise ValueError(f"Character {character} not found")
-        
-        if category not in self.response_categories:
-            raise ValueError(f"Category {category} not valid")
-            
-        responses = self.character_responses[character].get(category, [])
-        return random.choice(responses) if responses else ""
-
-    def get_character_context(self, character):
-        """Get all responses for a character for context."""
-        if character not in self.character_responses:
-            return ""
-        
-        context = []
-        for category in self.response_categories:
-            responses = self.character_responses[character].get(category, [])
-            if responses:
-                context.extend(responses)
-        return " ".join(context)
-
-    def get_operator_response(self, context: str) -> str:
-        """Get a response for the operator/agent based on context."""
-        if context not in self.operator_responses or not self.operator_responses[context]:
-            context = 'general'  # fallback to general responses
-            
-        responses = self.operator_responses.get(context, [])
-        if not responses:
-            return "I understand. Please proceed with evacuation for your safety."
-            
-        return random.choice(responses)
-
-
-class ConversationManager:
-    def __init__(self):
-        self.conversations: Dict[str, List[Dict]] = {}
-        
-    def add_message(self, session_id: str, speaker: str, content: str):
-        """Add a message to the conversation history."""
-        if session_id not in self.conversations:
-            self.conversations[session_id] = []
-            
-        self.conversations[session_id].append({
-            'speaker': speaker,
-            'content': content,
-            'timestamp': time.time()
-        })
-        
-    def get_history(self, session_id: str, max_turns: int = 7) -> str:
-        """Get formatted conversation history."""
-        if session_id not in self.conversations:
-            print(f"No conversation found for session ID: {session_id}")
-            return ""
-            
-        history = self.conversations[session_id][-max_turns:]
-        print(f"Found {len(history)} messages for session ID: {session_id}")
-        for i, msg in enumerate(history):
-            print(f"Message {i+1}: {msg['speaker']}: {msg['content']}")
-        
-        return "\n".join([f"{msg['speaker']}: {msg['content']}" for msg in history])
-
-# Initialize global instances
-vector_store = DialogueVectorStore()
+# Initialize global instances (the dialogue store and its encoder load lazily on first use)
 conversation_manager = ConversationManager()
 
-# Load dialogues if the file exists
-dialogue_file = 'data_for_train/characterlines.jsonl'
-if os.path.exists(dialogue_file):
-    
-    vector_store.add_dialogues(dialogue_file)
-   
-else:
-    logging.error(f"Warning: Dialogue file not found at {dialogue_file}")
-    logging.error(f"Current working directory: {os.getcwd()}")
-
 
 prompt_rag = """System: You are a Fire Department Agent speaking with TownPerson {name} during a fire emergency.
 
@@ -274,13 +98,21 @@ Current conversation history:
 Based on {name}'s background and the conversation examples, you are the operator to provide an intial greeting for fire rescue.
 Format your output as a direct response without any name prefix or additional context."""
 
-def send_to_ollama(prompt: str) -> str:
+def send_to_ollama(prompt: str, temperature: Optional[float] = None, max_tokens: Optional[int] = None) -> str:
     """Query the Ollama model with the given prompt."""
-    response = ollama.chat(model="llama3.2:latest", messages=[{
+    return ollama_chat([{
+        'role': 'user',
+        'content': prompt,
+    }], model=OLLAMA_CHAT_MODEL, temperature=temperature, max_tokens=max_tokens)
+
+def send_to_ollama_json(prompt: str) -> str:
+    """Query Ollama in JSON mode (deterministic, for structured classification)."""
+    return ollama_chat([{
         'role': 'user',
         'content': prompt,
-    }])
-    return response['message']['content'].strip()
+    }], model=OLLAMA_CHAT_MODEL, format="json", temperature=0)
+
+utterance_analyzer = UtteranceAnalyzer(send_to_ollama_json)
 
 def clean_response(response: str) -> str:
     """Clean up model response by removing prefixes and system messages."""
@@ -327,7 +159,7 @@ def simulate_dual_role_conversation(
     history = f"Agent: {initial_response}\n"
     
     # Add retrieved info for initial greeting
-    operator_greetings = vector_store.operator_responses.get('greetings', [])
+    operator_greetings = get_vector_store().operator_responses.get('greetings', [])
     retrieved_info_list.append({
         'speaker': 'Agent',
         'category': 'greetings',
@@ -844,7 +676,7 @@ def simulate_dual_role_conversation(
         # Get relevant examples based on the category
         if turn["speaker"] == name:
             # Get character-specific examples
-            responses = vector_store.character_responses[character.lower()].get(turn["category"], [])
+            responses = get_vector_store().character_responses[character.lower()].get(turn["category"], [])
             context = f"Category: {turn['category']}\nSpeaker: {name}\n\nExample responses:\n" + "\n".join([f"- {response}" for response in responses])
             retrieved_info_list.append({
                 'speaker': name,
@@ -854,7 +686,7 @@ def simulate_dual_role_conversation(
             })
         else:
             # Get operator examples
-            responses = vector_store.operator_responses.get(turn["category"], [])
+            responses = get_vector_store().operator_responses.get(turn["category"], [])
             context = f"Category: {turn['category']}\nSpeaker: Agent\n\nExample responses:\n" + "\n".join([f"- {response}" for response in responses])
             retrieved_info_list.append({
                 'speaker': 'Agent',
@@ -902,7 +734,7 @@ def simulate_interactive_single_turn(town_person, user_input, speaker, persona,
     name = town_person.lower()
     character = town_person.lower()
     
-    print(f"simulate_interactive_single_turn called for {town_person} with speaker={speaker}")
+    logging.debug(f"simulate_interactive_single_turn called for {town_person} with speaker={speaker}")
     
     # Use provided session_id or create a new one
     if session_id is None:
@@ -910,13 +742,12 @@ def simulate_interactive_single_turn(town_person, user_input, speaker, persona,
     
     # Then get the complete history INCLUDING the just-added message
     history = conversation_manager.get_history(session_id)
-    print(f'Current history after adding user input: {history}')
    
     # Get responses based on speaker
     if speaker == "Operator" or speaker == "Julie":
-        responses = vector_store.operator_responses.get(turn["category"], [])
+        responses = get_vector_store().operator_responses.get(turn["category"], [])
     else:
-        responses = vector_store.character_responses[character.lower()].get(turn["category"], [])
+        responses = get_vector_store().character_responses[character.lower()].get(turn["category"], [])
     
     context = f"Category: {turn['category']}\nSpeaker: {name}\n\nExample responses:\n" + "\n".join([f"- {response}" for response in responses])
     #print(f'category: {turn["category"]}, session_id: {session_id}, history lines: {(history.count("\n")+1) if history else 0}')
@@ -937,78 +768,54 @@ def simulate_interactive_single_turn(town_person, user_input, speaker, persona,
         "speaker": town_person.lower()
     }
     
-    print(f"Created retrieved_info dictionary for {town_person} with keys: {retrieved_info.keys()}")
-    
     # Add the response to conversation history
     conversation_manager.add_message(session_id, response_speaker, response)
-    print(f'Added response to history: {response_speaker}: {response}')
-    
-    # Get updated history count for debugging
-    updated_history = conversation_manager.get_history(session_id)
-    print(f'Updated history after adding response: {updated_history}')
-    #print(f'Total messages in conversation: {updated_history.count("\n")+1 if updated_history else 0}')
+    logging.debug(f'Added response to history: {response_speaker}: {response}')
 
     return response, retrieved_info
 
 
-def decision_making(history, name):
-    if name =='ross' or name == 'niki':
-        num = 1
-    else:
-        num = 2
-    messages = history.split('\n')
+def analyze_utterance(text, name=None):
+    """All yes/no labels for a text in one cached LLM call (see utterance_analysis.py)"""
+    return utterance_analyzer.analyze(text, name)
+
+def recent_resident_messages(history, name):
+    """The resident's last message (last two for characters other than ross/niki)"""
+    num = 1 if name in ('ross', 'niki') else 2
     town_person_messages = []
-    for message in messages:
-        message = message.lower()
-        if message.startswith(f'{name}'):
-            message = message.split(':')[-1].strip()
-            town_person_messages.append(message)
-    last_messages = town_person_messages[-num:]
-    recent_history = '  '.join(last_messages)
-    print(f"recent_history: {recent_history}")
-    prompt = f"{name} says:{recent_history}, determine if {name} is leaving/going/being evacuated or not. If {name} is leaving/going/being evacuated, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_ollama(prompt))
-    return response
+    for message in history.split('\n'):
+        if message.lower().startswith(f'{name}'):
+            town_person_messages.append(message.split(':')[-1].strip())
+    return town_person_messages[-num:]
+
+def decision_making(history, name):
+    # Judge only the resident's most recent message(s), not the whole conversation
+    recent_history = '\n'.join(f"{name}: {m}" for m in recent_resident_messages(history, name))
+    return yes_no(analyze_utterance(recent_history, name)["leaving"])
 
 def emphasize_danger_check(history):
-    prompt = f"Based on the previous utterance {history}, determine if this utterance is emphasizing danger. If so, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_ollama(prompt))
-    return response
+    return yes_no(analyze_utterance(history)["emphasizes_danger"])
 
 def emphasize_value_of_life_check(history):
-    prompt = f"Based on the previous utterance {history}, determine if this utterance is emphasizing the value of life. If so, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_ollama(prompt))
-    return response
+    return yes_no(analyze_utterance(history)["emphasizes_value_of_life"])
 
 def mentions_fire_check(history):
-    prompt = f"Based on the previous utterance {history}, determine if this utterance mentions fire. If so, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_ollama(prompt))
-    return response
+    return yes_no(analyze_utterance(history)["mentions_fire"])
 
 def keep_asking_questions_check(history):
-    prompt = f"Based on the previous utterance {history}, determine if this utterance is asking about the fire conditions. If so, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_ollama(prompt))
-    return response
+    return yes_no(analyze_utterance(history)["asks_about_fire_conditions"])
 
 def ending_conversation_check(history):
-    prompt = f"Based on the previous utterance {history}, determine if the current message is the end of the conversation, for example, if the operator says thanks or goodbye or something similar, it means the conversation is ending. If the conversation is ending, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_ollama(prompt))
-    return response
+    return yes_no(analyze_utterance(history)["ending_conversation"])
 
 def ask_about_children_check(history):
-    prompt = f"Based on the previous utterance {history}, determine if this utterance asks about children. If so, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_ollama(prompt))
-    return response
+    return yes_no(analyze_utterance(history)["asks_about_children"])
 
 def ask_about_parents_check(history):
-    prompt = f"Based on the previous utterance {history}, determine if this utterance asks about parents. If so, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_ollama(prompt))
-    return response
+    return yes_no(analyze_utterance(history)["asks_about_parents"])
 
 def engagement_check(history):
-    prompt = f"Based on this utterance {history}, determine if the operator expresses he would like to leave if he is in the situation. If the operator expresses he would like to leave, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_ollama(prompt))
-    return response
+    return yes_no(analyze_utterance(history)["operator_would_leave"])
 
 def setup_logging(output_file):
     # Create a logger
@@ -1048,6 +855,8 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     # Configure device
+    import torch
+
     if args.use_mps and torch.backends.mps.is_available():
         device = "mps"
         print("Using MPS backend for inference.")
@@ -1,17 +1,15 @@
 from openai import OpenAI
 from GeneratorModel import GeneratorModel
+from dialogue_vector_store import get_vector_store
+from utterance_analysis import UtteranceAnalyzer, yes_no
+from conversation_memory import ConversationManager
+from prompt_builder import PROMPT_TOKEN_BUDGET, render, trim_history_text
 import argparse
-import torch
-import pickle
 #from em_retriever import *
 import json
-from sentence_transformers import SentenceTransformer
-import faiss
-import numpy as np
 import os
-from typing import List, Dict, Optional
+from typing import Optional
 import time
-import random
 import logging
 import sys
 from datetime import datetime
@@ -95,184 +93,9 @@ You are the Fire Department Agent. Generate a single response to {name}'s messag
 
 Format your output as a direct response without any name prefix or additional context."""
 
-class DialogueVectorStore:
-    def __init__(self):
-        self.character_responses = {}
-        self.operator_responses = {}
-        self.operator_response_categories = ['greetings', 'progression', 'observations', 'closing', 'emphasize_danger', 'emphasize_value_of_life', 'give_up_persuading']
-        self.character_response_categories = ['greetings', 'response_to_operator_greetings', 'progression', 'observations', 'general', 'closing']
-        # Initialize sentence transformer for semantic similarity
-        self.encoder = SentenceTransformer('all-MiniLM-L6-v2')
-        
-    def add_dialogues(self, file_path):
-        """Load character responses from JSONL file."""
-        try:
-            with open(file_path, 'r') as file:
-                for line_num, line in enumerate(file, 1):
-                    # Skip empty lines
-                    line = line.strip()
-                    if not line:
-                        continue
-                        
-                    try:
-                        data = json.loads(line)
-                        try:
-                            if data['character'] == 'operator':
-                                # Store operator responses
-                                for category in self.operator_response_categories:
-                                    if category in data:
-                                        if category not in self.operator_responses:
-                                            self.operator_responses[category] = []
-                                        self.operator_responses[category].extend(data[category])
-                        except:
-                            import pdb; pdb.set_trace()
-                        else:
-                            # Store character responses
-                            for category in self.character_response_categories:
-                                if category not in data:
-                                    data[category] = []
-                            self.character_responses[data['character']] = data
-                    except json.JSONDecodeError as e:
-                        logging.warning(f"Skipping invalid JSON at line {line_num}: {str(e)}")
-                        continue
-                        
-            if not self.character_responses:
-                logging.warning("No valid character responses were loaded")
-            else:
-                logging.info(f"Loaded responses for characters: {list(self.character_responses.keys())}")
-                logging.info(f"Loaded operator responses for contexts: {list(self.operator_responses.keys())}")
-                
-        except Exception as e:
-            logging.error(f"Error loading dialogues: {str(e)}")
-            raise
-
-    def search(self, query: str, character: str = None, k: int = 3) -> List[Dict]:
-        """Search for relevant dialogue entries based on keywords."""
-        results = []
-        
-        # Convert query to lowercase for case-insensitive matching
-        query = query.lower()
-        
-        # Determine which category to search based on keywords
-        category = None
-        if "greeting" in query:
-            category = 'greetings'
-        elif "evacuation" in query or "leave" in query:
-            category = 'progression'
-        elif "see" in query or "smoke" in query or "fire" in query:
-            category = 'observations'
-        elif "goodbye" in query or "bye" in query:
-            category = 'closing'
-        elif "operator" in query or "response" in query:
-            category = 'response_to_operator_greetings'
-        else:
-            category = 'general'
-
-        # If character is specified, only search that character's responses
-        if character and character in self.character_responses:
-            responses = self.character_responses[character].get(category, [])
-            for response in responses[:k]:
-                results.append({
-                    'speaker': character,
-                    'content': response,
-                    'character': character,
-                    'context': category
-                })
-        else:
-            # Search all characters
-            for char, data in self.character_responses.items():
-                responses = data.get(category, [])
-                for response in responses[:k]:
-                    results.append({
-                        'speaker': char,
-                        'content': response,
-                        'character': char,
-                        'context': category
-                    })
-                    if len(results) >= k:
-                        break
-                if len(results) >= k:
-                    break
-
-        return results[:k]
-
-    def get_response(self, character, category):
-        """Get a response for a specific character and category."""
-        if character not in self.character_responses:
-            raise ValueError(f"Character {character} not found")
-        
-        if category not in self.response_categories:
-            raise ValueError(f"Category {category} not valid")
-            
-        responses = self.character_responses[character].get(category, [])
-        return random.choice(responses) if responses else ""
-
-    def get_character_context(self, character):
-        """Get all responses for a character for context."""
-        if character not in self.character_responses:
-            return ""
-        
-        context = []
-        for category in self.response_categories:
-            responses = self.character_responses[character].get(category, [])
-            if responses:
-                context.extend(responses)
-        return " ".join(context)
-
-    def get_operator_response(self, context: str) -> str:
-        """Get a response for the operator/agent based on context."""
-        if context not in self.operator_responses or not self.operator_responses[context]:
-            context = 'general'  # fallback to general responses
-            
-        responses = self.operator_responses.get(context, [])
-        if not responses:
-            return "I understand. Please proceed with evacuation for your safety."
-            
-        return random.choice(responses)
-
-
-class ConversationManager:
-    def __init__(self):
-        self.conversations: Dict[str, List[Dict]] = {}
-        
-    def add_message(self, session_id: str, speaker: str, content: str):
-        """Add a message to the conversation history."""
-        if session_id not in self.conversations:
-            self.conversations[session_id] = []
-            
-        self.conversations[session_id].append({
-            'speaker': speaker,
-            'content': content,
-            'timestamp': time.time()
-        })
-        
-    def get_history(self, session_id: str, max_turns: int = 7) -> str:
-        """Get formatted conversation history."""
-        if session_id not in self.conversations:
-            print(f"No conversation found for session ID: {session_id}")
-            return ""
-            
-        history = self.conversations[session_id][-max_turns:]
-        print(f"Found {len(history)} messages for session ID: {session_id}")
-        for i, msg in enumerate(history):
-            print(f"Message {i+1}: {msg['speaker']}: {msg['content']}")
-        
-        return "\n".join([f"{msg['speaker']}: {msg['content']}" for msg in history])
-
-# Initialize global instances
-vector_store = DialogueVectorStore()
+# Initialize global instances (the dialogue store and its encoder load lazily on first use)
 conversation_manager = ConversationManager()
 
-# Load dialogues if the file exists
-dialogue_file = 'data_for_train/characterlines.jsonl'
-if os.path.exists(dialogue_file):
-    
-    vector_store.add_dialogues(dialogue_file)
-   
-else:
-    logging.error(f"Warning: Dialogue file not found at {dialogue_file}")
-    logging.error(f"Current working directory: {os.getcwd()}")
-
 
 prompt_rag = """System: You are a Fire Department Agent speaking with TownPerson {name} during a fire emergency.
 
@@ -305,6 +128,22 @@ def send_to_openai(prompt: str, model: str = "gpt-4o-mini") -> str:
         logging.error(f"Error calling OpenAI API: {str(e)}")
         raise
 
+def send_to_openai_json(prompt: str, model: str = "gpt-4o-mini") -> str:
+    """Query OpenAI in JSON mode (deterministic, short output, for structured classification)."""
+    response = client.chat.completions.create(
+        model=model,
+        messages=[{
+            'role': 'user',
+            'content': prompt,
+        }],
+        temperature=0,
+        max_tokens=200,
+        response_format={"type": "json_object"},
+    )
+    return response.choices[0].message.content.strip()
+
+utterance_analyzer = UtteranceAnalyzer(send_to_openai_json)
+
 def clean_response(response: str) -> str:
     """Clean up model response by removing prefixes and system messages."""
     response = response.strip()
@@ -337,7 +176,8 @@ def simulate_dual_role_conversation(
     retrieved_info_list = []
     
     # Initial operator greeting
-    greeting_prompt = prompt_rag.format(
+    greeting_prompt = render(
+        prompt_rag,
         name=name,
         persona=persona,
         context="Example greeting: Hello hi, this is Fire Department dispatcher Tanay. Are you okay?",
@@ -350,7 +190,7 @@ def simulate_dual_role_conversation(
     history = f"Agent: {initial_response}\n"
     
     # Add retrieved info for initial greeting
-    operator_greetings = vector_store.operator_responses.get('greetings', [])
+    operator_greetings = get_vector_store().operator_responses.get('greetings', [])
     retrieved_info_list.append({
         'speaker': 'Agent',
         'category': 'greetings',
@@ -950,11 +790,12 @@ def simulate_dual_role_conversation(
             ]
     for turn in conversation_structure:
         # Generate response using the original prompt
-        prompt = turn["prompt"].format(
+        prompt = render(
+            turn["prompt"],
             name=name,
             persona=persona,
             context='',
-            history=history
+            history=trim_history_text(history, PROMPT_TOKEN_BUDGET)
         )
         
         # print(f"\nGenerating response for {turn['speaker']}...")
@@ -988,7 +829,7 @@ def simulate_interactive_single_turn(town_person, user_input, speaker, persona,
     name = town_person.lower()
     character = town_person.lower()
     
-    print(f"simulate_interactive_single_turn called for {town_person} with speaker={speaker}")
+    logging.debug(f"simulate_interactive_single_turn called for {town_person} with speaker={speaker}")
     
     # Use provided session_id or create a new one
     if session_id is None:
@@ -996,21 +837,21 @@ def simulate_interactive_single_turn(town_person, user_input, speaker, persona,
     
     # Then get the complete history INCLUDING the just-added message
     history = conversation_manager.get_history(session_id)
-    print(f'Current history after adding user input: {history}')
    
     # Get responses based on speaker
     if speaker == "Operator" or speaker == "Julie":
-        responses = vector_store.operator_responses.get(turn["category"], [])
+        responses = get_vector_store().operator_responses.get(turn["category"], [])
     else:
-        responses = vector_store.character_responses[character.lower()].get(turn["category"], [])
+        responses = get_vector_store().character_responses[character.lower()].get(turn["category"], [])
     
     context = f"Category: {turn['category']}\nSpeaker: {name}\n\nExample responses:\n" + "\n".join([f"- {response}" for response in responses])
     #print(f'category: {turn["category"]}, session_id: {session_id}, history lines: {(history.count("\n")+1) if history else 0}')
-    prompt = turn["prompt"].format(
+    prompt = render(
+            turn["prompt"],
             name=name,
             persona=persona,
             context=context,
-            history=history
+            history=trim_history_text(history, PROMPT_TOKEN_BUDGET)
         )
 
     response = clean_response(send_to_openai(prompt))
@@ -1023,65 +864,43 @@ def simulate_interactive_single_turn(town_person, user_input, speaker, persona,
         "speaker": town_person.lower()
     }
     
-    print(f"Created retrieved_info dictionary for {town_person} with keys: {retrieved_info.keys()}")
-    
     # Add the response to conversation history
     conversation_manager.add_message(session_id, response_speaker, response)
-    print(f'Added response to history: {response_speaker}: {response}')
-    
-    # Get updated history count for debugging
-    updated_history = conversation_manager.get_history(session_id)
-    print(f'Updated history after adding response: {updated_history}')
-    #print(f'Total messages in conversation: {updated_history.count("\n")+1 if updated_history else 0}')
+    logging.debug(f'Added response to history: {response_speaker}: {response}')
 
     return response, retrieved_info
 
 
+def analyze_utterance(text, name=None):
+    """All yes/no labels for a text in one cached LLM call (see utterance_analysis.py)"""
+    return utterance_analyzer.analyze(text, name)
+
 def decision_making(history, name):
-    recent_history = history
-    prompt = f"Based on the previous conversation {recent_history}, determine if {name} is leaving/going/being evacuated or not. If {name} is leaving/going/being evacuated, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_openai(prompt))
-    return response
+    return yes_no(analyze_utterance(history, name)["leaving"])
 
 def emphasize_danger_check(history):
-    prompt = f"Based on the previous utterance {history}, determine if this utterance is emphasizing danger. If so, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_openai(prompt))
-    return response
+    return yes_no(analyze_utterance(history)["emphasizes_danger"])
 
 def emphasize_value_of_life_check(history):
-    prompt = f"Based on the previous utterance {history}, determine if this utterance is emphasizing the value of life. If so, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_openai(prompt))
-    return response
+    return yes_no(analyze_utterance(history)["emphasizes_value_of_life"])
 
 def mentions_fire_check(history):
-    prompt = f"Based on the previous utterance {history}, determine if this utterance mentions fire. If so, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_openai(prompt))
-    return response
+    return yes_no(analyze_utterance(history)["mentions_fire"])
 
 def keep_asking_questions_check(history):
-    prompt = f"Based on the previous utterance {history}, determine if this utterance is asking about the fire conditions. If so, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_openai(prompt))
-    return response
+    return yes_no(analyze_utterance(history)["asks_about_fire_conditions"])
 
 def ending_conversation_check(history):
-    prompt = f"Based on the previous conversation {history}, determine if the last message is the end of the conversation, for example, if the speaker says thanks or goodbye or something similar, it means the conversation is ending. If the conversation is ending, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_openai(prompt))
-    return response
+    return yes_no(analyze_utterance(history)["ending_conversation"])
 
 def ask_about_children_check(history):
-    prompt = f"Based on the previous utterance {history}, determine if this utterance asks about children. If so, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_openai(prompt))
-    return response
+    return yes_no(analyze_utterance(history)["asks_about_children"])
 
 def ask_about_parents_check(history):
-    prompt = f"Based on the previous utterance {history}, determine if this utterance asks about parents. If so, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_openai(prompt))
-    return response
+    return yes_no(analyze_utterance(history)["asks_about_parents"])
 
 def engagement_check(history):
-    prompt = f"Based on this utterance {history}, determine if the operator expresses he would like to leave if he is in the situation. If the operator expresses he would like to leave, respond with 'yes', if not, respond with 'no', only respond with 'yes' or 'no'."
-    response = clean_response(send_to_openai(prompt))
-    return response
+    return yes_no(analyze_utterance(history)["operator_would_leave"])
 
 def setup_logging(output_file):
     # Create a logger
@@ -1121,6 +940,8 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     # Configure device
+    import torch
+
     if args.use_mps and torch.backends.mps.is_available():
         device = "mps"
         print("Using MPS backend for inference.")
@@ -0,0 +1,257 @@
+"""
+Shared async Ollama client (keep-alive pool, streaming, bounded fan-out)
+
+Used by A07_simulate_with_iql_and_mavis.py (call_ollama) and ollama_0220.py
+(send_to_ollama, and through it server_keywords.py / server_local_model.py):
+
+  • one httpx.AsyncClient per event loop with a keep-alive connection pool to
+    OLLAMA_HOST, instead of a fresh blocking request per call
+  • temperature / max_tokens are passed as Ollama options (temperature,
+    num_predict) rather than dropped
+  • stream_generate() / stream_chat() yield tokens as Ollama produces them
+  • at most OLLAMA_NUM_PARALLEL requests are in flight per process (set it to
+    the server's OLLAMA_NUM_PARALLEL); generate_many() fans prompts out under
+    that cap, so batch simulations keep every server slot busy
+  • a sync facade (ollama_generate, ollama_chat, ollama_generate_many,
+    ollama_stream) runs the same client on a background event loop, so
+    threaded callers share one pool and one parallelism cap
+
+Usage:
+    from ollama_client import ollama_generate, get_ollama_client
+    text = ollama_generate(prompt, model="llama3", temperature=0.7, max_tokens=128)
+    async for token in get_ollama_client().stream_chat(messages): ...
+"""
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import weakref
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+import httpx
+
+
+def _normalize_host(host: str) -> str:
+    # OLLAMA_HOST is often set server-style ("0.0.0.0:11434") without a scheme
+    host = host.strip().rstrip("/")
+    return host if "://" in host else f"http://{host}"
+
+
+OLLAMA_HOST = _normalize_host(os.getenv("OLLAMA_HOST", "http://localhost:11434"))
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:latest")
+OLLAMA_NUM_PARALLEL = max(1, int(os.getenv("OLLAMA_NUM_PARALLEL", "4")))
+OLLAMA_TIMEOUT_S = float(os.getenv("OLLAMA_TIMEOUT_S", "90"))
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "10m")  # how long the server keeps the model loaded
+
+
+class OllamaError(RuntimeError):
+    """Ollama answered with an error payload"""
+
+
+def build_options(temperature: Optional[float] = None, max_tokens: Optional[int] = None,
+                  options: Optional[Dict] = None) -> Dict:
+    """Ollama "options" dict; explicit temperature / max_tokens win over options"""
+    opts = dict(options or {})
+    if temperature is not None:
+        opts["temperature"] = float(temperature)
+    if max_tokens is not None:
+        opts["num_predict"] = int(max_tokens)
+    return opts
+
+
+class OllamaClient:
+    def __init__(self, base_url: str = OLLAMA_HOST, max_parallel: int = OLLAMA_NUM_PARALLEL,
+                 timeout_s: float = OLLAMA_TIMEOUT_S, keep_alive: str = OLLAMA_KEEP_ALIVE):
+        self.base_url = base_url
+        self.max_parallel = max_parallel
+        self.timeout_s = timeout_s
+        self.keep_alive = keep_alive
+        # httpx clients and asyncio semaphores are bound to the loop that uses them
+        self._per_loop: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, tuple]" = weakref.WeakKeyDictionary()
+
+    def _session(self):
+        loop = asyncio.get_running_loop()
+        state = self._per_loop.get(loop)
+        if state is None:
+            client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout_s, connect=10.0),
+                limits=httpx.Limits(max_connections=self.max_parallel * 2,
+                                    max_keepalive_connections=self.max_parallel),
+            )
+            state = (client, asyncio.Semaphore(self.max_parallel))
+            self._per_loop[loop] = state
+        return state
+
+    def _payload(self, model: Optional[str], temperature, max_tokens, fmt, options, stream: bool) -> Dict:
+        payload = {
+            "model": model or OLLAMA_MODEL,
+            "stream": stream,
+            "options": build_options(temperature, max_tokens, options),
+            "keep_alive": self.keep_alive,
+        }
+        if fmt:
+            payload["format"] = fmt
+        return payload
+
+    async def _post(self, path: str, payload: Dict) -> Dict:
+        client, semaphore = self._session()
+        async with semaphore:
+            r = await client.post(path, json=payload)
+        r.raise_for_status()
+        obj = r.json()
+        if obj.get("error"):
+            raise OllamaError(obj["error"])
+        return obj
+
+    async def _stream(self, path: str, payload: Dict) -> AsyncIterator[str]:
+        client, semaphore = self._session()
+        async with semaphore:
+            async with client.stream("POST", path, json=payload) as r:
+                r.raise_for_status()
+                async for line in r.aiter_lines():
+                    if not line.strip():
+                        continue
+                    obj = json.loads(line)
+                    if obj.get("error"):
+                        raise OllamaError(obj["error"])
+                    token = obj.get("response") or (obj.get("message") or {}).get("content") or ""
+                    if token:
+                        yield token
+                    if obj.get("done"):
+                        break
+
+    # ------------------------------------------------------------------
+    # /api/generate
+    # ------------------------------------------------------------------
+    async def generate(self, prompt: str, model: Optional[str] = None, temperature: Optional[float] = None,
+                       max_tokens: Optional[int] = None, format: Optional[str] = None,
+                       system: Optional[str] = None, options: Optional[Dict] = None) -> str:
+        payload = self._payload(model, temperature, max_tokens, format, options, stream=False)
+        payload["prompt"] = prompt
+        if system:
+            payload["system"] = system
+        obj = await self._post("/api/generate", payload)
+        return (obj.get("response") or "").strip()
+
+    async def stream_generate(self, prompt: str, model: Optional[str] = None, temperature: Optional[float] = None,
+                              max_tokens: Optional[int] = None, system: Optional[str] = None,
+                              options: Optional[Dict] = None) -> AsyncIterator[str]:
+        payload = self._payload(model, temperature, max_tokens, None, options, stream=True)
+        payload["prompt"] = prompt
+        if system:
+            payload["system"] = system
+        async for token in self._stream("/api/generate", payload):
+            yield token
+
+    async def generate_many(self, prompts: List[str], return_exceptions: bool = False, **kwargs) -> List:
+        """Fan prompts out concurrently; the semaphore keeps at most max_parallel in flight"""
+        return await asyncio.gather(*(self.generate(p, **kwargs) for p in prompts),
+                                    return_exceptions=return_exceptions)
+
+    # ------------------------------------------------------------------
+    # /api/chat
+    # ------------------------------------------------------------------
+    async def chat(self, messages: List[Dict[str, str]], model: Optional[str] = None,
+                   temperature: Optional[float] = None, max_tokens: Optional[int] = None,
+                   format: Optional[str] = None, options: Optional[Dict] = None) -> str:
+        payload = self._payload(model, temperature, max_tokens, format, options, stream=False)
+        payload["messages"] = messages
+        obj = await self._post("/api/chat", payload)
+        return ((obj.get("message") or {}).get("content") or "").strip()
+
+    async def stream_chat(self, messages: List[Dict[str, str]], model: Optional[str] = None,
+                          temperature: Optional[float] = None, max_tokens: Optional[int] = None,
+                          options: Optional[Dict] = None) -> AsyncIterator[str]:
+        payload = self._payload(model, temperature, max_tokens, None, options, stream=True)
+        payload["messages"] = messages
+        async for token in self._stream("/api/chat", payload):
+            yield token
+
+    async def aclose(self):
+        """Close the pool of the current loop"""
+        state = self._per_loop.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state[0].aclose()
+
+
+# ============================================================================
+# Shared instance + sync facade
+# ============================================================================
+
+_client: Optional[OllamaClient] = None
+_client_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_ollama_client() -> OllamaClient:
+    """Process-wide client configured from the OLLAMA_* environment variables"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OllamaClient()
+                logging.info(f"Ollama client: {OLLAMA_HOST}, {OLLAMA_NUM_PARALLEL} parallel requests")
+    return _client
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """Event loop on a daemon thread that runs every sync call, so they share one pool"""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="ollama-client", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def _run(coro):
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
+
+
+def ollama_generate(prompt: str, **kwargs) -> str:
+    """Blocking generate(); safe to call from any thread (not from inside a running event loop)"""
+    return _run(get_ollama_client().generate(prompt, **kwargs))
+
+
+def ollama_chat(messages: List[Dict[str, str]], **kwargs) -> str:
+    return _run(get_ollama_client().chat(messages, **kwargs))
+
+
+def ollama_generate_many(prompts: List[str], **kwargs) -> List:
+    return _run(get_ollama_client().generate_many(prompts, **kwargs))
+
+
+def ollama_stream(prompt: str, **kwargs) -> Iterator[str]:
+    """Blocking iterator over generated tokens"""
+    tokens: "queue.Queue" = queue.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for token in get_ollama_client().stream_generate(prompt, **kwargs):
+                tokens.put(token)
+        except Exception as e:
+            tokens.put(e)
+        finally:
+            tokens.put(done)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), _background_loop())
+    try:
+        while True:
+            item = tokens.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Consumer stopped early (break / close / error): cancel the pump so its
+        # request is closed and the semaphore slot released
+        future.cancel()
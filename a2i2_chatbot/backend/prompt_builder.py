@@ -0,0 +1,254 @@
+"""
+Prompt assembly: compiled templates, token budgets, cached static prefixes
+
+Used by server.py (build_prompt, generate_natural_closing,
+generate_personalized_scenario) and ollama_0220_openai.py (the dual-role and
+interactive prompt templates):
+
+  • compile_template() parses a str.format-style template once; render() then
+    only joins literal segments and values (same output as str.format)
+  • count_tokens() uses tiktoken when it is installed (encoding for
+    PROMPT_TOKENIZER_MODEL), otherwise a ~4 characters/token estimate
+  • trim_lines() / fit_examples() drop the oldest history lines and the
+    lowest-ranked examples until they fit a token budget
+  • PromptBuilder renders the static instruction prefix once per set of static
+    values and reuses the identical string, so provider-side prefix caching
+    sees the same leading tokens on every call
+  • BuiltPrompt.messages() puts the static prefix in its own system message.
+    That message is the only part shared across turns (the examples are
+    retrieved per resident message and the history window slides), so it is
+    what provider-side caching can reuse, and only once it is 1024+ tokens;
+    server.py pads the operator prefix with fixed per-policy examples for that
+
+Usage:
+    builder = PromptBuilder(INSTRUCTION, budget=1500)
+    built = builder.build({"policy_id": policy}, history_lines, example_blocks)
+    built.text, built.tokens, built.trimmed
+    call_openai_chat(messages=built.messages(), model=model)
+"""
+
+import logging
+import os
+import string
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+PROMPT_TOKENIZER_MODEL = os.getenv("PROMPT_TOKENIZER_MODEL", "gpt-4o-mini")
+CHARS_PER_TOKEN = 4  # fallback estimate when tiktoken is not installed
+
+_formatter = string.Formatter()
+
+
+class CompiledTemplate:
+    """A str.format template parsed once into (literal, field) segments"""
+    __slots__ = ("text", "segments", "fields", "_simple")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.segments: List[Tuple[str, Optional[str], str, Optional[str]]] = list(_formatter.parse(text))
+        self.fields = {name for _, name, _, _ in self.segments if name}
+        # Attribute/index lookups ("{a.b}", "{a[0]}") and positional fields go through str.format
+        self._simple = all(name.isidentifier() for name in self.fields)
+
+    def render(self, **values) -> str:
+        if not self._simple:
+            return self.text.format(**values)
+        parts = []
+        for literal, name, spec, conversion in self.segments:
+            parts.append(literal)
+            if name is None:
+                continue
+            value = values[name]
+            if conversion:
+                value = _formatter.convert_field(value, conversion)
+            parts.append(format(value, spec) if spec else str(value))
+        return "".join(parts)
+
+
+_templates: "OrderedDict[str, CompiledTemplate]" = OrderedDict()
+_templates_lock = threading.Lock()
+TEMPLATE_CACHE_SIZE = 512
+
+
+def compile_template(text: str) -> CompiledTemplate:
+    """Compiled form of a template, cached by its text"""
+    with _templates_lock:
+        template = _templates.get(text)
+        if template is not None:
+            _templates.move_to_end(text)
+            return template
+    template = CompiledTemplate(text)
+    with _templates_lock:
+        _templates[text] = template
+        if len(_templates) > TEMPLATE_CACHE_SIZE:
+            _templates.popitem(last=False)
+    return template
+
+
+def render(text: str, **values) -> str:
+    """text.format(**values) through the compiled-template cache"""
+    return compile_template(text).render(**values)
+
+
+# ============================================================================
+# Token counting and budgets
+# ============================================================================
+
+_encodings: Dict[str, object] = {}
+
+
+def _encoding(model: str):
+    if not TIKTOKEN_AVAILABLE:
+        return None
+    enc = _encodings.get(model)
+    if enc is None:
+        try:
+            enc = tiktoken.encoding_for_model(model)
+        except KeyError:
+            enc = tiktoken.get_encoding("o200k_base")
+        _encodings[model] = enc
+    return enc
+
+
+def count_tokens(text: str, model: str = PROMPT_TOKENIZER_MODEL) -> int:
+    if not text:
+        return 0
+    enc = _encoding(model)
+    if enc is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def trim_lines(lines: Sequence[str], budget: int, model: str = PROMPT_TOKENIZER_MODEL) -> List[str]:
+    """Newest lines whose total (one newline each) fits the budget; always keeps the last line"""
+    kept: List[str] = []
+    used = 0
+    for line in reversed(lines):
+        cost = count_tokens(line, model) + 1
+        if kept and used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    kept.reverse()
+    return kept
+
+
+def trim_history_text(history: str, budget: int, model: str = PROMPT_TOKENIZER_MODEL) -> str:
+    """trim_lines() for a newline-joined history string"""
+    if not history or count_tokens(history, model) <= budget:
+        return history
+    trailing = "\n" if history.endswith("\n") else ""
+    return "\n".join(trim_lines(history.rstrip("\n").split("\n"), budget, model)) + trailing
+
+
+def fit_examples(examples: Sequence[str], budget: int, sep: str = "\n\n",
+                 model: str = PROMPT_TOKENIZER_MODEL) -> List[str]:
+    """Leading (highest-ranked) examples that fit the budget"""
+    kept: List[str] = []
+    used = 0
+    sep_cost = count_tokens(sep, model)
+    for example in examples:
+        cost = count_tokens(example, model) + (sep_cost if kept else 0)
+        if used + cost > budget:
+            break
+        kept.append(example)
+        used += cost
+    return kept
+
+
+# ============================================================================
+# Builder
+# ============================================================================
+
+class BuiltPrompt:
+    __slots__ = ("prefix", "examples_block", "conversation_block", "text", "tokens", "trimmed")
+
+    def __init__(self, prefix: str, examples_block: str, conversation_block: str, text: str, tokens: int,
+                 trimmed: Dict[str, int]):
+        self.prefix = prefix                          # static instruction (identical across calls with the same static values)
+        self.examples_block = examples_block          # header + ranked examples
+        self.conversation_block = conversation_block  # header + budget-trimmed history + reply cue
+        self.text = text                              # single-string form (prefix, conversation, examples)
+        self.tokens = tokens
+        self.trimmed = trimmed                        # {"history_lines": n, "examples": n} dropped to fit the budget
+
+    def messages(self) -> List[Dict[str, str]]:
+        """
+        Chat messages: system prefix, examples, conversation. Only the system message
+        repeats across turns (examples follow the resident's latest message), so it is
+        the part a provider prefix cache can reuse, provided it reaches the provider's
+        minimum cacheable length (1024 tokens for OpenAI).
+        """
+        return [
+            {"role": "system", "content": self.prefix},
+            {"role": "user", "content": self.examples_block},
+            {"role": "user", "content": self.conversation_block},
+        ]
+
+
+class PromptBuilder:
+    """
+    Static instruction prefix + ranked examples + recent history, within a token budget.
+    The prefix is rendered once per distinct static_values and cached.
+    """
+
+    def __init__(self, instruction: str, budget: int = PROMPT_TOKEN_BUDGET, example_share: float = 0.4,
+                 conversation_header: str = "Conversation so far:", examples_header: str = "Similar example dialogues:",
+                 cue: str = "Operator:", model: str = PROMPT_TOKENIZER_MODEL, prefix_cache_size: int = 256):
+        self.instruction = compile_template(instruction)
+        self.conversation_header = conversation_header
+        self.examples_header = examples_header
+        self.cue = cue
+        self.budget = budget
+        self.example_share = example_share
+        self.model = model
+        self.prefix_cache_size = prefix_cache_size
+        self._prefixes: "OrderedDict[Tuple, Tuple[str, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._layout_tokens = count_tokens(f"\n\n{conversation_header}\n\n\n{examples_header}\n\n\n{cue}", model)
+
+    def prefix(self, **static_values) -> Tuple[str, int]:
+        """(rendered instruction, its token count), cached per static values"""
+        key = tuple(sorted(static_values.items()))
+        with self._lock:
+            cached = self._prefixes.get(key)
+            if cached is not None:
+                self._prefixes.move_to_end(key)
+                return cached
+        text = self.instruction.render(**static_values)
+        cached = (text, count_tokens(text, self.model))
+        with self._lock:
+            self._prefixes[key] = cached
+            if len(self._prefixes) > self.prefix_cache_size:
+                self._prefixes.popitem(last=False)
+        return cached
+
+    def build(self, static_values: Dict[str, str], history_lines: Sequence[str], examples: Sequence[str],
+              empty_examples: str = "(none)") -> BuiltPrompt:
+        prefix, prefix_tokens = self.prefix(**static_values)
+        available = max(0, self.budget - prefix_tokens - self._layout_tokens)
+
+        kept_examples = fit_examples(examples, int(available * self.example_share), model=self.model)
+        examples_text = "\n\n".join(kept_examples).strip()
+        examples_tokens = count_tokens(examples_text, self.model)
+
+        kept_lines = trim_lines(history_lines, available - examples_tokens, self.model)
+        conversation = "\n".join(kept_lines)
+
+        trimmed = {"history_lines": len(history_lines) - len(kept_lines), "examples": len(examples) - len(kept_examples)}
+        if trimmed["history_lines"] or trimmed["examples"]:
+            logging.debug(f"Prompt trimmed to budget {self.budget}: {trimmed}")
+
+        conversation_block = f"{self.conversation_header}\n{conversation}"
+        examples_block = f"{self.examples_header}\n{examples_text or empty_examples}"
+        text = f"{prefix}\n\n{conversation_block}\n\n{examples_block}\n\n{self.cue}"
+        tokens = prefix_tokens + self._layout_tokens + examples_tokens + count_tokens(conversation, self.model)
+        return BuiltPrompt(prefix, examples_block, f"{conversation_block}\n\n{self.cue}", text, tokens, trimmed)
@@ -4,13 +4,14 @@ Integrates survey system with IQL-powered conversation system
 """
 
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from pydantic import BaseModel
 from typing import Dict, List, Optional, Any
 import os
 import json
+import asyncio
 import traceback
 from pathlib import Path
 import time
@@ -22,6 +23,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 from sentence_transformers import SentenceTransformer
 import requests
+from requests.adapters import HTTPAdapter
 
 # Try to import HF Embedding API wrapper
 try:
@@ -34,6 +36,14 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 import threading
+from model_warmup import COLD, WarmupManager
+from encoder_registry import get_encoder
+from stance_classifier import get_stance_classifier
+import metrics
+import logging
+from structured_logging import get_logger, log_event, sampled
+from turn_log import TurnLogWriter
+from prompt_builder import PROMPT_TOKEN_BUDGET, BuiltPrompt, PromptBuilder, count_tokens, render, trim_history_text
 
 # Suppress warnings
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
@@ -49,12 +59,22 @@ BASE_DIR = os.getenv('A2I2_BASE_DIR', os.path.dirname(os.path.dirname(os.path.ab
 SURVEY_RESPONSES_DIR = os.path.join(BASE_DIR, "survey_responses")
 os.makedirs(SURVEY_RESPONSES_DIR, exist_ok=True)
 
+# Durable per-turn event log (policy, Q-values, judge, timings); see turn_log.py
+TURN_LOG_DIR = os.getenv("TURN_LOG_DIR", os.path.join(BASE_DIR, "turn_logs"))
+
 # IQL Configuration
 N_LAST_RESIDENT = 3
 EMBED_MODEL = "all-MiniLM-L6-v2"
 MAX_TURNS = 10  # Maximum resident turns (20 total conversation turns)
 MIN_RESIDENT_TURNS = 3  # Minimum turns before LLM can decide to end conversation
 
+# Local stance classifier (stance_classifier.py): the LLM judge is only called when
+# its top probability is below this; STANCE_ENCODER=hf embeds via the Space instead of local MiniLM
+STANCE_LOCAL_THRESHOLD = float(os.getenv("STANCE_LOCAL_THRESHOLD", "0.8"))
+STANCE_ENCODER = os.getenv("STANCE_ENCODER", "local").lower()
+# How long a chat turn waits for the shared warmup before falling back to no retrieval examples
+CHAT_WARMUP_WAIT_S = float(os.getenv("CHAT_WARMUP_WAIT_S", "60"))
+
 # Import Hugging Face API wrapper (replaces local IQL)
 try:
     from iql_hf_api import get_iql_hf
@@ -128,7 +148,7 @@ class IQLSelector:
     """IQL-based policy selector (DEPRECATED - not used)"""
     def __init__(self, pt_path: Path, policy_names: List[str]):
         self.device = torch.device("cpu")
-        self.embed_model = SentenceTransformer(EMBED_MODEL)
+        self.embed_model = get_encoder(EMBED_MODEL)
         
         # Load checkpoint
         state_dict = torch.load(pt_path, map_location="cpu")
@@ -192,6 +212,19 @@ def cosine_topk(query_vec: np.ndarray, mat: np.ndarray, k: int) -> List[int]:
     return idx.tolist()
 
 
+chat_log = get_logger("chat")
+
+RETRIEVER_CACHE = metrics.counter("a2i2_retriever_cache_total", "Policy index lookups by cache result (hit/miss)")
+CHAT_FALLBACKS = metrics.counter("a2i2_chat_fallbacks_total", "Chat turns that used a fallback, by reason")
+CHAT_TURNS = metrics.counter("a2i2_chat_turns_total", "Chat turns handled, by outcome")
+CHAT_TURN_LATENCY = metrics.histogram("a2i2_chat_turn_seconds", "End-to-end /api/chat/message latency")
+JUDGE_SOURCE = metrics.counter("a2i2_judge_total", "Resident stance judgements by source (local/llm)")
+LLM_PROMPT_TOKENS = metrics.counter("a2i2_llm_prompt_tokens_total", "OpenAI prompt tokens, by purpose")
+LLM_CACHED_TOKENS = metrics.counter("a2i2_llm_cached_prompt_tokens_total",
+                                    "OpenAI prompt tokens served from the provider prefix cache, by purpose")
+CHAT_IN_FLIGHT = metrics.gauge("a2i2_chat_turns_in_flight", "Chat turns currently being processed")
+
+
 class PolicyExampleRetriever:
     """Retrieves example responses for each policy"""
     def __init__(self, base_dir: Path, embed_model: SentenceTransformer):
@@ -207,7 +240,9 @@ class PolicyExampleRetriever:
 
     def _load_policy(self, policy: str):
         if policy in self._cache:
+            RETRIEVER_CACHE.inc(result="hit")
             return self._cache[policy]
+        RETRIEVER_CACHE.inc(result="miss")
 
         pairs_path = self._pairs_path(policy)
         embeds_path = self._embeds_path(policy)
@@ -228,6 +263,12 @@ class PolicyExampleRetriever:
         self._cache[policy] = (pairs, embeds)
         return pairs, embeds
 
+    def preload(self, policies: List[str]):
+        """Load pairs/embedding matrices for all policies ahead of the first retrieval"""
+        for policy in policies:
+            self._load_policy(policy)
+        print(f"[POLICY-RETRIEVER] Preloaded embedding matrices for {len(policies)} policies")
+
     def retrieve_topk_pairs(self, policy: str, resident_query: str, k: int = 2) -> List[Dict[str, str]]:
         """Retrieve top-k most similar examples for a policy"""
         pairs, embeds = self._load_policy(policy)
@@ -252,29 +293,117 @@ class PolicyExampleRetriever:
             })
         return out
 
+    def reference_pairs(self, policy: str) -> List[Dict[str, str]]:
+        """The policy's pairs in index order (a fixed, query-independent example set)"""
+        pairs, _ = self._load_policy(policy)
+        return [{"resident": (p.get("resident_text") or "").strip(), "operator": (p.get("operator_text") or "").strip()}
+                for p in pairs]
+
+
+# Override (e.g. http://localhost:8100/v1 for mock_llm_server.py) to load-test offline
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1").rstrip("/")
+
+# Shared HTTP session so OpenAI calls reuse pooled keep-alive connections
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """Get or create the process-wide pooled HTTP session"""
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _http_session = session
+    return _http_session
+
+
+def warm_llm_connections():
+    """Open pooled connections to the OpenAI API before the first chat turn"""
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("OPENAI_API_KEY environment variable not set")
+
+    r = get_http_session().get(
+        f"{OPENAI_API_BASE}/models",
+        headers={"Authorization": f"Bearer {api_key}"},
+        timeout=15,
+    )
+    r.raise_for_status()
+    print("[WARMUP] OpenAI connection pool warmed")
+
+
+def call_openai_chat(prompt: Optional[str] = None, model: str = "gpt-4o-mini", temperature: float = 0.6,
+                     max_tokens: int = 80, messages: Optional[List[Dict[str, str]]] = None,
+                     purpose: str = "operator", usage: Optional[dict] = None) -> str:
+    """Call OpenAI API for operator response generation (default: short responses ~30-40 words)
 
-def call_openai_chat(prompt: str, model: str, temperature: float = 0.6, max_tokens: int = 80) -> str:
-    """Call OpenAI API for operator response generation (default: short responses ~30-40 words)"""
+    Pass messages (stable system prompt first, volatile conversation last) so OpenAI's
+    automatic prefix caching can reuse the leading tokens; a bare prompt is sent as one
+    user message. Prompt / cached token counts are recorded per purpose and, when a
+    usage dict is given, copied into it for the turn record.
+    """
     api_key = os.environ.get("OPENAI_API_KEY")
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY environment variable not set")
+    if messages is None:
+        messages = [{"role": "user", "content": prompt}]
 
-    r = requests.post(
-        "https://api.openai.com/v1/chat/completions",
+    r = get_http_session().post(
+        f"{OPENAI_API_BASE}/chat/completions",
         headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
         json={
             "model": model,
             "temperature": temperature,
             "max_tokens": max_tokens,
-            "messages": [{"role": "user", "content": prompt}],
+            "messages": messages,
         },
         timeout=60,
     )
     r.raise_for_status()
     data = r.json()
+
+    reported = data.get("usage") or {}
+    prompt_tokens = reported.get("prompt_tokens", 0)
+    cached_tokens = (reported.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+    LLM_PROMPT_TOKENS.inc(prompt_tokens, purpose=purpose)
+    LLM_CACHED_TOKENS.inc(cached_tokens, purpose=purpose)
+    if usage is not None:
+        usage.update({
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": reported.get("completion_tokens", 0),
+        })
     return (data["choices"][0]["message"]["content"] or "").strip()
 
 
+# Static per end reason (system message); only the conversation context varies per call
+CLOSING_SYSTEM_PROMPT = """You are a fire department emergency dispatcher ending a call with a resident during a wildfire evacuation.
+
+ENDING SITUATION:
+{situation}
+
+INSTRUCTIONS:
+- Generate a natural, contextual closing message
+- Tone should be: {tone}
+- Goal: {goal}
+- CRITICAL: Keep it VERY brief (1-2 SHORT sentences, maximum 20-25 words total)
+- For max_turns ending: Just say goodbye and wish safety in ONE sentence.
+- For other endings: Still keep it to 1-2 sentences maximum
+- Be direct and concise - no elaboration
+- DO NOT use quotation marks or labels like "OPERATOR:" in your response
+- Sound like a real human emergency dispatcher, not robotic"""
+
+CLOSING_USER_PROMPT = """CONVERSATION CONTEXT:
+{conversation_context}
+
+Generate ONLY the closing message:"""
+
+
 def generate_natural_closing(history: list, end_reason: str, character: str, model: str = "gpt-4o-mini") -> str:
     """
     Generate a natural and contextual closing message for the conversation.
@@ -316,29 +445,15 @@ def generate_natural_closing(history: list, end_reason: str, character: str, mod
     
     context_info = ending_contexts.get(end_reason, ending_contexts["max_turns"])
     
-    prompt = f"""You are a fire department emergency dispatcher ending a call with a resident during a wildfire evacuation.
-
-CONVERSATION CONTEXT:
-{conversation_context}
-
-ENDING SITUATION:
-{context_info['situation']}
-
-INSTRUCTIONS:
-- Generate a natural, contextual closing message
-- Tone should be: {context_info['tone']}
-- Goal: {context_info['goal']}
-- CRITICAL: Keep it VERY brief (1-2 SHORT sentences, maximum 20-25 words total)
-- For max_turns ending: Just say goodbye and wish safety in ONE sentence.
-- For other endings: Still keep it to 1-2 sentences maximum
-- Be direct and concise - no elaboration
-- DO NOT use quotation marks or labels like "OPERATOR:" in your response
-- Sound like a real human emergency dispatcher, not robotic
-
-Generate ONLY the closing message:"""
+    messages = [
+        {"role": "system", "content": render(CLOSING_SYSTEM_PROMPT, situation=context_info['situation'],
+                                             tone=context_info['tone'], goal=context_info['goal'])},
+        {"role": "user", "content": render(CLOSING_USER_PROMPT, conversation_context=trim_history_text(
+            conversation_context, PROMPT_TOKEN_BUDGET // 2))},
+    ]
 
     try:
-        closing = call_openai_chat(prompt, model=model, temperature=0.7, max_tokens=60)
+        closing = call_openai_chat(messages=messages, model=model, temperature=0.7, max_tokens=60, purpose="closing")
         # Clean up any potential formatting issues
         closing = closing.strip().strip('"').strip("'")
         return closing
@@ -474,6 +589,31 @@ def select_character_pair(survey_data: dict, excluded_characters: List[str]) ->
     return highest_char, lowest_char, scores
 
 
+# Static requirements and examples (system message); the participant profile is the user message
+SCENARIO_SYSTEM_PROMPT = """Generate a brief, immersive emergency scenario (2-3 sentences) for a fire evacuation simulation.
+
+CRITICAL REQUIREMENTS:
+- Use SIMPLE, everyday words (8th grade reading level)
+- Make it feel IMMEDIATE and REAL
+- Start with: "It is a regular day at home. You are [doing something typical]..."
+- MUST end with: "Your phone suddenly rings. The caller ID shows the local fire department."
+- Do NOT mention age explicitly
+- Keep it SHORT (2-3 simple sentences)
+
+GOOD EXAMPLE:
+"It is a regular day at home. You are working on your computer projects when your phone suddenly rings. The caller ID shows the local fire department."
+
+BAD EXAMPLE (too formal, doesn't end with phone):
+"You are at home preparing dinner when the smell of smoke fills the air. You glance out the window and see flames in the distance..."
+
+Generate ONLY the scenario text in the good example style."""
+
+SCENARIO_USER_PROMPT = """Participant profile:
+- Age: {age}
+- Occupation: {occupation}
+- Situation: {context}"""
+
+
 def generate_personalized_scenario(survey_data: dict, model: str = "gpt-4o-mini") -> str:
     """
     Generate a personalized emergency scenario based on participant's survey data.
@@ -506,31 +646,13 @@ def generate_personalized_scenario(survey_data: dict, model: str = "gpt-4o-mini"
     
     context = ", ".join(context_parts) if context_parts else "is at home"
     
-    prompt = f"""Generate a brief, immersive emergency scenario (2-3 sentences) for a fire evacuation simulation.
-
-Participant profile:
-- Age: {age}
-- Occupation: {occupation}
-- Situation: {context}
-
-CRITICAL REQUIREMENTS:
-- Use SIMPLE, everyday words (8th grade reading level)
-- Make it feel IMMEDIATE and REAL
-- Start with: "It is a regular day at home. You are [doing something typical]..."
-- MUST end with: "Your phone suddenly rings. The caller ID shows the local fire department."
-- Do NOT mention age explicitly
-- Keep it SHORT (2-3 simple sentences)
-
-GOOD EXAMPLE:
-"It is a regular day at home. You are working on your computer projects when your phone suddenly rings. The caller ID shows the local fire department."
-
-BAD EXAMPLE (too formal, doesn't end with phone):
-"You are at home preparing dinner when the smell of smoke fills the air. You glance out the window and see flames in the distance..."
-
-Generate ONLY the scenario text in the good example style."""
+    messages = [
+        {"role": "system", "content": SCENARIO_SYSTEM_PROMPT},
+        {"role": "user", "content": render(SCENARIO_USER_PROMPT, age=age, occupation=occupation, context=context)},
+    ]
 
     try:
-        scenario = call_openai_chat(prompt, model=model, temperature=0.7, max_tokens=80)
+        scenario = call_openai_chat(messages=messages, model=model, temperature=0.7, max_tokens=80, purpose="scenario")
         scenario = scenario.strip().strip('"').strip("'")
         print(f"[SCENARIO] Generated personalized scenario: {scenario[:100]}...")
         return scenario
@@ -569,7 +691,7 @@ Examples of good openings:
 """
 
     try:
-        greeting = call_openai_chat(prompt, model=model, temperature=0.8, max_tokens=60)
+        greeting = call_openai_chat(prompt, model=model, temperature=0.8, max_tokens=60, purpose="greeting")
         greeting = greeting.strip().strip('"').strip("'")
         
         # Ensure it's not too long or weird
@@ -606,8 +728,8 @@ def judge_resident_stance(history: List[Dict[str, str]], model: str) -> dict:
     )
 
     try:
-        r = requests.post(
-            "https://api.openai.com/v1/chat/completions",
+        r = get_http_session().post(
+            f"{OPENAI_API_BASE}/chat/completions",
             headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
             json={
                 "model": model,
@@ -639,9 +761,102 @@ def judge_resident_stance(history: List[Dict[str, str]], model: str) -> dict:
         conf = max(0.0, min(1.0, conf))
         return {"stance": stance, "confidence": conf, "reason": reason}
     except Exception as e:
+        CHAT_FALLBACKS.inc(reason="judge_error")
         return {"stance": "UNKNOWN", "confidence": 0.0, "reason": f"Error: {str(e)}"}
 
 
+_stance_encoder = None
+_stance_encoder_resolved = False
+
+
+def get_stance_encoder():
+    """Encoder for the stance classifier (None = shared local MiniLM), resolved once per process"""
+    global _stance_encoder, _stance_encoder_resolved
+    if not _stance_encoder_resolved:
+        if STANCE_ENCODER == "hf" and HF_EMBEDDING_API_AVAILABLE:
+            _stance_encoder = get_embedding_hf()
+        _stance_encoder_resolved = True
+    return _stance_encoder
+
+
+def judge_stance(history: List[Dict[str, str]], model: str, session_id: str = None) -> dict:
+    """Local stance classifier when it is confident, otherwise the LLM judge"""
+    local = None
+    classifier = get_stance_classifier(encoder=get_stance_encoder())
+    if classifier is not None:
+        try:
+            local = classifier.predict(history)
+        except Exception as e:
+            log_event(chat_log, "stance_classifier_failed", level=logging.WARNING, session_id=session_id, error=str(e))
+        if local is not None and local["confidence"] >= STANCE_LOCAL_THRESHOLD:
+            JUDGE_SOURCE.inc(source="local")
+            return local
+
+    judge = judge_resident_stance(history, model=model)
+    judge["source"] = "llm"
+    if local is not None:
+        judge["local"] = {"stance": local["stance"], "confidence": local["confidence"]}
+    JUDGE_SOURCE.inc(source="llm")
+    return judge
+
+
+OPERATOR_INSTRUCTION = (
+    "You are the OPERATOR talking to a RESIDENT during a wildfire evacuation call.\n"
+    "Use the operator policy style optimized for: {policy_id}.\n"
+    "Read the conversation so far, then produce the next operator reply.\n"
+    "CRITICAL RULES:\n"
+    "- KEEP IT BRIEF: Maximum 1-2 short sentences (20-30 words total).\n"
+    "- Get straight to the point - no elaboration.\n"
+    "- Calm, professional, evacuation-focused.\n"
+    "- If resident resists, emphasize urgency/danger; if cooperative, give clear next steps.\n"
+    "- No role labels, no meta commentary.\n"
+    "- Avoid gendered pronouns.\n"
+    "- DO NOT over-explain. Be direct and concise.\n"
+    "- Only use information revealed in the conversation - do not assume anything about the resident.\n"
+    "Use the similar examples for style guidance."
+    "{policy_examples}"
+)
+
+# OpenAI only caches prompts of 1024+ tokens, and only the system message repeats
+# across turns. The instruction alone is ~180 tokens, so it is followed by a fixed
+# per-policy example set until the system message reaches this many tokens
+# (1024 plus one 128-token cache increment of margin for the token estimate).
+# 0 = instruction only (operator calls then never hit the cache).
+OPERATOR_CACHE_PREFIX_TOKENS = int(os.getenv("OPERATOR_CACHE_PREFIX_TOKENS", "1152"))
+
+# Instruction + reference examples rendered once per policy; the retrieved examples
+# and history are trimmed to PROMPT_TOKEN_BUDGET on top of that prefix
+operator_prompt_builder = PromptBuilder(OPERATOR_INSTRUCTION, budget=PROMPT_TOKEN_BUDGET + OPERATOR_CACHE_PREFIX_TOKENS)
+_policy_reference: Dict[str, tuple] = {}  # policy -> (examples block, {(resident, operator)})
+
+
+def _example_text(ex: Dict[str, str]) -> str:
+    return f"Resident: {ex['resident']}\nOperator: {ex['operator']}"
+
+
+def policy_reference_examples(policy_id: str) -> tuple:
+    """Fixed example block that pads the policy's system message to OPERATOR_CACHE_PREFIX_TOKENS"""
+    cached = _policy_reference.get(policy_id)
+    if cached is not None:
+        return cached
+    if OPERATOR_CACHE_PREFIX_TOKENS <= 0 or policy_retriever is None:
+        return "", set()  # not cached: the retriever may still be warming up
+
+    used = operator_prompt_builder.prefix(policy_id=policy_id, policy_examples="")[1]
+    kept = []
+    for ex in policy_retriever.reference_pairs(policy_id):
+        if used >= OPERATOR_CACHE_PREFIX_TOKENS:
+            break
+        if ex["resident"] and ex["operator"]:
+            kept.append(ex)
+            used += count_tokens(_example_text(ex)) + 1
+    block = "\n\nReference examples for this policy:\n" + "\n\n".join(_example_text(ex) for ex in kept) if kept else ""
+    cached = _policy_reference[policy_id] = (block, {(ex["resident"], ex["operator"]) for ex in kept})
+    if used < OPERATOR_CACHE_PREFIX_TOKENS:
+        print(f"[PROMPT] Policy {policy_id}: system prefix is {used} tokens, below the cache floor")
+    return cached
+
+
 def build_prompt(policy_id: str, character_name: str, history: List[Dict[str, str]], examples: List[Dict[str, str]], max_context_turns: int = 6) -> str:
     """Build prompt for operator response generation
     
@@ -649,39 +864,27 @@ def build_prompt(policy_id: str, character_name: str, history: List[Dict[str, st
         policy_id: IQL policy identifier
         character_name: Character being role-played
         history: Conversation history
-        examples: Policy example dialogues
+        examples: Policy example dialogues (best match first; the tail is dropped first when over budget)
         max_context_turns: Maximum conversation turns to include
     """
-    context = history[-max_context_turns:] if len(history) > max_context_turns else history
-    context_text = "\n".join([f"{t['role'].capitalize()}: {t['text'].strip()}" for t in context])
-
-    ex_block = "\n\n".join(
-        [f"Resident: {ex['resident']}\nOperator: {ex['operator']}" for ex in examples if ex.get("resident") and ex.get("operator")]
-    ).strip()
-
-    # Role-play conversation with IQL policy
-    instruction = (
-        f"You are the OPERATOR talking to a RESIDENT during a wildfire evacuation call.\n"
-        f"Use the operator policy style optimized for: {policy_id}.\n"
-        "Read the conversation so far, then produce the next operator reply.\n"
-        "CRITICAL RULES:\n"
-        "- KEEP IT BRIEF: Maximum 1-2 short sentences (20-30 words total).\n"
-        "- Get straight to the point - no elaboration.\n"
-        "- Calm, professional, evacuation-focused.\n"
-        "- If resident resists, emphasize urgency/danger; if cooperative, give clear next steps.\n"
-        "- No role labels, no meta commentary.\n"
-        "- Avoid gendered pronouns.\n"
-        "- DO NOT over-explain. Be direct and concise.\n"
-        "- Only use information revealed in the conversation - do not assume anything about the resident.\n"
-        "Use the similar examples for style guidance."
-    )
+    return build_operator_prompt(policy_id, history, examples, max_context_turns).text
 
-    return (
-        f"{instruction}\n\n"
-        f"Conversation so far:\n{context_text}\n\n"
-        f"Similar example dialogues:\n{ex_block if ex_block else '(none)'}\n\n"
-        "Operator:"
-    )
+
+def build_operator_prompt(policy_id: str, history: List[Dict[str, str]], examples: List[Dict[str, str]],
+                          max_context_turns: int = 6) -> BuiltPrompt:
+    """
+    Budgeted operator prompt. .messages() puts the instruction and the policy's fixed
+    reference examples in the system message (identical on every turn with this policy,
+    and long enough to be cached); retrieved examples and history follow it.
+    """
+    context = history[-max_context_turns:] if len(history) > max_context_turns else history
+    lines = [f"{t['role'].capitalize()}: {t['text'].strip()}" for t in context]
+    reference_block, reference_keys = policy_reference_examples(policy_id)
+    example_blocks = [
+        _example_text(ex) for ex in examples
+        if ex.get("resident") and ex.get("operator") and (ex["resident"], ex["operator"]) not in reference_keys
+    ]
+    return operator_prompt_builder.build({"policy_id": policy_id, "policy_examples": reference_block}, lines, example_blocks)
 
 
 # ============================================================================
@@ -690,6 +893,7 @@ def build_prompt(policy_id: str, character_name: str, history: List[Dict[str, st
 
 # In-memory session storage (for production, use Redis or database)
 conversation_sessions = {}
+metrics.gauge("a2i2_active_sessions", "Conversation sessions held in memory", fn=lambda: len(conversation_sessions))
 
 # In-memory participant data storage (surveys and post-surveys)
 # Structure: {participant_id: {"survey": {...}, "post_surveys": [...], "selected_characters": []}}
@@ -794,7 +998,30 @@ def get_session(session_id: str) -> Dict[str, Any]:
     return conversation_sessions[session_id]
 
 
-# Conversation history is now stored in memory and saved only when participant exits or completes study
+# Conversation history is now stored in memory and saved only when participant exits or completes study.
+# Every turn is also appended to the turn log, so a crash before exit/completion loses nothing:
+# `python turn_log.py replay <TURN_LOG_DIR>` rebuilds each session's iql_data.
+
+_turn_log = None
+_turn_log_lock = threading.Lock()
+
+
+def get_turn_log() -> TurnLogWriter:
+    """Get or create the process-wide turn log writer"""
+    global _turn_log
+    if _turn_log is None:
+        with _turn_log_lock:
+            if _turn_log is None:
+                _turn_log = TurnLogWriter(TURN_LOG_DIR)
+    return _turn_log
+
+
+def log_turn_event(event: str, session_id: str, **fields):
+    """Queue a turn event for the next group commit; never fails the request"""
+    try:
+        get_turn_log().append({"event": event, "session_id": session_id, **fields})
+    except Exception as e:
+        log_event(chat_log, "turn_log_failed", level=logging.ERROR, session_id=session_id, error=str(e))
 
 
 # ============================================================================
@@ -818,14 +1045,24 @@ def load_policy_names_from_label_map(label_map_path: Path) -> List[str]:
 # Global IQL system (lazy initialization)
 iql_selector = None
 policy_retriever = None
+_policy_retriever_lock = threading.Lock()
 
 
 def initialize_policy_retriever_lazy():
     """Lazy initialization of policy retriever (loads on first use)"""
+    if policy_retriever is not None:
+        return  # Already initialized
+    
+    # Serialize concurrent callers so the embedding model is only loaded once
+    with _policy_retriever_lock:
+        _initialize_policy_retriever_locked()
+
+
+def _initialize_policy_retriever_locked():
     global policy_retriever
     
     if policy_retriever is not None:
-        return  # Already initialized
+        return  # Initialized by another caller while we waited for the lock
     
     import time as timing_module
     base = Path(__file__).resolve().parent
@@ -842,9 +1079,8 @@ def initialize_policy_retriever_lazy():
             print("[POLICY-RETRIEVER] Falling back to local embeddings (slow on Render)")
             t1 = timing_module.time()
             
-            # Load sentence-transformers model locally
-            embed_model = SentenceTransformer(EMBED_MODEL)
-            embed_model.to('cpu')
+            # Shared process-wide MiniLM (see encoder_registry.py)
+            embed_model = get_encoder(EMBED_MODEL, device="cpu")
             _ = embed_model.encode(["warm up"], convert_to_numpy=True, show_progress_bar=False)
             
             t2 = timing_module.time()
@@ -895,6 +1131,39 @@ def initialize_iql():
         iql_selector = None
 
 
+# ============================================================================
+# Model Warmup
+# ============================================================================
+
+def _warm_policy_retriever():
+    initialize_policy_retriever_lazy()
+    if policy_retriever is None:
+        raise RuntimeError("Policy retriever failed to initialize")
+
+
+def _warm_policy_embeddings():
+    if iql_selector is not None:
+        policies = iql_selector.policy_names
+    else:
+        policies = load_policy_names_from_label_map(Path(__file__).resolve().parent / "iql" / "label_map.json")
+    policy_retriever.preload(policies)
+
+
+def _warm_iql_connection():
+    if iql_selector is None:
+        raise RuntimeError("IQL selector not initialized")
+    iql_selector.warmup()
+
+
+# Single-flight warmup shared by /api/preload-models, /api/ready and the first chat turn
+warmup_manager = WarmupManager([
+    ("policy_retriever", _warm_policy_retriever, True),
+    ("policy_embeddings", _warm_policy_embeddings, True),
+    ("iql_connection", _warm_iql_connection, False),
+    ("llm_connection_pool", warm_llm_connections, False),
+])
+
+
 # ============================================================================
 # FastAPI Application
 # ============================================================================
@@ -954,25 +1223,41 @@ class ChatRequest(BaseModel):
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize IQL system on startup"""
+    """Initialize IQL system on startup and start model warmup in the background"""
     initialize_iql()
+    warmup_manager.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Commit any queued turn-log records before the process exits"""
+    if _turn_log is not None:
+        _turn_log.close()
 
 
 @app.post("/api/preload-models")
 async def preload_models():
-    """Trigger preloading of sentence-transformers model in background (called when survey loads)"""
-    def preload_in_background():
-        global policy_retriever
-        if policy_retriever is None:
-            print("[PRELOAD] User started survey, preloading models in background...")
-            initialize_policy_retriever_lazy()
-            print("[PRELOAD] Models ready for Session 2!")
+    """Trigger model warmup in background (called when survey loads); concurrent calls share one run"""
+    warmup_manager.start()
+    status = warmup_manager.status()
     
-    # Start preloading in background thread
-    thread = threading.Thread(target=preload_in_background, daemon=True)
-    thread.start()
-    
-    return {"success": True, "message": "Preloading started in background"}
+    message = "Models ready" if status["ready"] else f"Warmup {status['state']}"
+    return {"success": True, "message": message, "state": status["state"]}
+
+
+@app.get("/api/ready")
+async def readiness():
+    """Readiness probe: 200 once warmup is complete, 503 while cold/loading/failed"""
+    if warmup_manager.state == COLD:
+        warmup_manager.start()
+    status = warmup_manager.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Stage latency histograms, fallback/cache counters and session gauges (Prometheus text format)"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/")
@@ -1190,16 +1475,10 @@ async def start_chat(request: Request):
         initial_message = generate_initial_greeting(character, persona, model=model)
         session["history"].append({"role": "operator", "text": initial_message})
         
-        # Print conversation start with clear formatting
-        print("\n" + "🟢"*40)
-        print(f"🚀 NEW CONVERSATION STARTED")
-        print("🟢"*40)
-        print(f"   Session ID: {session_id}")
-        print(f"   Character: {character.upper()}")
-        print(f"   Participant: {participant_id}")
-        print(f"\n💬 INITIAL GREETING:")
-        print(f"   {initial_message}")
-        print("🟢"*40 + "\n")
+        log_event(chat_log, "conversation_started", session_id=session_id, character=character,
+                  participant_id=participant_id, greeting=initial_message)
+        log_turn_event("session_start", session_id, participant_id=participant_id, character=character,
+                       greeting=initial_message)
         
         return {
             "session_id": session_id,
@@ -1209,17 +1488,22 @@ async def start_chat(request: Request):
         }
         
     except Exception as e:
-        print(f"[ERROR] Chat start failed: {e}")
-        traceback.print_exc()
+        chat_log.exception("chat_start_failed", extra={"error": str(e)})
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/chat/message")
 async def send_message(chat_req: ChatRequest):
     """Send a resident message and get operator response"""
+    CHAT_IN_FLIGHT.inc()
+    turn_start = time.perf_counter()
+    outcome = "error"
+    timings = {}  # per-stage latency (ms), attached to this turn's iql_data record
     try:
         if iql_selector is None:
             # Fallback if IQL not available
+            CHAT_FALLBACKS.inc(reason="iql_unavailable")
+            outcome = "fallback"
             return {
                 "response": "I understand. Please evacuate immediately if you can.",
                 "session_id": chat_req.session_id,
@@ -1238,18 +1522,15 @@ async def send_message(chat_req: ChatRequest):
         session["turn_count"] += 1
         resident_turns = session["turn_count"]
         
-        # Print detailed turn information
-        print("\n" + "="*80)
-        print(f"🔵 TURN {resident_turns} | Session: {chat_req.session_id[-8:]}")
-        print("="*80)
-        print(f"👤 RESIDENT: {chat_req.message}")
-        print("-"*80)
+        log_event(chat_log, "turn_start", session_id=chat_req.session_id, turn=resident_turns,
+                  character=character, resident_message=chat_req.message)
         
         # Set model for all operations
         model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
         
-        # Judge resident stance - LLM determines if conversation should end
-        judge = judge_resident_stance(history, model=model)
+        # Judge resident stance - local classifier, or the LLM judge when it is unsure
+        with metrics.span("judge", timings):
+            judge = judge_stance(history, model=model, session_id=chat_req.session_id)
         stance = judge["stance"]
         conf = judge["confidence"]
         
@@ -1257,11 +1538,15 @@ async def send_message(chat_req: ChatRequest):
         
         # Priority 1: LLM determines success end (agreement to evacuate)
         if can_end and stance == "AGREE" and conf >= 0.70:
-            print(f"\n✅ CONVERSATION ENDING: Resident agreed to evacuate!")
-            closing = generate_natural_closing(history, "agreement", character, model=model)
+            with metrics.span("closing", timings):
+                closing = generate_natural_closing(history, "agreement", character, model=model)
+            outcome = "agreement"
             history.append({"role": "operator", "text": closing})
-            print(f"💬 CLOSING MESSAGE: {closing}")
-            print("="*80 + "\n")
+            log_event(chat_log, "conversation_ended", session_id=chat_req.session_id, turn=resident_turns,
+                      end_reason=outcome, stance=stance, confidence=conf, closing=closing, timings_ms=timings)
+            log_turn_event("session_end", chat_req.session_id, participant_id=session.get("participant_id"),
+                           turn=resident_turns, resident_message=chat_req.message, end_reason=outcome,
+                           closing=closing, judge=judge, timings_ms=timings)
             
             # Conversation stays in memory until exit/completion
             
@@ -1271,7 +1556,8 @@ async def send_message(chat_req: ChatRequest):
                 "turn_count": resident_turns,
                 "conversation_ended": True,
                 "end_reason": "agreement",
-                "judge": judge
+                "judge": judge,
+                "timings_ms": timings
             }
         
         # Track consecutive refusals
@@ -1285,11 +1571,15 @@ async def send_message(chat_req: ChatRequest):
         
         # Priority 2: LLM determines refusal end (clear disagreement to evacuate)
         if can_end and session['consecutive_refuse'] >= 2:
-            print(f"\n🚫 CONVERSATION ENDING: Repeated refusals detected")
-            closing = generate_natural_closing(history, "refusal", character, model=model)
+            with metrics.span("closing", timings):
+                closing = generate_natural_closing(history, "refusal", character, model=model)
+            outcome = "refusal"
             history.append({"role": "operator", "text": closing})
-            print(f"💬 CLOSING MESSAGE: {closing}")
-            print("="*80 + "\n")
+            log_event(chat_log, "conversation_ended", session_id=chat_req.session_id, turn=resident_turns,
+                      end_reason=outcome, stance=stance, confidence=conf, closing=closing, timings_ms=timings)
+            log_turn_event("session_end", chat_req.session_id, participant_id=session.get("participant_id"),
+                           turn=resident_turns, resident_message=chat_req.message, end_reason=outcome,
+                           closing=closing, judge=judge, timings_ms=timings)
             
             # Conversation stays in memory until exit/completion
             
@@ -1299,16 +1589,21 @@ async def send_message(chat_req: ChatRequest):
                 "turn_count": resident_turns,
                 "conversation_ended": True,
                 "end_reason": "refusal",
-                "judge": judge
+                "judge": judge,
+                "timings_ms": timings
             }
         
         # Priority 3: Hard cap fallback (only if LLM hasn't decided to end)
         if resident_turns >= MAX_TURNS:
-            print(f"\n🔴 CONVERSATION ENDING: Max turns reached ({MAX_TURNS} resident turns)")
-            closing = generate_natural_closing(history, "max_turns", character, model=model)
+            with metrics.span("closing", timings):
+                closing = generate_natural_closing(history, "max_turns", character, model=model)
+            outcome = "max_turns"
             history.append({"role": "operator", "text": closing})
-            print(f"💬 CLOSING MESSAGE: {closing}")
-            print("="*80 + "\n")
+            log_event(chat_log, "conversation_ended", session_id=chat_req.session_id, turn=resident_turns,
+                      end_reason=outcome, stance=stance, confidence=conf, closing=closing, timings_ms=timings)
+            log_turn_event("session_end", chat_req.session_id, participant_id=session.get("participant_id"),
+                           turn=resident_turns, resident_message=chat_req.message, end_reason=outcome,
+                           closing=closing, judge=judge, timings_ms=timings)
             
             # Conversation stays in memory until exit/completion
             
@@ -1318,54 +1613,50 @@ async def send_message(chat_req: ChatRequest):
                 "turn_count": resident_turns,
                 "conversation_ended": True,
                 "end_reason": "max_turns",
-                "judge": judge
+                "judge": judge,
+                "timings_ms": timings
             }
         
         # Role-play conversation: use IQL policy selection
-        import time as timing_module
-        t1 = timing_module.time()
-        best_policy, qvals = iql_selector.select_policy(history, character=character, n_last=N_LAST_RESIDENT)
-        t2 = timing_module.time()
-        
-        # Print IQL policy selection with Q-values
-        print("\n🤖 IQL POLICY SELECTION:")
-        print(f"   ⭐ Selected: {best_policy.upper()} (took {t2-t1:.2f}s)")
-        print(f"   📊 Q-Values:")
-        sorted_policies = sorted(qvals.items(), key=lambda x: x[1], reverse=True)
-        for policy, qval in sorted_policies:
-            marker = "→" if policy == best_policy else " "
-            print(f"      {marker} {policy:10} : {qval:.4f}")
+        with metrics.span("policy_selection", timings):
+            best_policy, qvals = iql_selector.select_policy(history, character=character, n_last=N_LAST_RESIDENT,
+                                                            session_id=chat_req.session_id)
+        
+        # Full Q-value dumps are verbose: DEBUG level and sampled by LOG_SAMPLE_RATE
+        if sampled():
+            log_event(chat_log, "q_values", level=logging.DEBUG, session_id=chat_req.session_id,
+                      turn=resident_turns, policy=best_policy, q_values=qvals)
         
         # Retrieval + operator generation
-        # Lazy load policy retriever on first use
+        # The retriever loads in the shared warmup run; join it (without blocking the event loop)
         if policy_retriever is None:
-            initialize_policy_retriever_lazy()
-        
-        t3 = timing_module.time()
-        if policy_retriever:
-            examples = policy_retriever.retrieve_topk_pairs(best_policy, resident_query=chat_req.message, k=2)
-        else:
-            print("[WARNING] Policy retriever not available, using no examples")
-            examples = []
-        t4 = timing_module.time()
-        print(f"[RETRIEVAL] Got {len(examples)} examples (took {t4-t3:.2f}s)")
-        
-        t5 = timing_module.time()
-        prompt = build_prompt(best_policy, character, history, examples)
-        operator_response = call_openai_chat(prompt, model=model)
-        t6 = timing_module.time()
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(warmup_manager.start())),
+                                       timeout=CHAT_WARMUP_WAIT_S)
+            except asyncio.TimeoutError:
+                log_event(chat_log, "warmup_wait_timeout", level=logging.WARNING, session_id=chat_req.session_id,
+                          state=warmup_manager.state)
+        
+        with metrics.span("retrieval", timings):
+            if policy_retriever:
+                examples = policy_retriever.retrieve_topk_pairs(best_policy, resident_query=chat_req.message, k=2)
+            else:
+                log_event(chat_log, "retriever_unavailable", level=logging.WARNING, session_id=chat_req.session_id)
+                CHAT_FALLBACKS.inc(reason="no_retriever")
+                examples = []
+        
+        with metrics.span("prompt_build", timings):
+            built = build_operator_prompt(best_policy, history, examples)
+        llm_usage = {}
+        with metrics.span("llm_call", timings):
+            operator_response = call_openai_chat(messages=built.messages(), model=model, usage=llm_usage)
         
         history.append({"role": "operator", "text": operator_response})
         
-        # Print operator response with judge prediction
-        print(f"\n🎯 JUDGE PREDICTION:")
-        print(f"   Stance: {judge['stance']} (confidence: {judge['confidence']:.2f})")
-        if judge.get('reason'):
-            print(f"   Reason: {judge['reason'][:80]}...")
-        
-        print(f"\n💬 OPERATOR RESPONSE (via {model}, {t6-t5:.2f}s):")
-        print(f"   {operator_response}")
-        print("="*80 + "\n")
+        log_event(chat_log, "turn_complete", session_id=chat_req.session_id, turn=resident_turns,
+                  policy=best_policy, examples=len(examples), stance=judge["stance"],
+                  confidence=judge["confidence"], model=model, operator_response=operator_response,
+                  timings_ms=timings, llm_usage=llm_usage)
         
         # Store IQL data in session
         iql_turn_data = {
@@ -1375,11 +1666,15 @@ async def send_message(chat_req: ChatRequest):
             "selected_policy": best_policy,
             "q_values": qvals,
             "judge": judge,
+            "timings_ms": timings,
+            "llm_usage": llm_usage,  # prompt_tokens / cached_tokens / completion_tokens
             "timestamp": datetime.utcnow().isoformat()
         }
         if "iql_data" not in session:
             session["iql_data"] = []
         session["iql_data"].append(iql_turn_data)
+        log_turn_event("turn", chat_req.session_id, participant_id=session.get("participant_id"),
+                       character=character, **iql_turn_data)
         
         # Build response
         response_data = {
@@ -1389,15 +1684,20 @@ async def send_message(chat_req: ChatRequest):
             "conversation_ended": False,
             "judge": judge,
             "policy": best_policy,
-            "q_values": qvals
+            "q_values": qvals,
+            "timings_ms": timings
         }
         
+        outcome = "reply"
         return response_data
         
     except Exception as e:
-        print(f"[ERROR] Chat message failed: {e}")
-        traceback.print_exc()
+        chat_log.exception("chat_message_failed", extra={"session_id": chat_req.session_id, "error": str(e)})
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        CHAT_IN_FLIGHT.dec()
+        CHAT_TURN_LATENCY.observe(time.perf_counter() - turn_start, outcome=outcome)
+        CHAT_TURNS.inc(outcome=outcome)
 
 
 @app.get("/api/chat/history/{session_id}")
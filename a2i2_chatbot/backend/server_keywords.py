@@ -1,15 +1,20 @@
 # backend/server.py
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from ollama_0220 import simulate_interactive_single_turn, conversation_manager
 import subprocess
+import asyncio
 import os
+import re
 import json
+import uuid
 import traceback
 from pathlib import Path
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 import time
+from typing import Dict, Optional
 
 app = FastAPI()
 
@@ -80,6 +85,30 @@ class ChatRequest(BaseModel):
     townPerson: str
     userInput: str
     mode: str  # "interactive" or "auto"
+    sessionId: Optional[str] = None  # client-issued token, see chat()
+
+# Client session tokens: uuid hex or similar, never used as a path
+SESSION_TOKEN_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+class SessionLocks:
+    """One asyncio.Lock per chat session; idle locks of evicted conversations are pruned as new sessions arrive"""
+
+    def __init__(self, prune_at: int):
+        self.prune_at = prune_at
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def get(self, session_id: str) -> asyncio.Lock:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            if len(self._locks) >= self.prune_at:
+                # An unlocked lock has no waiters, so dropping it is safe
+                for sid, existing in list(self._locks.items()):
+                    if not existing.locked() and sid not in conversation_manager:
+                        del self._locks[sid]
+            lock = self._locks[session_id] = asyncio.Lock()
+        return lock
+
+session_locks = SessionLocks(prune_at=conversation_manager.max_sessions)
 
 @app.get("/")
 async def root():
@@ -105,21 +134,17 @@ async def get_persona(town_person: str):
         print(f"Error in get_persona: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/chat")
-async def chat(request: Request):
+def _chat_turn(data: dict, session_id: str) -> dict:
+    """One /chat turn. Blocking (LLM calls), so chat() runs it in the threadpool under the session's lock."""
     try:
-        data = await request.json()
         town_person = data.get("townPerson")
         user_input = data.get("userInput", "")
         mode = data.get("mode", "interactive")
         speaker = data.get("speaker", "")
         auto_julie = data.get("autoJulie", False)
         town_person_lower = town_person.lower()
-        
-        # Simulating session tracking on the server side
-        session_id = f"{town_person_lower}_session"
 
-        # If in interactive mode, the session ID is stable across requests
+        # session_id is "<town_person>:<client token>", issued per browser tab (see chat())
         if mode == "interactive":
             print(f"Interactive mode: session_id = {session_id}")
             
@@ -712,11 +737,42 @@ async def chat(request: Request):
                 print(f"Error in auto mode generation: {str(e)}")
                 traceback.print_exc()
                 return {"error": f"Error generating conversation: {str(e)}"}
+        else:
+            return {"error": f"Unknown mode: {mode}"}
     except Exception as e:
         print(f"Error in chat endpoint: {str(e)}")
         traceback.print_exc()
         return {"error": str(e)}
 
+@app.post("/chat")
+async def chat(request: Request):
+    """
+    Session-isolated chat turn. The client sends a sessionId token (chat.js keeps one per tab and
+    character); without a valid one a new token is issued and returned as "sessionId".
+    Turns of the same session serialize on its lock; different sessions run in parallel.
+    """
+    try:
+        data = await request.json()
+    except Exception as e:
+        return {"error": f"Invalid JSON body: {str(e)}"}
+    if not isinstance(data, dict):
+        return {"error": "Request body must be a JSON object"}
+    town_person = data.get("townPerson")
+    if not town_person or not isinstance(town_person, str):
+        return {"error": "townPerson is required and must be a string"}
+
+    token = data.get("sessionId")
+    if not isinstance(token, str) or not SESSION_TOKEN_RE.match(token):
+        token = uuid.uuid4().hex
+    session_id = f"{town_person.lower()}:{token}"
+
+    async with session_locks.get(session_id):
+        result = await run_in_threadpool(_chat_turn, data, session_id)
+    if not isinstance(result, dict):
+        result = {"error": "No response generated"}
+    result["sessionId"] = token
+    return result
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
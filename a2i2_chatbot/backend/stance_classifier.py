@@ -0,0 +1,356 @@
+"""
+Local resident-stance classifier (AGREE / REFUSE / DELAY / UNKNOWN)
+
+A multinomial logistic regression over MiniLM embeddings of the recent resident
+turns, distilled from the LLM judge (judge_resident_stance in server.py). The
+server asks it first and only calls the LLM judge when its top probability is
+below STANCE_LOCAL_THRESHOLD.
+
+Features: [mean embedding of the last N resident turns, embedding of the last
+resident turn] (768-d). Resident-turn embeddings are cached, so a turn usually
+encodes just the one new message.
+
+Training data:
+  • logged judge outputs: turn logs (turn_log.py "turn" / "session_end" records)
+    and completed study records (survey_responses/completed/*.json iql_data)
+  • 2023ClaireTo/Dialogues transcripts, labeled once by the LLM judge
+    (--label-transcripts; labels are cached in the dataset JSONL)
+
+Usage:
+  python stance_classifier.py build-dataset [--label-transcripts]   # -> indexes/stance_dataset.jsonl
+  python stance_classifier.py train                                 # -> indexes/stance_classifier.pkl
+                                                                    #    (holdout accuracy/coverage@threshold, Brier, ECE)
+  python stance_classifier.py predict "I'm not leaving my house"
+"""
+
+import argparse
+import glob
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from encoder_registry import get_encoder
+
+BACKEND_DIR = Path(__file__).resolve().parent
+BASE_DIR = Path(os.getenv('A2I2_BASE_DIR', BACKEND_DIR.parent))
+DEFAULT_DATASET = BACKEND_DIR / "indexes" / "stance_dataset.jsonl"
+DEFAULT_MODEL_PATH = Path(os.getenv("STANCE_CLASSIFIER_PATH", BACKEND_DIR / "indexes" / "stance_classifier.pkl"))
+TRANSCRIPTS_DIR = BASE_DIR / "2023ClaireTo" / "Dialogues"
+TURN_LOG_DIR = Path(os.getenv("TURN_LOG_DIR", BASE_DIR / "turn_logs"))
+SURVEY_RESPONSES_DIR = BASE_DIR / "survey_responses"
+
+STANCES = ["AGREE", "REFUSE", "DELAY", "UNKNOWN"]
+N_RESIDENT = 3
+EMBED_MODEL = "all-MiniLM-L6-v2"
+EMBED_CACHE_SIZE = 4096
+
+
+def resident_window(history: List[Dict[str, str]], n: int = N_RESIDENT) -> List[str]:
+    return [h["text"] for h in history if h.get("role") == "resident" and h.get("text")][-n:]
+
+
+# ============================================================================
+# Classifier
+# ============================================================================
+
+class StanceClassifier:
+    """Fitted sklearn model + encoder; predict() returns a judge-shaped dict"""
+
+    def __init__(self, model, classes: List[str], encoder=None, n_resident: int = N_RESIDENT):
+        self.model = model
+        self.classes = list(classes)
+        self.n_resident = n_resident
+        self.encoder = encoder
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: Path = DEFAULT_MODEL_PATH, encoder=None) -> "StanceClassifier":
+        with open(path, "rb") as f:
+            blob = pickle.load(f)
+        return cls(blob["model"], blob["classes"], encoder=encoder, n_resident=blob.get("n_resident", N_RESIDENT))
+
+    def save(self, path: Path, meta: Optional[dict] = None):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            pickle.dump({"model": self.model, "classes": self.classes, "n_resident": self.n_resident,
+                         "encoder": EMBED_MODEL, **(meta or {})}, f)
+
+    # ------------------------------------------------------------------
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        encoder = self.encoder or get_encoder(EMBED_MODEL)
+        with self._lock:
+            missing = [t for t in dict.fromkeys(texts) if t not in self._cache]
+        if missing:
+            embs = np.asarray(encoder.encode(missing, convert_to_numpy=True, normalize_embeddings=True,
+                                             show_progress_bar=False), dtype=np.float32)
+            with self._lock:
+                for text, emb in zip(missing, embs):
+                    self._cache[text] = emb
+                while len(self._cache) > EMBED_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        with self._lock:
+            return np.stack([self._cache[t] for t in texts])
+
+    def features(self, windows: List[List[str]]) -> np.ndarray:
+        dim = None
+        flat = [t for w in windows for t in w]
+        embs = self._embed(flat) if flat else None
+        rows, pos = [], 0
+        for w in windows:
+            if w:
+                e = embs[pos:pos + len(w)]
+                pos += len(w)
+                rows.append(np.concatenate([e.mean(axis=0), e[-1]]))
+                dim = rows[-1].shape[0]
+            else:
+                rows.append(None)
+        dim = dim or 2 * 384
+        return np.stack([r if r is not None else np.zeros(dim, dtype=np.float32) for r in rows]).astype(np.float32)
+
+    def predict_proba(self, history: List[Dict[str, str]]) -> Dict[str, float]:
+        window = resident_window(history, self.n_resident)
+        if not window:
+            return {s: (1.0 if s == "UNKNOWN" else 0.0) for s in self.classes}
+        probs = self.model.predict_proba(self.features([window]))[0]
+        return dict(zip(self.classes, probs.tolist()))
+
+    def predict(self, history: List[Dict[str, str]]) -> dict:
+        """{"stance", "confidence", "reason", "source": "local"} like judge_resident_stance"""
+        probs = self.predict_proba(history)
+        stance = max(probs, key=probs.get)
+        return {
+            "stance": stance,
+            "confidence": round(float(probs[stance]), 4),
+            "reason": "local classifier",
+            "source": "local",
+            "probs": {k: round(v, 4) for k, v in probs.items()},
+        }
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+_classifier_loaded = False
+
+
+def get_stance_classifier(encoder=None) -> Optional[StanceClassifier]:
+    """Process-wide classifier, or None if no trained model exists (or sklearn is missing)"""
+    global _classifier, _classifier_loaded
+    if not _classifier_loaded:
+        with _classifier_lock:
+            if not _classifier_loaded:
+                if DEFAULT_MODEL_PATH.exists():
+                    try:
+                        _classifier = StanceClassifier.load(DEFAULT_MODEL_PATH, encoder=encoder)
+                        print(f"[STANCE] Loaded local classifier from {DEFAULT_MODEL_PATH}")
+                    except Exception as e:
+                        print(f"[STANCE] Could not load {DEFAULT_MODEL_PATH}: {e}")
+                _classifier_loaded = True
+    return _classifier
+
+
+# ============================================================================
+# Training data
+# ============================================================================
+
+def _example(window: List[str], stance: str, source: str, confidence: float = None) -> Optional[dict]:
+    stance = str(stance or "").upper()
+    if not window or stance not in STANCES:
+        return None
+    return {"window": window, "stance": stance, "confidence": confidence, "source": source}
+
+
+def _llm_judged(judge: dict) -> bool:
+    """Only LLM judgements are labels; "local" ones are this classifier's own predictions.
+    Records from before the local classifier carry no source and were all LLM-judged."""
+    return judge.get("source", "llm") == "llm"
+
+
+def examples_from_turn_logs(directory: Path) -> Iterator[dict]:
+    """Rebuild each session's resident window in log order and pair it with the logged judge"""
+    from turn_log import iter_records
+
+    windows: Dict[str, List[str]] = {}
+    for rec in iter_records(directory):
+        if rec.get("event") not in ("turn", "session_end") or not rec.get("resident_message"):
+            continue
+        window = windows.setdefault(rec.get("session_id"), [])
+        window.append(rec["resident_message"])
+        judge = rec.get("judge") or {}
+        if not _llm_judged(judge):
+            continue
+        ex = _example(window[-N_RESIDENT:], judge.get("stance"), "turn_log", judge.get("confidence"))
+        if ex:
+            yield ex
+
+
+def examples_from_completed(responses_dir: Path) -> Iterator[dict]:
+    for path in sorted(glob.glob(str(responses_dir / "completed" / "*.json"))):
+        try:
+            record = json.loads(Path(path).read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            continue
+        for conv in record.get("conversations", []):
+            window: List[str] = []
+            for turn in conv.get("iql_data") or []:
+                if not turn.get("resident_message"):
+                    continue
+                window.append(turn["resident_message"])
+                judge = turn.get("judge") or {}
+                if not _llm_judged(judge):
+                    continue
+                ex = _example(window[-N_RESIDENT:], judge.get("stance"), "completed", judge.get("confidence"))
+                if ex:
+                    yield ex
+
+
+def transcript_histories(directory: Path) -> Iterator[List[Dict[str, str]]]:
+    """Every prefix ending in a resident turn, as server-style history (speaker 1 = operator)"""
+    import pandas as pd
+
+    for path in sorted(directory.glob("*.xlsx")):
+        df = pd.read_excel(path)
+        history = []
+        for speaker, text in zip(df["speaker"], df["text"]):
+            if not isinstance(text, str) or not text.strip():
+                continue
+            role = "operator" if speaker == 1 else "resident"
+            history.append({"role": role, "text": text.strip()})
+            if role == "resident":
+                yield list(history)
+
+
+def examples_from_transcripts(directory: Path, model: str) -> Iterator[dict]:
+    """Label transcript prefixes with the LLM judge (the teacher this classifier distills)"""
+    from server import judge_resident_stance
+
+    for history in transcript_histories(directory):
+        judge = judge_resident_stance(history, model=model)
+        if judge.get("reason", "").startswith("Error") or judge.get("reason") == "API key not set":
+            continue
+        ex = _example(resident_window(history), judge.get("stance"), "transcript", judge.get("confidence"))
+        if ex:
+            yield ex
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def build_dataset(out: Path, label_transcripts: bool, model: str):
+    seen = set()
+    counts: Dict[str, int] = {}
+    out.parent.mkdir(parents=True, exist_ok=True)
+    sources = [examples_from_turn_logs(TURN_LOG_DIR), examples_from_completed(SURVEY_RESPONSES_DIR)]
+    if label_transcripts:
+        sources.append(examples_from_transcripts(TRANSCRIPTS_DIR, model))
+    with open(out, "w", encoding="utf-8") as f:
+        for source in sources:
+            for ex in source:
+                key = (tuple(ex["window"]), ex["stance"])
+                if key in seen:
+                    continue
+                seen.add(key)
+                counts[ex["source"]] = counts.get(ex["source"], 0) + 1
+                f.write(json.dumps(ex, ensure_ascii=False) + "\n")
+    print(f"[STANCE] Wrote {sum(counts.values())} examples to {out}: {counts}")
+
+
+def calibration_report(probs: np.ndarray, y: np.ndarray, bins: int = 10) -> Dict[str, float]:
+    """Multiclass Brier score and top-label expected calibration error (equal-width bins)"""
+    onehot = np.eye(probs.shape[1])[y]
+    brier = float(((probs - onehot) ** 2).sum(axis=1).mean())
+    top = probs.max(axis=1)
+    correct = probs.argmax(axis=1) == y
+    edges = np.linspace(0.0, 1.0, bins + 1)
+    ece = 0.0
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        mask = (top > lo) & (top <= hi)
+        if mask.any():
+            ece += mask.mean() * abs(correct[mask].mean() - top[mask].mean())
+    return {"brier": round(brier, 4), "ece": round(float(ece), 4)}
+
+
+def train(dataset: Path, out: Path, c: float, holdout: float, seed: int):
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.model_selection import train_test_split
+
+    rows = [json.loads(line) for line in dataset.open(encoding="utf-8") if line.strip()]
+    if not rows:
+        raise SystemExit(f"No examples in {dataset}; run build-dataset first")
+    classes = [s for s in STANCES if any(r["stance"] == s for r in rows)]
+    clf = StanceClassifier(None, classes)
+    X = clf.features([r["window"] for r in rows])
+    y = np.array([classes.index(r["stance"]) for r in rows])
+
+    report = {"examples": len(rows), "classes": {s: int((y == i).sum()) for i, s in enumerate(classes)}}
+    if holdout > 0 and len(rows) >= 20:
+        stratify = y if min(np.bincount(y)) >= 2 else None
+        X_tr, X_te, y_tr, y_te = train_test_split(X, y, test_size=holdout, random_state=seed, stratify=stratify)
+        # No class_weight: reweighting classes skews predict_proba, and the server
+        # treats the top probability as a confidence (STANCE_LOCAL_THRESHOLD)
+        model = LogisticRegression(C=c, max_iter=2000).fit(X_tr, y_tr)
+        probs = np.zeros((len(y_te), len(classes)))
+        probs[:, model.classes_] = model.predict_proba(X_te)
+        pred = probs.argmax(axis=1)
+        top = probs.max(axis=1)
+        report["holdout_accuracy"] = round(float((pred == y_te).mean()), 4)
+        report.update({f"holdout_{k}": v for k, v in calibration_report(probs, y_te).items()})
+        for threshold in (0.6, 0.7, 0.8, 0.9):
+            mask = top >= threshold
+            report[f"coverage@{threshold}"] = round(float(mask.mean()), 4)
+            report[f"accuracy@{threshold}"] = round(float((pred[mask] == y_te[mask]).mean()), 4) if mask.any() else None
+
+    clf.model = LogisticRegression(C=c, max_iter=2000).fit(X, y)
+    t0 = time.perf_counter()
+    for _ in range(20):
+        clf.predict_proba([{"role": "resident", "text": "I guess I could go later"}])
+    report["predict_ms_cached"] = round((time.perf_counter() - t0) / 20 * 1000, 3)
+    clf.save(out, meta={"trained_at": time.time(), "report": report})
+    print(json.dumps(report, indent=2))
+    print(f"[STANCE] Saved classifier to {out}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build, train and query the local stance classifier.")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    b = sub.add_parser("build-dataset")
+    b.add_argument("--out", type=Path, default=DEFAULT_DATASET)
+    b.add_argument("--label-transcripts", action="store_true",
+                   help="Label 2023ClaireTo/Dialogues prefixes with the LLM judge (needs OPENAI_API_KEY)")
+    b.add_argument("--model", default=os.getenv("OPENAI_MODEL", "gpt-4o-mini"))
+
+    t = sub.add_parser("train")
+    t.add_argument("--dataset", type=Path, default=DEFAULT_DATASET)
+    t.add_argument("--out", type=Path, default=DEFAULT_MODEL_PATH)
+    t.add_argument("--C", type=float, default=1.0)
+    t.add_argument("--holdout", type=float, default=0.2)
+    t.add_argument("--seed", type=int, default=13)
+
+    p = sub.add_parser("predict")
+    p.add_argument("texts", nargs="+", help="Recent resident turns, oldest first")
+
+    args = ap.parse_args()
+    if args.command == "build-dataset":
+        build_dataset(args.out, args.label_transcripts, args.model)
+    elif args.command == "train":
+        train(args.dataset, args.out, args.C, args.holdout, args.seed)
+    else:
+        clf = StanceClassifier.load(DEFAULT_MODEL_PATH)
+        history = [{"role": "resident", "text": t} for t in args.texts]
+        t0 = time.perf_counter()
+        result = clf.predict(history)
+        result["latency_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
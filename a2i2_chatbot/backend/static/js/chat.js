@@ -16,6 +16,24 @@ const API_BASE_URL = 'http://localhost:8001';
 const selectedPerson = sessionStorage.getItem('selectedPerson');
 const personaData = JSON.parse(sessionStorage.getItem('personaData'));
 
+// Per-tab session token so concurrent users of the same character get separate histories
+const sessionKey = `chatSessionId:${selectedPerson}`;
+let chatSessionId = sessionStorage.getItem(sessionKey);
+if (!chatSessionId) {
+    chatSessionId = (window.crypto && crypto.randomUUID)
+        ? crypto.randomUUID().replace(/-/g, '')
+        : Math.random().toString(36).slice(2) + Date.now().toString(36);
+    sessionStorage.setItem(sessionKey, chatSessionId);
+}
+
+// Keep the token the server echoes back (it issues a new one if ours was rejected)
+function rememberSession(data) {
+    if (data && data.sessionId && data.sessionId !== chatSessionId) {
+        chatSessionId = data.sessionId;
+        sessionStorage.setItem(sessionKey, chatSessionId);
+    }
+}
+
 // Update chat title
 document.getElementById('chat-title').textContent = `Chat with ${selectedPerson} as Emergency Operator`;
 
@@ -135,6 +153,7 @@ async function generateJulieResponse() {
         },
         body: JSON.stringify({
             townPerson: selectedPerson,
+            sessionId: chatSessionId,
             userInput: "",
             mode: "interactive",
             speaker: "Julie",
@@ -144,6 +163,7 @@ async function generateJulieResponse() {
     .then(response => response.json())
     .then(data => {
         isGenerating = false;
+        rememberSession(data);
         
         // Check if data is null or undefined before accessing properties
         if (!data) {
@@ -340,6 +360,7 @@ async function sendMessage() {
             },
             body: JSON.stringify({
                 townPerson: selectedPerson,
+                sessionId: chatSessionId,
                 userInput: userInput,
                 mode: 'interactive',
                 speaker: speaker  // Pass the speaker (Julie or Operator)
@@ -351,6 +372,7 @@ async function sendMessage() {
         }
         
         data = await response.json();
+        rememberSession(data);
         console.log('Received response data:', data);
         
         // Check if data is null or undefined before accessing properties
@@ -456,6 +478,7 @@ async function generateAutoChat() {
                 },
                 body: JSON.stringify({
                     townPerson: townPerson,
+                    sessionId: chatSessionId,
                     mode: 'auto'
                 })
             });
@@ -0,0 +1,111 @@
+"""
+Structured JSON logging with a queue-backed handler
+
+Hot-path code (chat turns, IQL calls) only enqueues log records; a single
+background QueueListener thread formats them as one JSON object per line and
+writes to stdout, so request handlers never block on stdout under load.
+
+  LOG_LEVEL          minimum level (DEBUG, INFO, WARNING, ...; default INFO)
+  LOG_SAMPLE_RATE    fraction of verbose per-turn dumps (e.g. Q-value tables)
+                     that are emitted (default 1.0; 0 disables them)
+
+Usage:
+    from structured_logging import get_logger, log_event, sampled
+
+    log = get_logger("chat")
+    log_event(log, "turn_start", session_id=sid, turn=3)
+    if sampled():
+        log_event(log, "q_values", level=logging.DEBUG, session_id=sid, q_values=qvals)
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, event plus any structured fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:  # records logged without the queue handler
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class _StructuredQueueHandler(logging.handlers.QueueHandler):
+    """Keeps `event` clean: the traceback travels as its own field instead of being merged into msg"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+            record.exc_text = None
+        return record
+
+
+def _setup():
+    """Install the queue handler on the 'a2i2' logger and start the writer thread (once)"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        log_queue = queue.SimpleQueue()
+
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(JSONFormatter())
+
+        root = logging.getLogger("a2i2")
+        root.setLevel(LOG_LEVEL)
+        root.addHandler(_StructuredQueueHandler(log_queue))
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=False)
+        _listener.start()
+        atexit.register(_listener.stop)  # flush queued records on shutdown
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger under the 'a2i2' namespace, e.g. get_logger('chat') -> 'a2i2.chat'"""
+    _setup()
+    return logging.getLogger(f"a2i2.{name}")
+
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO, **fields):
+    """Log a named event with structured fields (session_id, turn, latency_ms, ...)"""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra=fields)
+
+
+def sampled(rate: float = None) -> bool:
+    """Whether to emit a verbose dump this time (LOG_SAMPLE_RATE by default)"""
+    rate = LOG_SAMPLE_RATE if rate is None else rate
+    return rate >= 1.0 or (rate > 0 and random.random() < rate)
@@ -0,0 +1,313 @@
+"""
+Append-only turn event log with group commit
+
+Durable record of every conversation turn (policy, Q-values, judge, timings)
+shared by server.py and interactive_iql_operator_chat.py.
+
+  • Segmented JSONL files: <dir>/<prefix>-000001.jsonl, rotated at max_segment_bytes
+  • append() only enqueues; a background writer thread batches records and
+    commits each group with a single write + flush + fsync, either every
+    flush_interval_ms or once max_batch records are waiting
+  • Every record gets a monotonically increasing `seq` and a `ts`
+  • a failed commit is retried (in seq order) before anything newer, so the
+    durable watermark never skips records; reopening after a crash first
+    truncates a torn last line so new records start on a fresh line
+  • iter_records() / replay_sessions() read the segments back in order and
+    tolerate a torn last line from a crash
+
+CLI:
+  python turn_log.py stats  <dir>
+  python turn_log.py replay <dir> [--session SESSION_ID]
+"""
+
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+DEFAULT_PREFIX = "turns"
+
+_STOP = object()
+
+
+class TurnLogWriter:
+    """Buffered, group-committed writer for one log directory (one writer per directory)"""
+
+    def __init__(self, directory, prefix: str = DEFAULT_PREFIX,
+                 max_segment_bytes: int = 64 * 1024 * 1024,
+                 flush_interval_ms: float = 20.0,
+                 max_batch: int = 256,
+                 fsync: bool = True,
+                 retry_interval_ms: float = 500.0):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.prefix = prefix
+        self.max_segment_bytes = max_segment_bytes
+        self.flush_interval_s = flush_interval_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.fsync = fsync
+        self.retry_interval_s = retry_interval_ms / 1000.0
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._seq_lock = threading.Lock()
+        self._committed = threading.Condition()
+        self._next_seq = 0
+        self._committed_seq = -1
+        self.groups = 0
+        self.records = 0
+        self.failed_commits = 0
+
+        segments = list_segments(self.directory, prefix)
+        self._segment_index = _segment_number(segments[-1]) if segments else 1
+        # Continue the sequence after a restart (the newest segment may be empty after a rotation)
+        for segment in reversed(segments):
+            last = _last_record(segment)
+            if last is not None:
+                self._next_seq = last.get("seq", -1) + 1
+                self._committed_seq = self._next_seq - 1
+                break
+        self._file = None
+        self._open_segment()
+
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"turn-log-{prefix}", daemon=True)
+        self._thread.start()
+
+    # ------------------------------------------------------------------
+    def _segment_path(self, index: int) -> Path:
+        return self.directory / f"{self.prefix}-{index:06d}.jsonl"
+
+    def _open_segment(self):
+        path = self._segment_path(self._segment_index)
+        if path.exists() and path.stat().st_size >= self.max_segment_bytes:
+            self._segment_index += 1
+            path = self._segment_path(self._segment_index)
+        elif path.exists():
+            _truncate_torn_tail(path)
+        self._file = open(path, "ab")
+
+    def _rotate_if_needed(self):
+        """Start the next segment once the current one is full; on failure keep writing the current one"""
+        if self._file.tell() < self.max_segment_bytes:
+            return
+        try:
+            # Open the next segment before closing this one, so a failure leaves a usable file
+            new_file = open(self._segment_path(self._segment_index + 1), "ab")
+        except OSError as e:
+            print(f"[TURN-LOG] Could not open the next segment (retrying after the next group): {e}")
+            return
+        self._file.close()
+        self._segment_index += 1
+        self._file = new_file
+
+    # ------------------------------------------------------------------
+    def append(self, record: dict) -> int:
+        """Queue one record for the next group commit; returns its sequence number"""
+        if self._closed:
+            raise RuntimeError("TurnLogWriter is closed")
+        # Enqueue under the lock so queue order == seq order (groups commit in seq order)
+        with self._seq_lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._queue.put(dict(record, seq=seq, ts=record.get("ts", time.time())))
+        return seq
+
+    def wait_durable(self, seq: int, timeout: Optional[float] = None) -> bool:
+        """Block until record `seq` has been fsynced (or timeout); returns True if durable"""
+        with self._committed:
+            return self._committed.wait_for(lambda: self._committed_seq >= seq, timeout=timeout)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything appended so far is committed"""
+        with self._seq_lock:
+            last = self._next_seq - 1
+        return last < 0 or self.wait_durable(last, timeout)
+
+    def close(self, timeout: Optional[float] = 5.0):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    # ------------------------------------------------------------------
+    def _run(self):
+        pending: List[dict] = []  # a failed group, retried ahead of newer records
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.retry_interval_s if pending else None)
+            except queue.Empty:
+                item = None
+            batch = []
+            if item is _STOP:
+                stopping = True
+            elif item is not None:
+                batch.append(item)
+                deadline = time.monotonic() + self.flush_interval_s
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+            if pending or batch:
+                batch = pending + batch
+                pending = [] if self._commit(batch) else batch
+        # Drain anything appended before close()
+        leftover = pending
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftover.append(item)
+        if leftover and not self._commit(leftover):
+            print(f"[TURN-LOG] {len(leftover)} records not written at close")
+        self._file.close()
+
+    def _commit(self, batch: List[dict]) -> bool:
+        """Write + fsync one group; on failure roll the segment back and leave the watermark alone"""
+        data = b"".join(
+            (json.dumps(r, ensure_ascii=False, default=str) + "\n").encode("utf-8") for r in batch
+        )
+        offset = self._file.tell()
+        try:
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        except OSError as e:
+            self.failed_commits += 1
+            print(f"[TURN-LOG] Commit of {len(batch)} records failed (will retry): {e}")
+            try:
+                # Drop any partial write so the retry does not land after a torn line
+                self._file.truncate(offset)
+            except OSError:
+                pass
+            return False
+        self.groups += 1
+        self.records += len(batch)
+        with self._committed:
+            # Groups commit strictly in seq order, so this batch's max seq is the new watermark
+            self._committed_seq = max(self._committed_seq, max(r["seq"] for r in batch))
+            self._committed.notify_all()
+        # Only after the group is durable and acknowledged: a rotation failure must never roll it back
+        self._rotate_if_needed()
+        return True
+
+
+# ============================================================================
+# Reading / replay
+# ============================================================================
+
+def _segment_number(path: Path) -> int:
+    return int(path.stem.rsplit("-", 1)[-1])
+
+
+def _truncate_torn_tail(path: Path):
+    """Cut a segment back to its last newline (drops a partial record left by a crash)"""
+    with path.open("r+b") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        pos = size
+        while pos > 0:
+            step = min(64 * 1024, pos)
+            pos -= step
+            f.seek(pos)
+            cut = f.read(step).rfind(b"\n")
+            if cut != -1:
+                f.truncate(pos + cut + 1)
+                break
+        else:
+            f.truncate(0)
+        print(f"[TURN-LOG] Truncated torn record at the end of {path.name}")
+
+
+def _last_record(path: Path) -> Optional[dict]:
+    """Last complete record of a segment (reads only the tail)"""
+    with path.open("rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 64 * 1024))
+        lines = f.read().splitlines()
+    for line in reversed(lines):
+        try:
+            return json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            continue
+    return None
+
+
+def list_segments(directory, prefix: str = DEFAULT_PREFIX) -> List[Path]:
+    return sorted(Path(directory).glob(f"{prefix}-*.jsonl"), key=_segment_number)
+
+
+def iter_records(directory, prefix: str = DEFAULT_PREFIX) -> Iterator[dict]:
+    """All records in commit order; skips a torn (partially written) line after a crash"""
+    for segment in list_segments(directory, prefix):
+        with segment.open("r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def replay_sessions(directory, prefix: str = DEFAULT_PREFIX) -> Dict[str, List[dict]]:
+    """session_id -> that session's records in order (rebuilds iql_data after a crash)"""
+    sessions: Dict[str, List[dict]] = {}
+    for record in iter_records(directory, prefix):
+        sessions.setdefault(record.get("session_id") or "unknown", []).append(record)
+    return sessions
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Inspect or replay a turn event log.")
+    ap.add_argument("command", choices=["stats", "replay"])
+    ap.add_argument("directory", type=Path)
+    ap.add_argument("--prefix", default=DEFAULT_PREFIX)
+    ap.add_argument("--session", default=None, help="Only replay this session_id")
+    args = ap.parse_args()
+
+    sessions = replay_sessions(args.directory, args.prefix)
+    if args.command == "stats":
+        segments = list_segments(args.directory, args.prefix)
+        events: Dict[str, int] = {}
+        for records in sessions.values():
+            for r in records:
+                events[r.get("event", "?")] = events.get(r.get("event", "?"), 0) + 1
+        print(json.dumps({
+            "segments": len(segments),
+            "bytes": sum(p.stat().st_size for p in segments),
+            "sessions": len(sessions),
+            "events": events,
+        }, indent=2))
+        return
+
+    for session_id, records in sessions.items():
+        if args.session and session_id != args.session:
+            continue
+        for r in records:
+            print(json.dumps(r, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
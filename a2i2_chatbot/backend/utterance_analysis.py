@@ -0,0 +1,206 @@
+"""
+Single-call multi-label utterance analysis
+
+Replaces the per-question yes/no LLM checks in ollama_0220.py and
+ollama_0220_openai.py (decision_making, emphasize_danger_check, ...) with one
+structured JSON call that returns every label at once.
+
+  • results are cached per (text, name) hash, so asking several checks about the
+    same utterance costs one LLM call in total
+  • if the LLM call fails or returns unusable JSON (or UTTERANCE_ANALYSIS_MODE=local),
+    labels come from a local embedding classifier: cosine similarity of the last
+    line to positive vs. negative prototype sentences per label
+
+Usage:
+    analyzer = UtteranceAnalyzer(send_to_openai_json)
+    labels = analyzer.analyze("Operator: The fire is spreading, your life matters")
+    labels["emphasizes_danger"], labels["emphasizes_value_of_life"], labels["source"]
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+from encoder_registry import get_encoder
+
+ANALYSIS_MODE = os.getenv("UTTERANCE_ANALYSIS_MODE", "llm").lower()  # "llm" (local fallback) or "local"
+CACHE_SIZE = int(os.getenv("UTTERANCE_ANALYSIS_CACHE", "4096"))
+
+# label -> question asked of the LLM (mirrors the old one-question prompts)
+LABELS = {
+    "leaving": "Is {name} leaving / going / being evacuated, judging by the conversation?",
+    "emphasizes_danger": "Is the last utterance emphasizing danger?",
+    "emphasizes_value_of_life": "Is the last utterance emphasizing the value of life?",
+    "mentions_fire": "Does the last utterance mention fire?",
+    "asks_about_fire_conditions": "Is the last utterance asking about the fire conditions?",
+    "ending_conversation": "Is the last message ending the conversation (thanks, goodbye or similar)?",
+    "asks_about_children": "Does the last utterance ask about children?",
+    "asks_about_parents": "Does the last utterance ask about parents?",
+    "operator_would_leave": "Does the operator express he would leave if he were in the situation?",
+}
+
+ANALYSIS_PROMPT = """Analyze the following text from a fire-evacuation conversation between an operator and {name}.
+If it has several lines, "the last utterance" means the last line.
+
+Text:
+{text}
+
+Answer every question with true or false:
+{questions}
+
+Respond with only a JSON object with exactly these keys: {keys}"""
+
+# Local fallback: (positive, negative) prototype sentences per label
+PROTOTYPES = {
+    "leaving": (
+        ["Okay, I'll leave now.", "We're heading out.", "Alright, I'm going to evacuate.", "I'm on my way to the shelter."],
+        ["I'm not leaving.", "I'm staying here.", "I don't need to go anywhere.", "Maybe later, not now."],
+    ),
+    "emphasizes_danger": (
+        ["The fire is very close, you are in danger.", "This is life threatening, the fire is spreading fast.",
+         "It's extremely dangerous to stay."],
+        ["How are you doing today?", "Do you need a ride?", "Thank you, goodbye."],
+    ),
+    "emphasizes_value_of_life": (
+        ["Your life is more important than your house.", "Nothing is worth more than your life.",
+         "Your family needs you safe and alive."],
+        ["The fire is moving east.", "Where are you right now?", "Thank you, goodbye."],
+    ),
+    "mentions_fire": (
+        ["There is a fire nearby.", "The wildfire is spreading.", "I can see smoke and flames."],
+        ["Hello, how are you?", "Do you have a car?", "Thank you, goodbye."],
+    ),
+    "asks_about_fire_conditions": (
+        ["How bad is the fire?", "Where is the fire now?", "How close is the fire to us?"],
+        ["I'm leaving now.", "Hello there.", "Thank you, goodbye."],
+    ),
+    "ending_conversation": (
+        ["Thanks, goodbye.", "Okay, thank you, bye.", "Sounds good, see you."],
+        ["Why should I leave?", "Where is the fire?", "I'm not sure about this."],
+    ),
+    "asks_about_children": (
+        ["Do you have kids with you?", "Are your children safe?", "Is your child at home?"],
+        ["Do you have a car?", "Is your mother with you?", "The fire is close."],
+    ),
+    "asks_about_parents": (
+        ["Are your parents with you?", "Is your mother safe?", "Where is your father?"],
+        ["Do you have kids?", "Do you have a car?", "The fire is close."],
+    ),
+    "operator_would_leave": (
+        ["If I were you I would leave right now.", "I would evacuate if I were in your position.",
+         "In your situation I'd get out immediately."],
+        ["You need to leave now.", "Where are you?", "The fire is close."],
+    ),
+}
+FIRE_KEYWORDS = ("fire", "smoke", "flame", "burn", "blaze", "wildfire")
+
+
+def _parse_json(text: str) -> Optional[dict]:
+    text = (text or "").strip()
+    if text.startswith("```"):
+        text = re.sub(r"^```(?:json)?\s*", "", text, flags=re.IGNORECASE)
+        text = re.sub(r"\s*```$", "", text)
+    m = re.search(r"\{[\s\S]*\}", text)
+    if not m:
+        return None
+    try:
+        obj = json.loads(m.group(0))
+    except json.JSONDecodeError:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+
+def _as_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "yes", "1")
+    return bool(value)
+
+
+def yes_no(flag: bool) -> str:
+    """'yes' / 'no', the format the old *_check helpers returned"""
+    return "yes" if flag else "no"
+
+
+class UtteranceAnalyzer:
+    """All labels for one text in one LLM call, LRU-cached, with a local fallback"""
+
+    def __init__(self, llm_fn: Callable[[str], str], cache_size: int = CACHE_SIZE, mode: str = ANALYSIS_MODE):
+        self.llm_fn = llm_fn
+        self.cache_size = cache_size
+        self.mode = mode
+        self._cache: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._prototypes = None
+        self.stats = {"hits": 0, "llm_calls": 0, "local": 0}
+
+    def analyze(self, text: str, name: Optional[str] = None) -> Dict:
+        key = hashlib.sha1(f"{name or ''}\x00{text}".encode("utf-8")).hexdigest()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+                return cached
+
+        labels = self._llm(text, name) if self.mode != "local" else None
+        if labels is None:
+            labels = self._local(text)
+
+        # Local fallbacks after an LLM failure are not cached, so the next call retries the LLM
+        if labels["source"] == "llm" or self.mode == "local":
+            with self._lock:
+                self._cache[key] = labels
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return labels
+
+    def _llm(self, text: str, name: Optional[str]) -> Optional[Dict]:
+        who = name or "the resident"
+        prompt = ANALYSIS_PROMPT.format(
+            name=who,
+            text=text,
+            questions="\n".join(f"- {key}: {q.format(name=who)}" for key, q in LABELS.items()),
+            keys=", ".join(LABELS),
+        )
+        try:
+            self.stats["llm_calls"] += 1
+            obj = _parse_json(self.llm_fn(prompt))
+        except Exception as e:
+            logging.warning(f"Utterance analysis LLM call failed, using local classifier: {e}")
+            return None
+        if obj is None or not all(key in obj for key in LABELS):
+            logging.warning("Utterance analysis returned unusable JSON, using local classifier")
+            return None
+        labels = {key: _as_bool(obj[key]) for key in LABELS}
+        labels["source"] = "llm"
+        return labels
+
+    def _local(self, text: str) -> Dict:
+        import numpy as np
+
+        encoder = get_encoder()
+        if self._prototypes is None:
+            self._prototypes = {
+                key: (
+                    encoder.encode(pos, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False),
+                    encoder.encode(neg, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False),
+                )
+                for key, (pos, neg) in PROTOTYPES.items()
+            }
+        last_line = next((line for line in reversed(text.strip().split("\n")) if line.strip()), text)
+        utterance = last_line.split(":", 1)[1] if ":" in last_line[:20] else last_line
+        vec = encoder.encode([utterance], convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)[0]
+
+        labels = {}
+        for key, (pos, neg) in self._prototypes.items():
+            labels[key] = bool(np.max(pos @ vec) > np.max(neg @ vec))
+        if any(word in utterance.lower() for word in FIRE_KEYWORDS):
+            labels["mentions_fire"] = True
+        labels["source"] = "local"
+        self.stats["local"] += 1
+        return labels
@@ -304,12 +304,34 @@
     .then(res => res.json())
     .then(data => {
       console.log('✅ Backend preload started:', data.message);
+      if (data.state !== 'ready') {
+        pollModelReadiness(0);
+      }
     })
     .catch(err => {
       console.warn('⚠️ Preload request failed (non-critical):', err);
     });
   }
 
+  // Poll the readiness endpoint until warmup finishes (logging only, never blocks the survey)
+  function pollModelReadiness(attempt) {
+    const MAX_ATTEMPTS = 24;  // ~2 minutes at 5s intervals
+    fetch(`${CONFIG.API_URL}/api/ready`)
+    .then(res => res.json())
+    .then(status => {
+      if (status.state === 'ready') {
+        console.log(`✅ Backend models ready (${status.elapsed_s}s)`);
+      } else if (status.state === 'failed') {
+        console.warn('⚠️ Backend warmup failed (non-critical):', status.error);
+      } else if (attempt < MAX_ATTEMPTS) {
+        setTimeout(() => pollModelReadiness(attempt + 1), 5000);
+      }
+    })
+    .catch(err => {
+      console.warn('⚠️ Readiness check failed (non-critical):', err);
+    });
+  }
+
   // Wait for DOM to be ready
   document.addEventListener('DOMContentLoaded', function() {
     console.log('=== SURVEY DOM READY ===');
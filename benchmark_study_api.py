@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Throughput and tail-latency benchmark for the study API
+
+Replays full participant journeys against a running backend:
+  survey → character-selection → character-confirm → chat/start
+  → N × chat/message → post-survey → complete-study
+
+Journeys arrive as a Poisson process (--arrival-rate journeys/s) or back to back
+(--arrival-rate 0), with at most --concurrency in flight. Reports p50/p95/p99 and
+error rate per endpoint, samples the server's RSS over time (--server-pid, Linux
+/proc), and writes everything to a JSON file tagged with the git commit so runs can
+be compared across commits (--compare).
+
+For offline runs, start the backend against mock_llm_server.py:
+  python a2i2_chatbot/backend/mock_llm_server.py --port 8100 &
+  OPENAI_API_BASE=http://localhost:8100/v1 OPENAI_API_KEY=mock \\
+  HUGGINGFACE_MODEL_ID=http://localhost:8100 python a2i2_chatbot/backend/server.py &
+
+Usage:
+  python benchmark_study_api.py --journeys 50 --concurrency 10 --arrival-rate 2 --messages 5
+  python benchmark_study_api.py --server-pid $(pgrep -f server.py) --out bench_after.json \\
+      --compare bench_before.json
+"""
+
+import argparse
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import requests
+
+# Configuration
+BASE_URL = "http://localhost:8001"
+
+RESIDENT_MESSAGES = [
+    "Who is this? What's going on?",
+    "I don't think the fire is that close to my place.",
+    "I can't leave right now, I have things to take care of.",
+    "How much time do I have?",
+    "I don't have a car, how am I supposed to get out?",
+    "What about my dog?",
+    "Okay, where should I go?",
+    "Fine, I'll start packing and leave soon.",
+]
+
+SURVEY_TEMPLATE = {
+    "background": {
+        "email": "bench@example.com",
+        "nickname": "Bench",
+        "age": "67",
+        "gender": "female",
+        "education": "College graduate",
+        "occupation": "retired librarian",
+        "ideology": "4"
+    },
+    "personality": {f"q{i}": str(1 + i % 5) for i in range(1, 11)},
+    "moral": {f"q{i}": str(1 + i % 5) for i in range(1, 13)},
+    "specialNeeds": {
+        "condition": "yes",
+        "responsible": "no",
+        "vehicle": "yes",
+        "details": "I have a small dog and need help with transportation."
+    }
+}
+
+
+# ============================================================================
+# Recording
+# ============================================================================
+
+class Recorder:
+    """Thread-safe per-endpoint latency/error samples"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[dict]] = {}
+        self.journeys: List[dict] = []
+
+    def add(self, endpoint: str, latency_ms: float, status: int, ok: bool):
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append(
+                {"latency_ms": latency_ms, "status": status, "ok": ok}
+            )
+
+    def add_journey(self, result: dict):
+        with self._lock:
+            self.journeys.append(result)
+
+
+class RSSSampler(threading.Thread):
+    """Samples VmRSS of the server process from /proc every `interval` seconds"""
+    def __init__(self, pid: int, interval: float):
+        super().__init__(name="rss-sampler", daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[dict] = []
+        self._stop_event = threading.Event()
+        self._t0 = time.time()
+
+    def read_rss_mb(self) -> Optional[float]:
+        try:
+            with open(f"/proc/{self.pid}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) / 1024.0
+        except OSError:
+            return None
+        return None
+
+    def run(self):
+        while not self._stop_event.is_set():
+            rss = self.read_rss_mb()
+            if rss is not None:
+                self.samples.append({"t_s": round(time.time() - self._t0, 2), "rss_mb": round(rss, 1)})
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return round(ordered[idx], 2)
+
+
+def summarize(samples: List[dict]) -> dict:
+    latencies = [s["latency_ms"] for s in samples]
+    errors = sum(1 for s in samples if not s["ok"])
+    return {
+        "count": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else None,
+        "max_ms": round(max(latencies), 2) if latencies else None,
+    }
+
+
+# ============================================================================
+# Journey
+# ============================================================================
+
+class JourneyError(Exception):
+    pass
+
+
+def timed_call(session: requests.Session, recorder: Recorder, endpoint: str, method: str,
+               url: str, timeout: float, **kwargs) -> dict:
+    t0 = time.perf_counter()
+    status = 0
+    try:
+        response = session.request(method, url, timeout=timeout, **kwargs)
+        status = response.status_code
+        ok = response.status_code == 200
+    except requests.RequestException:
+        ok = False
+    recorder.add(endpoint, (time.perf_counter() - t0) * 1000.0, status, ok)
+    if not ok:
+        raise JourneyError(f"{endpoint} failed (status={status})")
+    return response.json()
+
+
+def run_journey(journey_id: int, args, recorder: Recorder) -> dict:
+    """One simulated participant; every step is timed under its endpoint name"""
+    rnd = random.Random(args.seed + journey_id)
+    base = args.base_url.rstrip("/")
+    t0 = time.perf_counter()
+    turns = 0
+    with requests.Session() as s:
+        try:
+            survey = dict(SURVEY_TEMPLATE, timestamp=datetime.utcnow().isoformat() + "Z")
+            participant_id = timed_call(s, recorder, "survey", "POST", f"{base}/api/survey",
+                                        args.timeout, json=survey)["participantId"]
+
+            characters = timed_call(s, recorder, "character-selection", "POST",
+                                    f"{base}/api/character-selection", args.timeout,
+                                    json={"participantId": participant_id})["characters"]
+            character = rnd.choice(characters)["key"]
+
+            timed_call(s, recorder, "character-confirm", "POST", f"{base}/api/character-confirm",
+                       args.timeout, json={"participantId": participant_id, "selectedCharacter": character})
+
+            session_id = timed_call(s, recorder, "chat/start", "POST", f"{base}/api/chat/start",
+                                    args.timeout,
+                                    json={"character": character, "participantId": participant_id})["session_id"]
+
+            for _ in range(args.messages):
+                reply = timed_call(s, recorder, "chat/message", "POST", f"{base}/api/chat/message",
+                                   args.timeout,
+                                   json={"session_id": session_id, "character": character,
+                                         "participant_id": participant_id,
+                                         "message": rnd.choice(RESIDENT_MESSAGES)})
+                turns += 1
+                if reply.get("conversation_ended"):
+                    break
+
+            timed_call(s, recorder, "post-survey", "POST", f"{base}/api/post-survey", args.timeout,
+                       json={"sessionId": session_id, "participantId": participant_id,
+                             "character": character, "conversationNumber": 1,
+                             "timestamp": datetime.utcnow().isoformat() + "Z",
+                             "willing": "yes", "naturalness": "4", "unnaturalUtterances": []})
+
+            timed_call(s, recorder, "complete-study", "POST", f"{base}/api/complete-study", args.timeout,
+                       json={"participantId": participant_id})
+            ok, error = True, None
+        except (JourneyError, KeyError, ValueError) as e:
+            ok, error = False, str(e)
+
+    result = {"journey": journey_id, "ok": ok, "error": error, "turns": turns,
+              "duration_s": round(time.perf_counter() - t0, 3)}
+    recorder.add_journey(result)
+    return result
+
+
+# ============================================================================
+# Comparison
+# ============================================================================
+
+def compare(current: dict, baseline: dict, threshold: float) -> bool:
+    """Print p50/p95/p99 deltas per endpoint; returns True if any regression exceeds threshold"""
+    print(f"\n[COMPARE] {baseline['meta'].get('git_commit', '?')[:8]} → {current['meta'].get('git_commit', '?')[:8]}")
+    print(f"{'endpoint':22s} {'metric':7s} {'baseline':>10s} {'current':>10s} {'delta':>8s}")
+    regressed = False
+    for endpoint, cur in current["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(endpoint)
+        if not base:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "error_rate"):
+            b, c = base.get(metric), cur.get(metric)
+            if b is None or c is None:
+                continue
+            delta = (c - b) / b if b else (0.0 if c == b else float("inf"))
+            flag = ""
+            if delta > threshold and metric != "error_rate":
+                flag, regressed = "  ⚠️", True
+            if metric == "error_rate" and c > b + 0.01:
+                flag, regressed = "  ⚠️", True
+            print(f"{endpoint:22s} {metric:7s} {b:10.2f} {c:10.2f} {delta:+8.1%}{flag}")
+    return regressed
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=Path(__file__).resolve().parent,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ============================================================================
+# Main
+# ============================================================================
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay participant journeys and report per-endpoint latency.")
+    ap.add_argument("--base-url", default=BASE_URL)
+    ap.add_argument("--journeys", type=int, default=20, help="Total journeys to run")
+    ap.add_argument("--concurrency", type=int, default=5, help="Max journeys in flight")
+    ap.add_argument("--arrival-rate", type=float, default=1.0,
+                    help="Poisson arrival rate in journeys/s (0 = start as fast as concurrency allows)")
+    ap.add_argument("--messages", type=int, default=5, help="Chat messages per journey")
+    ap.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    ap.add_argument("--server-pid", type=int, default=None, help="Backend PID for RSS sampling (Linux)")
+    ap.add_argument("--rss-interval", type=float, default=1.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--label", default="", help="Free-form label stored with the results")
+    ap.add_argument("--out", type=Path, default=None, help="Results JSON (default: benchmark_results/<timestamp>.json)")
+    ap.add_argument("--compare", type=Path, default=None, help="Baseline results JSON to compare against")
+    ap.add_argument("--regression-threshold", type=float, default=0.10,
+                    help="Relative latency increase that counts as a regression (default 10%%)")
+    args = ap.parse_args()
+
+    recorder = Recorder()
+    sampler = RSSSampler(args.server_pid, args.rss_interval) if args.server_pid else None
+    if sampler:
+        sampler.start()
+
+    print(f"[BENCH] {args.journeys} journeys × {args.messages} messages against {args.base_url} "
+          f"(concurrency={args.concurrency}, arrival_rate={args.arrival_rate}/s)")
+
+    arrivals = random.Random(args.seed)
+    t_start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+        futures = []
+        for j in range(args.journeys):
+            futures.append(pool.submit(run_journey, j, args, recorder))
+            if args.arrival_rate > 0 and j < args.journeys - 1:
+                time.sleep(arrivals.expovariate(args.arrival_rate))
+        for i, fut in enumerate(futures, start=1):
+            result = fut.result()
+            status = "✅" if result["ok"] else f"❌ {result['error']}"
+            print(f"[BENCH] Journey {result['journey']:4d} {result['duration_s']:7.2f}s turns={result['turns']} {status}")
+    wall_s = time.time() - t_start
+
+    if sampler:
+        sampler.stop()
+        sampler.join(timeout=2)
+
+    journey_durations = [j["duration_s"] * 1000.0 for j in recorder.journeys if j["ok"]]
+    completed = sum(1 for j in recorder.journeys if j["ok"])
+    total_requests = sum(len(v) for v in recorder.samples.values())
+    results = {
+        "meta": {
+            "git_commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "label": args.label,
+            "base_url": args.base_url,
+            "journeys": args.journeys,
+            "concurrency": args.concurrency,
+            "arrival_rate": args.arrival_rate,
+            "messages": args.messages,
+            "seed": args.seed,
+        },
+        "summary": {
+            "wall_s": round(wall_s, 2),
+            "journeys_completed": completed,
+            "journeys_failed": len(recorder.journeys) - completed,
+            "journeys_per_min": round(completed / wall_s * 60, 2) if wall_s > 0 else None,
+            "requests_per_s": round(total_requests / wall_s, 2) if wall_s > 0 else None,
+            "journey_p50_s": (percentile(journey_durations, 50) or 0) / 1000.0,
+            "journey_p95_s": (percentile(journey_durations, 95) or 0) / 1000.0,
+        },
+        "endpoints": {ep: summarize(samples) for ep, samples in recorder.samples.items()},
+        "rss": {
+            "samples": sampler.samples if sampler else [],
+            "peak_mb": max((s["rss_mb"] for s in sampler.samples), default=None) if sampler else None,
+        },
+    }
+
+    print("\n" + "=" * 78)
+    print(f"{'endpoint':22s} {'count':>6s} {'err%':>6s} {'p50':>9s} {'p95':>9s} {'p99':>9s}")
+    for ep, st in results["endpoints"].items():
+        print(f"{ep:22s} {st['count']:6d} {st['error_rate'] * 100:6.1f} "
+              f"{st['p50_ms'] or 0:9.1f} {st['p95_ms'] or 0:9.1f} {st['p99_ms'] or 0:9.1f}")
+    print("=" * 78)
+    print(f"[BENCH] {json.dumps(results['summary'])}")
+    if results["rss"]["peak_mb"] is not None:
+        print(f"[BENCH] Server peak RSS: {results['rss']['peak_mb']} MB")
+
+    out = args.out or Path("benchmark_results") / f"{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=2))
+    print(f"[BENCH] Results written to {out}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        if compare(results, baseline, args.regression_threshold):
+            print("[BENCH] Regression detected")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
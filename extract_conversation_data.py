@@ -1,148 +1,336 @@
 #!/usr/bin/env python3
 """
-Extract conversation data from Terminal 7 logs and save to structured JSON
+Rebuild structured conversation data from backend logs
+
+Streams one or more log files line by line (never loading a whole file) and
+reconstructs every session: character, participant, each turn's resident
+message, selected policy, Q-values, judge result, stage timings and operator
+response, plus how the conversation ended.
+
+Understands three inputs, mixed freely:
+  • turn log segments written by the backend (turn_log.py: session_start / turn / session_end)
+  • structured JSON log lines from stdout (structured_logging.py: turn_start, q_values,
+    turn_complete, conversation_started, conversation_ended)
+  • legacy plain-text terminal logs ("[IQL-HF] Q-values: {...}"), parsed with
+    ast.literal_eval instead of eval()
+
+Files are parsed in parallel (one worker process per file). Each worker spills
+its events to per-file shard files keyed by session id; shards are then reduced
+one at a time, merging fragments in input order, so records for the same
+(session, turn) from different sources are combined while memory stays
+proportional to the sessions of one shard, not the whole log set. Sessions are
+written shard by shard (first-seen order within a shard).
+
+Usage:
+  python extract_conversation_data.py turn_logs/
+  python extract_conversation_data.py server_stdout.log backend_logs_*.txt --workers 4
+  python extract_conversation_data.py turn_logs/ --format jsonl --output sessions.jsonl
+  python extract_conversation_data.py big_logs/ --shards 256   # more shards = less memory per shard
 """
 
-import re
+import argparse
+import ast
 import json
-from datetime import datetime
+import os
+import re
+import sys
+import tempfile
+import zlib
+from datetime import datetime, timezone
+from multiprocessing import Pool
 from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
-TERMINAL_FILE = Path("/Users/tzhang/.cursor/projects/Users-tzhang-projects-a2i2-survey/terminals/7.txt")
 OUTPUT_DIR = Path("conversation_data_exports")
+DEFAULT_SHARDS = 64
+
+# Legacy plain-text log lines
+RE_SESSION_START = re.compile(r"\[CHAT\] Started role-play session: ([^\s]+) for character: (\w+)")
+RE_TURN = re.compile(r"\[CHAT\] Session:.*Turn: (\d+), Resident: (.+)")
+RE_POLICY = re.compile(r"\[IQL-HF\] Selected policy: (\w+)")
+RE_QVALUES = re.compile(r"\[IQL-HF\] Q-values: (\{.+\})")
+RE_OPERATOR = re.compile(r"\[CHAT\] Operator: (.+)")
+
+
+# ============================================================================
+# Streaming parsers (each yields normalized events)
+# ============================================================================
+
+def iter_lines(path: Path) -> Iterator[str]:
+    """Stream a file line by line; undecodable bytes are replaced, not fatal"""
+    with path.open("r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            yield line.rstrip("\n")
+
+
+def events_from_record(rec: dict) -> Iterator[dict]:
+    """Map a turn-log or structured-log record to normalized session events"""
+    event = rec.get("event")
+    sid = rec.get("session_id")
+    if not sid:
+        return
+    if event in ("session_start", "conversation_started"):
+        yield {"kind": "start", "session_id": sid, "character": rec.get("character"),
+               "participant_id": rec.get("participant_id"), "greeting": rec.get("greeting"),
+               "ts": rec.get("ts")}
+    elif event == "turn":
+        yield {"kind": "turn", "session_id": sid, "turn": rec.get("turn"),
+               "resident_message": rec.get("resident_message"),
+               "policy": rec.get("selected_policy"), "q_values": rec.get("q_values"),
+               "operator_response": rec.get("operator_response"), "judge": rec.get("judge"),
+               "timings_ms": rec.get("timings_ms"), "timestamp": rec.get("timestamp"),
+               "character": rec.get("character"), "participant_id": rec.get("participant_id")}
+    elif event == "turn_start":
+        yield {"kind": "turn", "session_id": sid, "turn": rec.get("turn"),
+               "resident_message": rec.get("resident_message"), "character": rec.get("character")}
+    elif event == "q_values":
+        yield {"kind": "turn", "session_id": sid, "turn": rec.get("turn"),
+               "policy": rec.get("policy") or rec.get("selected_policy"), "q_values": rec.get("q_values")}
+    elif event == "turn_complete":
+        judge = {"stance": rec["stance"], "confidence": rec.get("confidence")} if rec.get("stance") else None
+        yield {"kind": "turn", "session_id": sid, "turn": rec.get("turn"), "policy": rec.get("policy"),
+               "operator_response": rec.get("operator_response"), "judge": judge,
+               "timings_ms": rec.get("timings_ms")}
+    elif event in ("session_end", "conversation_ended"):
+        if rec.get("resident_message") is not None:  # the message that ended the conversation
+            yield {"kind": "turn", "session_id": sid, "turn": rec.get("turn"),
+                   "resident_message": rec.get("resident_message"), "judge": rec.get("judge")}
+        yield {"kind": "end", "session_id": sid, "turn": rec.get("turn"),
+               "end_reason": rec.get("end_reason"), "closing": rec.get("closing")}
+
+
+def iter_file_events(path: Path) -> Iterator[dict]:
+    """Normalized events from one file, whatever mix of JSON and legacy text it holds"""
+    legacy_session: Optional[str] = None
+    legacy_turn: Optional[int] = None
+    for line in iter_lines(path):
+        stripped = line.strip()
+        if not stripped:
+            continue
+
+        if stripped.startswith("{"):
+            try:
+                rec = json.loads(stripped)
+            except json.JSONDecodeError:
+                continue  # torn line or non-JSON braces
+            if isinstance(rec, dict):
+                yield from events_from_record(rec)
+            continue
+
+        # ---- legacy plain-text lines ----
+        m = RE_SESSION_START.search(line)
+        if m:
+            legacy_session, legacy_turn = m.group(1), None
+            yield {"kind": "start", "session_id": legacy_session, "character": m.group(2)}
+            continue
+        if legacy_session is None:
+            continue
+        m = RE_TURN.search(line)
+        if m:
+            legacy_turn = int(m.group(1))
+            yield {"kind": "turn", "session_id": legacy_session, "turn": legacy_turn,
+                   "resident_message": m.group(2).strip()}
+            continue
+        if legacy_turn is None:
+            continue
+        m = RE_POLICY.search(line)
+        if m:
+            yield {"kind": "turn", "session_id": legacy_session, "turn": legacy_turn, "policy": m.group(1)}
+            continue
+        m = RE_QVALUES.search(line)
+        if m:
+            try:
+                q_vals = ast.literal_eval(m.group(1))  # literals only, never executes code
+            except (ValueError, SyntaxError):
+                continue
+            if isinstance(q_vals, dict):
+                yield {"kind": "turn", "session_id": legacy_session, "turn": legacy_turn,
+                       "q_values": {k: float(v) for k, v in q_vals.items()}}
+            continue
+        m = RE_OPERATOR.search(line)
+        if m:
+            yield {"kind": "turn", "session_id": legacy_session, "turn": legacy_turn,
+                   "operator_response": m.group(1).strip()}
+
+
+# ============================================================================
+# Session reconstruction
+# ============================================================================
+
+def _new_session(session_id: str) -> dict:
+    return {"session_id": session_id, "character": None, "participant_id": None, "greeting": None,
+            "created_at": None, "end_reason": None, "closing": None, "turns": {}}
+
+
+def apply_event(sessions: Dict[str, dict], ev: dict):
+    """Fold one event into the session table; later non-empty fields win"""
+    session = sessions.setdefault(ev["session_id"], _new_session(ev["session_id"]))
+    for key in ("character", "participant_id"):
+        if ev.get(key) and not session[key]:
+            session[key] = ev[key]
+
+    if ev["kind"] == "start":
+        session["greeting"] = ev.get("greeting") or session["greeting"]
+        if ev.get("ts") and not session["created_at"]:
+            ts = ev["ts"]  # epoch seconds in the turn log, ISO string in stdout logs
+            session["created_at"] = datetime.fromtimestamp(ts, timezone.utc).isoformat() if isinstance(ts, (int, float)) else ts
+    elif ev["kind"] == "end":
+        session["end_reason"] = ev.get("end_reason") or session["end_reason"]
+        session["closing"] = ev.get("closing") or session["closing"]
+    elif ev["kind"] == "turn" and ev.get("turn") is not None:
+        turn = session["turns"].setdefault(int(ev["turn"]), {
+            "turn": int(ev["turn"]), "resident_message": None, "policy": None, "q_values": None,
+            "operator_response": None, "judge": None, "timings_ms": None, "timestamp": None,
+        })
+        for key in ("resident_message", "policy", "q_values", "operator_response", "judge",
+                    "timings_ms", "timestamp"):
+            if ev.get(key) is not None:
+                turn[key] = ev[key]
+
+
+def shard_of(session_id: str, shards: int) -> int:
+    # crc32 rather than hash(): worker processes must agree on the shard
+    return zlib.crc32(session_id.encode("utf-8")) % shards
+
+
+def _shard_path(shard_dir: str, file_index: int, shard: int) -> str:
+    return os.path.join(shard_dir, f"{file_index:05d}-{shard:04d}.jsonl")
+
+
+def shard_file(job: Tuple[int, str, str, int]) -> Set[int]:
+    """Worker: stream one file's events into per-session-shard spill files; returns the shards written"""
+    file_index, path, shard_dir, shards = job
+    handles = {}
+    try:
+        for ev in iter_file_events(Path(path)):
+            shard = shard_of(ev["session_id"], shards)
+            f = handles.get(shard)
+            if f is None:
+                f = handles[shard] = open(_shard_path(shard_dir, file_index, shard), "w", encoding="utf-8")
+            f.write(json.dumps(ev, ensure_ascii=False) + "\n")
+    finally:
+        for f in handles.values():
+            f.close()
+    return set(handles)
+
+
+def parse_events(path: str) -> Dict[str, dict]:
+    """Fold one spill file into session fragments"""
+    sessions: Dict[str, dict] = {}
+    for line in iter_lines(Path(path)):
+        apply_event(sessions, json.loads(line))
+    return sessions
+
+
+def merge_sessions(into: Dict[str, dict], fragment: Dict[str, dict]):
+    for sid, frag in fragment.items():
+        if sid not in into:
+            into[sid] = frag
+            continue
+        target = into[sid]
+        for key in ("character", "participant_id", "greeting", "created_at", "end_reason", "closing"):
+            if frag[key]:
+                target[key] = frag[key]
+        for n, turn in frag["turns"].items():
+            merged = target["turns"].setdefault(n, turn)
+            if merged is not turn:
+                for key, value in turn.items():
+                    if value is not None:
+                        merged[key] = value
+
+
+def finalize(session: dict) -> dict:
+    out = dict(session)
+    out["turns"] = [session["turns"][n] for n in sorted(session["turns"])]
+    return out
+
+
+def expand_inputs(inputs: Iterable[str]) -> List[str]:
+    """Files as given; directories expand to their *.jsonl / *.log / *.txt files in name order"""
+    files = []
+    for raw in inputs:
+        p = Path(raw)
+        if p.is_dir():
+            files.extend(str(f) for f in sorted(p.iterdir())
+                         if f.is_file() and f.suffix in (".jsonl", ".log", ".txt"))
+        elif p.exists():
+            files.append(str(p))
+        else:
+            print(f"⚠️  Skipping missing input: {raw}")
+    return files
+
+
+def extract(inputs: Iterable[str], workers: int = 1, shards: int = DEFAULT_SHARDS) -> Iterator[dict]:
+    """
+    Parse all inputs (in parallel) and yield reconstructed sessions shard by shard.
+    Only one shard's sessions are held in memory at a time.
+    """
+    files = expand_inputs(inputs)
+    with tempfile.TemporaryDirectory(prefix="extract_sessions_") as shard_dir:
+        jobs = [(i, path, shard_dir, shards) for i, path in enumerate(files)]
+        if workers > 1 and len(files) > 1:
+            with Pool(processes=min(workers, len(files))) as pool:
+                written = pool.map(shard_file, jobs)
+        else:
+            written = [shard_file(job) for job in jobs]
+
+        for shard in range(shards):
+            sessions: Dict[str, dict] = {}
+            for file_index, shards_written in enumerate(written):  # input order, as before
+                if shard in shards_written:
+                    merge_sessions(sessions, parse_events(_shard_path(shard_dir, file_index, shard)))
+            for session in sessions.values():
+                yield finalize(session)
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def main():
+    ap = argparse.ArgumentParser(description="Rebuild conversation sessions from backend logs.")
+    ap.add_argument("inputs", nargs="+", help="Log files or directories (turn_logs/, stdout logs, terminal logs)")
+    ap.add_argument("--workers", type=int, default=1, help="Parallel worker processes (one file each)")
+    ap.add_argument("--shards", type=int, default=DEFAULT_SHARDS,
+                    help="Session shards reduced one at a time (more shards = lower peak memory)")
+    ap.add_argument("--format", choices=["json", "jsonl"], default="json",
+                    help="json: one export document (same shape as before); jsonl: one session per line")
+    ap.add_argument("--output", type=Path, default=None, help="Output file (default: conversation_data_exports/)")
+    args = ap.parse_args()
 
-def parse_terminal_logs():
-    """Parse Terminal 7 logs and extract structured conversation data"""
-    
-    if not TERMINAL_FILE.exists():
-        print(f"❌ Terminal file not found: {TERMINAL_FILE}")
-        return None
-    
-    content = TERMINAL_FILE.read_text()
-    lines = content.split('\n')
-    
-    conversations = []
-    current_session = None
-    
-    for line in lines:
-        # New session started
-        if "[CHAT] Started role-play session:" in line:
-            match = re.search(r"session: ([^\s]+) for character: (\w+)", line)
-            if match:
-                if current_session:
-                    conversations.append(current_session)
-                current_session = {
-                    "session_id": match.group(1),
-                    "character": match.group(2),
-                    "turns": [],
-                    "created_at": None
-                }
-        
-        # Turn with resident message
-        elif "[CHAT] Session:" in line and "Resident:" in line:
-            match = re.search(r"Turn: (\d+), Resident: (.+)", line)
-            if match and current_session:
-                turn_data = {
-                    "turn": int(match.group(1)),
-                    "resident_message": match.group(2).strip(),
-                    "policy": None,
-                    "q_values": None,
-                    "operator_response": None
-                }
-                current_session["turns"].append(turn_data)
-        
-        # Policy selected
-        elif "[IQL-HF] Selected policy:" in line:
-            match = re.search(r"Selected policy: (\w+)", line)
-            if match and current_session and current_session["turns"]:
-                current_session["turns"][-1]["policy"] = match.group(1)
-        
-        # Q-values
-        elif "[IQL-HF] Q-values:" in line:
-            match = re.search(r"Q-values: ({.+})", line)
-            if match and current_session and current_session["turns"]:
-                try:
-                    q_vals = eval(match.group(1))  # Safe here since it's from our own logs
-                    current_session["turns"][-1]["q_values"] = q_vals
-                except:
-                    pass
-        
-        # Operator response
-        elif "[CHAT] Operator:" in line:
-            match = re.search(r"Operator: (.+)", line)
-            if match and current_session and current_session["turns"]:
-                current_session["turns"][-1]["operator_response"] = match.group(1).strip()
-    
-    # Add last session
-    if current_session:
-        conversations.append(current_session)
-    
-    return conversations
-
-
-def save_conversation_data():
-    """Save extracted conversation data to JSON file"""
-    
     print("=" * 80)
     print("CONVERSATION DATA EXTRACTOR")
     print("=" * 80)
-    print()
-    
-    conversations = parse_terminal_logs()
-    
-    if not conversations:
-        print("❌ No conversation data found in Terminal 7 logs")
-        print()
-        print("Make sure:")
-        print("  1. Backend server is running")
-        print("  2. You've had at least one conversation")
-        print("  3. Terminal 7 contains the backend logs")
-        return
-    
-    # Create output directory
-    OUTPUT_DIR.mkdir(exist_ok=True)
-    
-    # Prepare export data
-    export_data = {
-        "export_timestamp": datetime.utcnow().isoformat(),
-        "total_conversations": len(conversations),
-        "conversations": conversations
-    }
-    
-    # Save to file
+
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_file = OUTPUT_DIR / f"conversations_{timestamp}.json"
-    
-    with open(output_file, 'w') as f:
-        json.dump(export_data, f, indent=2)
-    
-    print(f"✅ Extracted {len(conversations)} conversation(s)")
+    output_file = args.output or OUTPUT_DIR / f"conversations_{timestamp}.{args.format}"
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+
+    count = 0
+    sessions = extract(args.inputs, args.workers, max(1, args.shards))
+    with open(output_file, "w", encoding="utf-8") as f:
+        if args.format == "jsonl":
+            for session in sessions:
+                f.write(json.dumps(session, ensure_ascii=False) + "\n")
+                count += 1
+        else:
+            # Same document as before, written incrementally; total_conversations
+            # comes last because it is only known once every shard is reduced
+            f.write('{\n  "export_timestamp": %s,\n  "conversations": [' % json.dumps(datetime.utcnow().isoformat()))
+            for session in sessions:
+                body = json.dumps(session, indent=2, ensure_ascii=False).replace("\n", "\n    ")
+                f.write(("," if count else "") + "\n    " + body)
+                count += 1
+            f.write(("\n  " if count else "") + '],\n  "total_conversations": %d\n}\n' % count)
+
+    if not count:
+        print("❌ No conversation data found in the given logs")
+        sys.exit(1)
+
+    print(f"✅ Extracted {count} conversation(s)")
     print(f"📁 Saved to: {output_file}")
-    print()
-    
-    # Print summary
-    print("📊 Summary:")
-    print("-" * 80)
-    for i, conv in enumerate(conversations, 1):
-        char = conv.get('character', 'unknown')
-        turns = len(conv.get('turns', []))
-        print(f"  {i}. Character: {char:10} | Turns: {turns}")
-        
-        # Show policy selections
-        policies = [t.get('policy') for t in conv.get('turns', []) if t.get('policy')]
-        if policies:
-            policy_str = ', '.join(policies)
-            print(f"     Policies: {policy_str}")
-    
-    print()
-    print("=" * 80)
-    print("✅ Export complete!")
     print("=" * 80)
-    print()
-    
-    return output_file
 
 
 if __name__ == "__main__":
-    save_conversation_data()
-
+    main()
@@ -5,7 +5,7 @@ Deploy this to HF Space to serve your custom IQL model
 Upload to: https://huggingface.co/spaces/tzhang62/iql-fire-rescue-api
 """
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from typing import Dict, List, Optional
 import torch
@@ -14,7 +14,12 @@ import torch.nn.functional as F
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, deque
+import asyncio
 import json
+import os
+import time
 
 app = FastAPI(title="IQL Fire Rescue API")
 
@@ -22,6 +27,29 @@ app = FastAPI(title="IQL Fire Rescue API")
 EMBED_MODEL = "all-MiniLM-L6-v2"
 N_LAST = 3
 
+# Inference runtime: "int8" serves dynamic int8-quantized Linear layers (encoder + Q-network),
+# "fp32" serves the original weights. Validate int8 with verify_quantization.py before deploying.
+IQL_RUNTIME = os.getenv("IQL_RUNTIME", "int8").lower()
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", "0"))  # 0 = torch default
+
+# Micro-batching: concurrent predict/embed requests are collected for up to
+# BATCH_MAX_WAIT_MS (or BATCH_MAX_SIZE requests) and served by one batched encode + Q pass
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "32"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+# Texts per encoder forward pass; a coalesced batch is encoded in chunks of this size,
+# so peak memory does not grow with request size
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", "64"))
+
+# /embed limits: texts per request and characters per text
+EMBED_MAX_TEXTS = int(os.getenv("EMBED_MAX_TEXTS", "256"))
+EMBED_MAX_CHARS = int(os.getenv("EMBED_MAX_CHARS", "4000"))
+
+# /predict_batch limits: states per request and characters per text state
+PREDICT_BATCH_MAX_ITEMS = int(os.getenv("PREDICT_BATCH_MAX_ITEMS", "1024"))
+PREDICT_BATCH_MAX_CHARS = int(os.getenv("PREDICT_BATCH_MAX_CHARS", "4000"))
+# States per worker job; live `/` batches run between the chunks of a large request
+PREDICT_BATCH_SIZE = max(1, int(os.getenv("PREDICT_BATCH_SIZE", "64")))
+
 # ============================================================================
 # IQL Model (same as your server.py)
 # ============================================================================
@@ -48,13 +76,26 @@ class QNetworkEmbed(nn.Module):
 def embed_state(model, texts):
     if not texts:
         return np.zeros((model.get_sentence_embedding_dimension(),), dtype=np.float32)
-    embs = model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+    embs = model.encode(texts, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)
     return np.mean(embs, axis=0).astype(np.float32)
 
+def normalize_rows(x: np.ndarray) -> np.ndarray:
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+def quantize_int8(module):
+    """Dynamic int8 quantization of every nn.Linear (weights int8, activations quantized on the fly)"""
+    return torch.quantization.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
 class IQLSelector:
-    def __init__(self, pt_path, policy_names):
+    def __init__(self, pt_path, policy_names, runtime=IQL_RUNTIME, load_encoder=True):
+        """load_encoder=False skips MiniLM for callers that only score precomputed state vectors"""
+        if runtime not in ("int8", "fp32"):
+            raise ValueError(f"Unknown IQL_RUNTIME: {runtime} (expected 'int8' or 'fp32')")
         self.device = torch.device("cpu")
-        self.embed_model = SentenceTransformer(EMBED_MODEL)
+        self.runtime = runtime
+        self.embed_model = SentenceTransformer(EMBED_MODEL, device="cpu") if load_encoder else None
+        if self.embed_model is not None:
+            self.embed_model.eval()
         state_dict = torch.load(pt_path, map_location="cpu")
         
         ae_key = next((k for k in state_dict.keys() if k.endswith("action_embeds")), None)
@@ -72,38 +113,234 @@ class IQLSelector:
         self.qnet.load_state_dict(state_dict, strict=True)
         self.qnet.eval()
         self.policy_names = policy_names
-        print(f"[IQL] Loaded: {num_actions} policies, state_dim={state_dim}")
+        self.state_dim = state_dim
+        self.action_ids = torch.arange(num_actions, dtype=torch.long, device=self.device)
+        # Dynamic int8 computes activation scales from the whole input of each forward call,
+        # so co-batched requests would shift each other's outputs; serve them one at a time
+        self.batch_invariant = runtime == "int8"
+
+        if runtime == "int8":
+            if self.embed_model is not None:
+                quantize_int8(self.embed_model)
+            quantize_int8(self.qnet)
+        print(f"[IQL] Loaded: {num_actions} policies, state_dim={state_dim}, runtime={runtime}")
+
+    def q_matrix(self, states: np.ndarray) -> np.ndarray:
+        """Q-values for a batch of state vectors in one forward pass: (B, state_dim) -> (B, num_actions)"""
+        num_actions = len(self.policy_names)
+        s = torch.as_tensor(states, dtype=torch.float32, device=self.device)
+        s = s.repeat_interleave(num_actions, dim=0)
+        a = self.action_ids.repeat(len(states))
+        with torch.inference_mode():
+            q = self.qnet(s, a)
+        return q.view(len(states), num_actions).cpu().numpy()
+
+    def q_rows(self, states: np.ndarray) -> np.ndarray:
+        """q_matrix() whose rows do not depend on the other states (one forward per state when batch_invariant)"""
+        if not self.batch_invariant or len(states) <= 1:
+            return self.q_matrix(states)
+        return np.concatenate([self.q_matrix(states[i:i + 1]) for i in range(len(states))])
+
+    def encode_groups(self, groups) -> List[np.ndarray]:
+        """
+        Raw (unnormalized) embeddings per group of texts. One encode for all groups, or
+        one per group when batch_invariant, so a group gets the embeddings it would get alone.
+        """
+        dim = self.embed_model.get_sentence_embedding_dimension()
+
+        def encode(texts):
+            if not texts:
+                return np.zeros((0, dim), dtype=np.float32)
+            return self.embed_model.encode(
+                texts, convert_to_numpy=True, normalize_embeddings=False, show_progress_bar=False,
+                batch_size=ENCODE_BATCH_SIZE,
+            ).astype(np.float32)
+
+        if self.batch_invariant:
+            return [encode(list(texts)) for texts in groups]
+        flat = encode([t for texts in groups for t in texts])
+        out, pos = [], 0
+        for texts in groups:
+            out.append(flat[pos:pos + len(texts)])
+            pos += len(texts)
+        return out
+
+    def states_from_texts(self, message_lists) -> np.ndarray:
+        """Each state is the mean normalized embedding of its messages (same as `/`)"""
+        dim = self.embed_model.get_sentence_embedding_dimension()
+        states = np.zeros((len(message_lists), dim), dtype=np.float32)
+        for i, raw in enumerate(self.encode_groups(message_lists)):
+            if len(raw):
+                states[i] = normalize_rows(raw).mean(axis=0)
+        return states
+
+    def predict_states(self, states: np.ndarray):
+        """[(policy, q_values)] for a batch of state vectors"""
+        q = self.q_rows(states)
+        return [
+            (self.policy_names[int(np.argmax(row))], dict(zip(self.policy_names, row.tolist())))
+            for row in q
+        ]
 
     def select_policy(self, history, n_last=N_LAST):
         texts = [h["text"] for h in history if h.get("role") == "resident"]
         last_n = texts[-n_last:] if texts else []
         s_vec = embed_state(self.embed_model, last_n)
-        s = torch.tensor(s_vec, dtype=torch.float32, device=self.device).unsqueeze(0)
-
-        q_vals = []
-        with torch.no_grad():
-            for a_id in range(len(self.policy_names)):
-                a = torch.tensor([a_id], dtype=torch.long, device=self.device)
-                q_vals.append(float(self.qnet(s, a).item()))
 
+        q_vals = self.q_matrix(s_vec[None, :])[0].tolist()
         best_idx = int(np.argmax(q_vals))
         return self.policy_names[best_idx], dict(zip(self.policy_names, q_vals))
 
+# ============================================================================
+# Micro-batching
+# ============================================================================
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return round(ordered[idx], 3)
+
+class BatchMetrics:
+    """Batch size distribution plus recent queue-wait / compute latencies (ms)"""
+    def __init__(self, window=2000):
+        self.batches = 0
+        self.requests = 0
+        self.errors = 0
+        self.batch_sizes = Counter()
+        self.queue_wait_ms = deque(maxlen=window)
+        self.compute_ms = deque(maxlen=window)
+
+    def record(self, batch_size, queue_waits_ms, compute_ms, failed=False):
+        self.batches += 1
+        self.requests += batch_size
+        self.errors += int(failed)
+        self.batch_sizes[batch_size] += 1
+        self.queue_wait_ms.extend(queue_waits_ms)
+        self.compute_ms.append(compute_ms)
+
+    def snapshot(self):
+        waits = list(self.queue_wait_ms)
+        compute = list(self.compute_ms)
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "errors": self.errors,
+            "mean_batch_size": round(self.requests / self.batches, 3) if self.batches else None,
+            "batch_size_counts": {str(k): v for k, v in sorted(self.batch_sizes.items())},
+            "queue_wait_ms": {"p50": _percentile(waits, 50), "p95": _percentile(waits, 95), "p99": _percentile(waits, 99)},
+            "compute_ms": {"p50": _percentile(compute, 50), "p95": _percentile(compute, 95), "p99": _percentile(compute, 99)},
+        }
+
+class MicroBatcher:
+    """
+    Collects predict/embed requests from the event loop and serves each batch
+    with one encode call and one Q-network forward on a dedicated worker thread,
+    so the event loop never blocks on model inference. With the int8 runtime each
+    request is encoded and scored on its own (still one worker dispatch per batch),
+    so its result does not depend on the traffic it was batched with.
+    """
+    def __init__(self, selector, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        self.selector = selector
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000.0
+        self.queue = asyncio.Queue()
+        # One worker: torch already parallelizes inside a batch, and this keeps the models single-threaded
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="iql-batch")
+        self.metrics = BatchMetrics()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, kind, texts, normalize=True):
+        """kind is "predict" (texts = last resident messages) or "embed"; resolves to that request's result"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((kind, list(texts), normalize, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            dispatched = time.perf_counter()
+            waits = [(dispatched - item[4]) * 1000.0 for item in batch]
+            failed = False
+            try:
+                results = await loop.run_in_executor(self.executor, self._process, batch)
+                for item, result in zip(batch, results):
+                    if not item[3].done():
+                        item[3].set_result(result)
+            except Exception as e:
+                failed = True
+                print(f"[BATCH] Batch of {len(batch)} failed: {e}")
+                for item in batch:
+                    if not item[3].done():
+                        item[3].set_exception(e)
+            self.metrics.record(len(batch), waits, (time.perf_counter() - dispatched) * 1000.0, failed)
+
+    def _process(self, batch):
+        """
+        Runs on the worker thread: one encode for every text in the batch, one Q forward for
+        every predict (per request instead in int8 mode, see IQLSelector.batch_invariant)
+        """
+        selector = self.selector
+        dim = selector.embed_model.get_sentence_embedding_dimension()
+        encoded = selector.encode_groups([texts for _, texts, _, _, _ in batch])
+
+        results = [None] * len(batch)
+        predict_idx, states = [], []
+        for i, ((kind, _, normalize, _, _), raw) in enumerate(zip(batch, encoded)):
+            normed = normalize_rows(raw)
+            if kind == "predict":
+                # Same state as embed_state(): mean of the normalized resident embeddings
+                states.append(normed.mean(axis=0) if len(normed) else np.zeros(dim, dtype=np.float32))
+                predict_idx.append(i)
+            else:
+                results[i] = normed if normalize else raw
+
+        if predict_idx:
+            q = selector.q_rows(np.stack(states).astype(np.float32))
+            for row, i in enumerate(predict_idx):
+                q_vals = q[row].tolist()
+                best = int(np.argmax(q_vals))
+                results[i] = (selector.policy_names[best], dict(zip(selector.policy_names, q_vals)))
+        return results
+
 # ============================================================================
 # Global Model
 # ============================================================================
 
 iql_selector = None
+batcher = None
 
 @app.on_event("startup")
 async def load_model():
-    global iql_selector
+    global iql_selector, batcher
+    if TORCH_THREADS > 0:
+        torch.set_num_threads(TORCH_THREADS)
     try:
         base = Path(__file__).parent
         label_map = json.loads((base / "label_map.json").read_text())
         policies = [k for k, _ in sorted(label_map.items(), key=lambda x: x[1])]
         iql_selector = IQLSelector(base / "iql_model_embed.pt", policies)
-        print("[Space] Model loaded!")
+        batcher = MicroBatcher(iql_selector)
+        batcher.start()
+        print(f"[Space] Model loaded! (batching: max_size={BATCH_MAX_SIZE}, max_wait={BATCH_MAX_WAIT_MS}ms)")
     except Exception as e:
         print(f"[Space] Load failed: {e}")
         import traceback
@@ -121,22 +358,101 @@ class Response(BaseModel):
     policy: str
     q_values: Dict[str, float]
 
+def parse_state_text(inputs: Optional[str]) -> List[str]:
+    """State string "msg1 | msg2 | msg3" -> last N_LAST messages ("START" / empty -> no messages)"""
+    if inputs == "START" or not inputs:
+        return []
+    return [m.strip() for m in inputs.split("|")][-N_LAST:]
+
 @app.post("/", response_model=Response)
 async def predict(req: Request):
-    # Parse state: "msg1 | msg2 | msg3"
-    if req.inputs == "START" or not req.inputs:
-        messages = []
-    else:
-        messages = [m.strip() for m in req.inputs.split("|")]
+    if not iql_selector:
+        # 503 tells clients (iql_hf_api) the model is still loading and to retry
+        raise HTTPException(status_code=503, detail="Model loading")
     
-    history = [{"role": "resident", "text": m} for m in messages]
-    policy, q_vals = iql_selector.select_policy(history, n_last=N_LAST)
+    policy, q_vals = await batcher.submit("predict", parse_state_text(req.inputs))
     
     return {"policy": policy, "q_values": q_vals}
 
+class BatchRequest(BaseModel):
+    inputs: Optional[List[str]] = None          # state strings, same format as `/` inputs
+    states: Optional[List[List[float]]] = None  # or precomputed state vectors (state_dim each)
+
+class BatchResponse(BaseModel):
+    results: List[Response]
+    count: int
+    compute_ms: float
+
+@app.post("/predict_batch", response_model=BatchResponse)
+async def predict_batch(req: BatchRequest):
+    """
+    Many states in one request, scored in chunks of PREDICT_BATCH_SIZE states (one
+    encode + one Q forward per chunk). Bounded by PREDICT_BATCH_MAX_ITEMS per request.
+    """
+    if not iql_selector:
+        raise HTTPException(status_code=503, detail="Model loading")
+    if (req.inputs is None) == (req.states is None):
+        raise HTTPException(status_code=422, detail="Provide exactly one of 'inputs' or 'states'")
+    
+    items = req.inputs if req.inputs is not None else req.states
+    if len(items) > PREDICT_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"{len(items)} states exceeds PREDICT_BATCH_MAX_ITEMS={PREDICT_BATCH_MAX_ITEMS}",
+        )
+    if not items:
+        return {"results": [], "count": 0, "compute_ms": 0.0}
+    
+    if req.inputs is not None:
+        too_long = next((i for i, t in enumerate(req.inputs) if len(t) > PREDICT_BATCH_MAX_CHARS), None)
+        if too_long is not None:
+            raise HTTPException(status_code=413, detail=f"inputs[{too_long}] exceeds {PREDICT_BATCH_MAX_CHARS} chars")
+        message_lists = [parse_state_text(t) for t in req.inputs]
+        work = lambda chunk: iql_selector.predict_states(iql_selector.states_from_texts(chunk))
+        items = message_lists
+    else:
+        # Check every row before converting: ragged rows would make np.asarray raise (a 500)
+        bad = next((i for i, row in enumerate(req.states) if len(row) != iql_selector.state_dim), None)
+        if bad is not None:
+            raise HTTPException(status_code=422, detail=f"states[{bad}] must have {iql_selector.state_dim} floats")
+        work = lambda chunk: iql_selector.predict_states(np.asarray(chunk, dtype=np.float32))
+        items = req.states
+    
+    # Same single worker thread as the micro-batcher, so the models are never used concurrently.
+    # One job per chunk: the executor is FIFO, so pending `/` batches are served between chunks
+    loop = asyncio.get_running_loop()
+    t0 = time.perf_counter()
+    results = []
+    for start in range(0, len(items), PREDICT_BATCH_SIZE):
+        chunk = items[start:start + PREDICT_BATCH_SIZE]
+        results.extend(await loop.run_in_executor(batcher.executor, work, chunk))
+    return {
+        "results": [{"policy": p, "q_values": q} for p, q in results],
+        "count": len(results),
+        "compute_ms": round((time.perf_counter() - t0) * 1000.0, 2),
+    }
+
 @app.get("/health")
 async def health():
-    return {"status": "ok", "model_loaded": iql_selector is not None}
+    return {
+        "status": "ok",
+        "model_loaded": iql_selector is not None,
+        "runtime": iql_selector.runtime if iql_selector else IQL_RUNTIME,
+        "queue_depth": batcher.queue.qsize() if batcher else 0,
+        "predict_batch_max_items": PREDICT_BATCH_MAX_ITEMS,
+        "predict_batch_chunk": PREDICT_BATCH_SIZE,
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Micro-batcher metrics: batch sizes, queue wait and compute latency"""
+    return {
+        "max_batch_size": BATCH_MAX_SIZE,
+        "max_wait_ms": BATCH_MAX_WAIT_MS,
+        "encode_batch_size": ENCODE_BATCH_SIZE,
+        "queue_depth": batcher.queue.qsize() if batcher else 0,
+        **(batcher.metrics.snapshot() if batcher else {}),
+    }
 
 # ============================================================================
 # Embedding API
@@ -165,15 +481,16 @@ async def embed_texts(req: EmbedRequest):
     """
     if not iql_selector:
         return {"embeddings": [], "dimension": 384}
+
+    if len(req.texts) > EMBED_MAX_TEXTS:
+        raise HTTPException(status_code=413, detail=f"{len(req.texts)} texts exceeds EMBED_MAX_TEXTS={EMBED_MAX_TEXTS}")
+    too_long = next((i for i, t in enumerate(req.texts) if len(t) > EMBED_MAX_CHARS), None)
+    if too_long is not None:
+        raise HTTPException(status_code=413, detail=f"texts[{too_long}] exceeds {EMBED_MAX_CHARS} chars")
     
     try:
-        # Use the already-loaded sentence-transformers model
-        embeddings = iql_selector.embed_model.encode(
-            req.texts,
-            convert_to_numpy=True,
-            normalize_embeddings=req.normalize,
-            show_progress_bar=False
-        )
+        # Batched with concurrent predict/embed requests on the worker thread
+        embeddings = await batcher.submit("embed", req.texts, req.normalize)
         
         # Convert to list for JSON serialization
         embeddings_list = embeddings.tolist()
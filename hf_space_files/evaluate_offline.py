@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Offline evaluation of the IQL policy selector over the IQL dataset
+
+Scores every dataset state against every policy with each inference backend
+and reports, without running any live chat:
+  • action agreement of each backend with the fp32 reference (and with the
+    action logged in the dataset)
+  • Q-value statistics per resident (mean/std of the chosen Q, margin to the
+    runner-up, mean Q per policy, chosen-policy distribution)
+  • throughput (states/sec) and latency per backend
+
+Backends:
+  fp32_single    fp32 Q-network, one forward per stored state vector (per-call Q-network
+                 overhead only; no text encoding)
+  fp32_batched   fp32 Q-network, --batch-size states per forward (reference)
+  int8_batched   dynamic int8 Q-network as served: --batch-size states per call, each scored in its
+                 own forward so results are batch-invariant (the encoder is not loaded; states are precomputed)
+  remote         a running Space (--space-url); sends state_text (one request per state, or
+                 --remote-batch-size states per /predict_batch call), so it is compared
+                 against the local fp32 encode + Q pipeline on the same text
+
+The state vectors come from the binary dataset store (iql_dataset_store.py),
+converted from iql_dataset.jsonl on first use.
+
+Usage:
+  python evaluate_offline.py
+  python evaluate_offline.py --backends fp32_batched int8_batched --batch-size 512
+  python evaluate_offline.py --space-url http://localhost:7860 --remote-concurrency 8 --report eval.json
+  python evaluate_offline.py --space-url http://localhost:7860 --remote-batch-size 1000
+"""
+
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from app import IQLSelector, parse_state_text
+
+BASE = Path(__file__).resolve().parent
+BACKEND_DIR = BASE.parent / "a2i2_chatbot" / "backend"
+DEFAULT_DATASET = BACKEND_DIR / "iql" / "iql_dataset.jsonl"
+
+sys.path.insert(0, str(BACKEND_DIR))
+from iql_dataset_store import load_or_convert  # noqa: E402
+
+LOCAL_BACKENDS = ("fp32_single", "fp32_batched", "int8_batched")
+
+
+# ============================================================================
+# Backends: each returns a (N, num_actions) Q matrix plus timing
+# ============================================================================
+
+def run_local(selector: IQLSelector, states: np.ndarray, batch_size: int) -> Dict[str, object]:
+    latencies = []
+    chunks = []
+    t0 = time.perf_counter()
+    for start in range(0, len(states), batch_size):
+        t = time.perf_counter()
+        chunks.append(selector.q_rows(states[start:start + batch_size]))  # served path
+        latencies.append((time.perf_counter() - t) * 1000.0)
+    return {"q": np.concatenate(chunks), "seconds": time.perf_counter() - t0, "call_ms": latencies}
+
+
+def run_remote(space_url: str, texts: List[str], policies: List[str], concurrency: int,
+               batch_size: int = 0) -> Dict[str, object]:
+    """One `/` request per state, or chunks of batch_size states per `/predict_batch` request"""
+    import requests
+
+    session = requests.Session()
+    base = space_url.rstrip("/")
+
+    def call(text):
+        t = time.perf_counter()
+        r = session.post(f"{base}/", json={"inputs": text or "START"}, timeout=60)
+        r.raise_for_status()
+        q = r.json()["q_values"]
+        return [[q.get(p, float("nan")) for p in policies]], (time.perf_counter() - t) * 1000.0
+
+    def call_batch(chunk):
+        t = time.perf_counter()
+        r = session.post(f"{base}/predict_batch", json={"inputs": [c or "START" for c in chunk]}, timeout=300)
+        r.raise_for_status()
+        rows = [[res["q_values"].get(p, float("nan")) for p in policies] for res in r.json()["results"]]
+        return rows, (time.perf_counter() - t) * 1000.0
+
+    if batch_size > 0:
+        fn, items = call_batch, [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    else:
+        fn, items = call, texts
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(fn, items))
+    return {
+        "q": np.asarray([row for rows, _ in results for row in rows], dtype=np.float32),
+        "seconds": time.perf_counter() - t0,
+        "call_ms": [ms for _, ms in results],
+    }
+
+
+# ============================================================================
+# Reporting
+# ============================================================================
+
+def _percentile(values, pct):
+    return round(float(np.percentile(values, pct)), 3) if len(values) else None
+
+
+def backend_summary(result: Dict[str, object], reference_q: np.ndarray, logged_actions: np.ndarray) -> dict:
+    q = result["q"]
+    chosen = q.argmax(axis=1)
+    n = len(q)
+    return {
+        "states": n,
+        "seconds": round(result["seconds"], 4),
+        "states_per_sec": round(n / result["seconds"], 1) if result["seconds"] > 0 else None,
+        "calls": len(result["call_ms"]),
+        "call_ms_p50": _percentile(result["call_ms"], 50),
+        "call_ms_p95": _percentile(result["call_ms"], 95),
+        "agreement_with_reference": round(float(np.mean(chosen == reference_q.argmax(axis=1))), 4),
+        "agreement_with_logged_action": round(float(np.mean(chosen == logged_actions)), 4),
+        "max_abs_q_diff": round(float(np.max(np.abs(q - reference_q))), 6),
+    }
+
+
+def per_resident_stats(q: np.ndarray, residents: List[str], policies: List[str]) -> Dict[str, dict]:
+    chosen = q.argmax(axis=1)
+    sorted_q = np.sort(q, axis=1)
+    margin = sorted_q[:, -1] - sorted_q[:, -2] if q.shape[1] > 1 else sorted_q[:, -1]
+    residents_arr = np.asarray(residents)
+    stats = {}
+    for resident in sorted(set(residents)):
+        mask = residents_arr == resident
+        best = sorted_q[mask, -1]
+        counts = np.bincount(chosen[mask], minlength=len(policies))
+        stats[resident] = {
+            "states": int(mask.sum()),
+            "chosen_q_mean": round(float(best.mean()), 4),
+            "chosen_q_std": round(float(best.std()), 4),
+            "margin_mean": round(float(margin[mask].mean()), 4),
+            "margin_min": round(float(margin[mask].min()), 4),
+            "q_mean_by_policy": {p: round(float(q[mask, i].mean()), 4) for i, p in enumerate(policies)},
+            "chosen_policy": {p: int(c) for p, c in zip(policies, counts) if c},
+        }
+    return stats
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline IQL selector evaluation: agreement, Q stats and throughput.")
+    ap.add_argument("--dataset", type=Path, default=DEFAULT_DATASET)
+    ap.add_argument("--model", type=Path, default=BASE / "iql_model_embed.pt")
+    ap.add_argument("--label-map", type=Path, default=BASE / "label_map.json")
+    ap.add_argument("--backends", nargs="+", default=list(LOCAL_BACKENDS),
+                    choices=list(LOCAL_BACKENDS) + ["remote"])
+    ap.add_argument("--batch-size", type=int, default=256)
+    ap.add_argument("--limit", type=int, default=0, help="Only evaluate the first N states (0 = all)")
+    ap.add_argument("--space-url", default=None, help="Space base URL for the remote backend")
+    ap.add_argument("--remote-concurrency", type=int, default=4)
+    ap.add_argument("--remote-batch-size", type=int, default=0,
+                    help="States per /predict_batch request (0 = one / request per state)")
+    ap.add_argument("--report", type=Path, default=None, help="Optional path to write the JSON report")
+    args = ap.parse_args()
+
+    backends = list(args.backends)
+    if args.space_url and "remote" not in backends:
+        backends.append("remote")
+    if "remote" in backends and not args.space_url:
+        ap.error("--space-url is required for the remote backend")
+
+    label_map = json.loads(args.label_map.read_text())
+    policies = [k for k, _ in sorted(label_map.items(), key=lambda x: x[1])]
+
+    t0 = time.perf_counter()
+    store = load_or_convert(args.dataset)
+    n = min(len(store), args.limit) if args.limit else len(store)
+    states = np.ascontiguousarray(store.states[:n], dtype=np.float32)
+    texts = store.state_text[:n]
+    residents = store.resident[:n]
+    logged = store.action_id[:n]
+    print(f"[EVAL] {n} states (dim={store.dim}) loaded in {(time.perf_counter() - t0) * 1000:.1f}ms")
+
+    # Only the remote comparison encodes text; the local backends score stored state vectors
+    fp32 = IQLSelector(args.model, policies, runtime="fp32", load_encoder="remote" in backends)
+    # int8 only scores stored state vectors, so it does not need its own encoder
+    int8 = IQLSelector(args.model, policies, runtime="int8", load_encoder=False) if "int8_batched" in backends else None
+
+    # Warm up so timings exclude one-off allocations
+    fp32.q_matrix(states[:8])
+    if int8 is not None:
+        int8.q_matrix(states[:8])
+
+    reference = run_local(fp32, states, args.batch_size)
+    results = {}
+    for name in backends:
+        print(f"[EVAL] Running {name}...")
+        if name == "fp32_single":
+            results[name] = run_local(fp32, states, 1)
+        elif name == "fp32_batched":
+            results[name] = reference
+        elif name == "int8_batched":
+            results[name] = run_local(int8, states, args.batch_size)
+
+    report = {
+        "num_states": n,
+        "policies": policies,
+        "batch_size": args.batch_size,
+        "backends": {name: backend_summary(r, reference["q"], logged) for name, r in results.items()},
+        "per_resident": per_resident_stats(reference["q"], residents, policies),
+    }
+
+    if "remote" in backends:
+        # The Space re-encodes state_text, so its reference is the local fp32 encode + Q pipeline
+        # States built by the Space's own parse_state_text() / states_from_texts()
+        pipeline_q = fp32.q_rows(fp32.states_from_texts([parse_state_text(t) for t in texts]))
+        remote = run_remote(args.space_url, texts, policies, args.remote_concurrency, args.remote_batch_size)
+        report["backends"]["remote"] = backend_summary(remote, pipeline_q, logged)
+        report["backends"]["remote"]["agreement_with_stored_state_reference"] = round(
+            float(np.mean(remote["q"].argmax(axis=1) == reference["q"].argmax(axis=1))), 4)
+
+    print(json.dumps(report, indent=2))
+    if args.report:
+        args.report.write_text(json.dumps(report, indent=2))
+        print(f"[EVAL] Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
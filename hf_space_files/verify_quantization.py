@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Accuracy check for the int8 Space runtime (run before deploying IQL_RUNTIME=int8)
+
+Compares the int8 runtime against the fp32 weights on the IQL dataset:
+  • cosine agreement of sentence embeddings for every message the Space encodes
+  • argmax policy agreement of the full pipeline, built like the served selector:
+    state_text -> parse_state_text() -> states_from_texts() (mean of per-message
+    embeddings) -> Q-network
+  • argmax policy agreement of the Q-network alone on the stored state vectors
+  • batch invariance of the served int8 path: each state scored alone vs inside a
+    shuffled batch of other states must give the same Q-values (dynamic int8 takes
+    its activation scales from the whole forward input; the shared-pass drift that
+    serving avoids is reported alongside)
+and reports CPU encode/Q timings for both runtimes.
+
+Exits with status 1 if any agreement is below its threshold.
+
+Usage:
+  python verify_quantization.py
+  python verify_quantization.py --dataset ../a2i2_chatbot/backend/iql/iql_dataset.jsonl --min-cosine 0.98
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from app import IQLSelector, parse_state_text
+
+BASE = Path(__file__).resolve().parent
+DEFAULT_DATASET = BASE.parent / "a2i2_chatbot" / "backend" / "iql" / "iql_dataset.jsonl"
+
+
+def load_dataset(path: Path, limit: int = 0):
+    rows = []
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            rows.append(json.loads(line))
+            if limit and len(rows) >= limit:
+                break
+    return rows
+
+
+def encode(selector: IQLSelector, texts, batch_size: int):
+    t0 = time.perf_counter()
+    embs = selector.embed_model.encode(
+        texts,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+        batch_size=batch_size,
+    ).astype(np.float32)
+    return embs, time.perf_counter() - t0
+
+
+def pipeline_states(selector: IQLSelector, message_lists):
+    """State vectors exactly as the Space builds them for `/` and /predict_batch"""
+    t0 = time.perf_counter()
+    states = selector.states_from_texts(message_lists)
+    return states, time.perf_counter() - t0
+
+
+def q_argmax(selector: IQLSelector, states: np.ndarray):
+    t0 = time.perf_counter()
+    q = selector.q_rows(states)  # as served (per state in int8 mode)
+    return q.argmax(axis=1), time.perf_counter() - t0
+
+
+def batch_invariance(selector: IQLSelector, message_lists, sample: int, seed: int = 0) -> dict:
+    """Max |Q| difference between scoring each state alone and inside a shuffled batch"""
+    lists = message_lists[:sample]
+    if not lists:
+        return {"states": 0, "served_max_abs_diff": 0.0, "shared_pass_max_abs_diff": 0.0}
+    alone_states = np.concatenate([selector.states_from_texts([ml]) for ml in lists])
+    alone = np.concatenate([selector.q_rows(alone_states[i:i + 1]) for i in range(len(lists))])
+
+    order = np.random.default_rng(seed).permutation(len(lists))
+    batched_states = selector.states_from_texts([lists[i] for i in order])
+    served = np.empty_like(alone)
+    served[order] = selector.q_rows(batched_states)
+    shared = np.empty_like(alone)
+    shared[order] = selector.q_matrix(batched_states)  # one forward for the whole batch
+    return {
+        "states": len(lists),
+        "served_max_abs_diff": float(np.abs(served - alone).max()),
+        "served_argmax_agreement": float(np.mean(served.argmax(axis=1) == alone.argmax(axis=1))),
+        "shared_pass_max_abs_diff": float(np.abs(shared - alone).max()),
+        "shared_pass_argmax_agreement": float(np.mean(shared.argmax(axis=1) == alone.argmax(axis=1))),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Validate the int8 runtime against fp32 on the IQL dataset.")
+    ap.add_argument("--dataset", type=Path, default=DEFAULT_DATASET)
+    ap.add_argument("--model", type=Path, default=BASE / "iql_model_embed.pt")
+    ap.add_argument("--label-map", type=Path, default=BASE / "label_map.json")
+    ap.add_argument("--limit", type=int, default=0, help="Only check the first N states (0 = all)")
+    ap.add_argument("--batch-size", type=int, default=64)
+    ap.add_argument("--min-cosine", type=float, default=0.98,
+                    help="Minimum mean cosine between fp32 and int8 embeddings")
+    ap.add_argument("--min-policy-agreement", type=float, default=0.95,
+                    help="Minimum fraction of states where int8 picks the same policy as fp32")
+    ap.add_argument("--invariance-sample", type=int, default=256,
+                    help="States used for the batch-invariance check")
+    ap.add_argument("--max-batch-drift", type=float, default=1e-6,
+                    help="Maximum |Q| difference between a state served alone and inside a batch")
+    ap.add_argument("--report", type=Path, default=None, help="Optional path to write the JSON report")
+    args = ap.parse_args()
+
+    label_map = json.loads(args.label_map.read_text())
+    policies = [k for k, _ in sorted(label_map.items(), key=lambda x: x[1])]
+
+    rows = load_dataset(args.dataset, args.limit)
+    message_lists = [parse_state_text(r["state_text"]) for r in rows]
+    messages = [m for ms in message_lists for m in ms]
+    stored_states = np.asarray([r["state_vec"] for r in rows], dtype=np.float32)
+    print(f"[VERIFY] {len(rows)} states from {args.dataset}")
+
+    fp32 = IQLSelector(args.model, policies, runtime="fp32")
+    int8 = IQLSelector(args.model, policies, runtime="int8")
+
+    # Warm both runtimes so the timings exclude one-off allocation costs
+    encode(fp32, messages[:8], args.batch_size)
+    encode(int8, messages[:8], args.batch_size)
+
+    emb_fp32, _ = encode(fp32, messages, args.batch_size)
+    emb_int8, _ = encode(int8, messages, args.batch_size)
+    cosine = np.sum(emb_fp32 * emb_int8, axis=1)  # both unit-normalized
+
+    states_fp32, t_enc_fp32 = pipeline_states(fp32, message_lists)
+    states_int8, t_enc_int8 = pipeline_states(int8, message_lists)
+    pipe_fp32, t_q_fp32 = q_argmax(fp32, states_fp32)
+    pipe_int8, t_q_int8 = q_argmax(int8, states_int8)
+    pipeline_agreement = float(np.mean(pipe_fp32 == pipe_int8))
+
+    stored_fp32, _ = q_argmax(fp32, stored_states)
+    stored_int8, _ = q_argmax(int8, stored_states)
+    qnet_agreement = float(np.mean(stored_fp32 == stored_int8))
+
+    invariance = batch_invariance(int8, message_lists, args.invariance_sample)
+
+    report = {
+        "num_states": len(rows),
+        "num_messages": len(messages),
+        "cosine_mean": float(cosine.mean()),
+        "cosine_min": float(cosine.min()),
+        "pipeline_policy_agreement": pipeline_agreement,
+        "qnet_policy_agreement": qnet_agreement,
+        "int8_batch_invariance": invariance,
+        "encode_seconds": {"fp32": round(t_enc_fp32, 4), "int8": round(t_enc_int8, 4)},
+        "q_seconds": {"fp32": round(t_q_fp32, 4), "int8": round(t_q_int8, 4)},
+        "encode_speedup": round(t_enc_fp32 / t_enc_int8, 2) if t_enc_int8 > 0 else None,
+        "thresholds": {"min_cosine": args.min_cosine, "min_policy_agreement": args.min_policy_agreement,
+                       "max_batch_drift": args.max_batch_drift},
+    }
+    report["passed"] = (
+        report["cosine_mean"] >= args.min_cosine
+        and pipeline_agreement >= args.min_policy_agreement
+        and qnet_agreement >= args.min_policy_agreement
+        and invariance["served_max_abs_diff"] <= args.max_batch_drift
+    )
+
+    print(json.dumps(report, indent=2))
+    if args.report:
+        args.report.write_text(json.dumps(report, indent=2))
+        print(f"[VERIFY] Report written to {args.report}")
+
+    if not report["passed"]:
+        print("[VERIFY] FAILED: keep IQL_RUNTIME=fp32 for this model")
+        sys.exit(1)
+    print("[VERIFY] PASSED: int8 runtime is safe to serve")
+
+
+if __name__ == "__main__":
+    main()